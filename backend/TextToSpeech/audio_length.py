@@ -0,0 +1,52 @@
+import wave
+
+
+# ========== MP3 frame 標頭 ==========
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],   # MPEG-1 Layer III
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],       # MPEG-2 / 2.5 Layer III
+}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+
+
+def mp3_duration(path):
+    """只讀 MP3 frame 標頭計算長度 (不需解碼)。無法解析時回傳 None。"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    total = 0.0
+    frames = 0
+    while pos + 4 <= len(data):
+        header = int.from_bytes(data[pos:pos + 4], "big")
+        if (header >> 21) & 0x7FF != 0x7FF:
+            pos += 1
+            continue
+        version_bits = (header >> 19) & 0x3
+        layer_bits = (header >> 17) & 0x3
+        bitrate_idx = (header >> 12) & 0xF
+        sr_idx = (header >> 10) & 0x3
+        padding = (header >> 9) & 0x1
+        if version_bits == 1 or layer_bits != 1 or bitrate_idx in (0, 15) or sr_idx == 3:
+            pos += 1
+            continue
+        version = {3: 1, 2: 2, 0: 25}[version_bits]
+        bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_idx] * 1000
+        sample_rate = MP3_SAMPLE_RATES[version][sr_idx]
+        samples = 1152 if version == 1 else 576
+        frame_len = (samples // 8) * bitrate // sample_rate + padding
+        total += samples / sample_rate
+        frames += 1
+        pos += frame_len
+    return total if frames else None
+
+
+def audio_duration(path):
+    if path.endswith(".wav"):
+        with wave.open(path, "rb") as wf:
+            return wf.getnframes() / wf.getframerate()
+    return mp3_duration(path)
@@ -1,23 +1,97 @@
 import os
+import sys
 import json
 import re
+import io
+import time
+import wave
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import texttospeech
-import hashlib
+from google.cloud import texttospeech_v1beta1
+import imageio_ffmpeg
+
+# 全域內容定址音檔快取 (見 tts_cache.py)
+from tts_cache import TTSCache, cache_key
+# 音檔長度量測 (只讀標頭，見 audio_length.py)
+from audio_length import audio_duration
 
 # ========== 憑證載入、設定 ==========
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 錄製 / 重播卡帶 (見 backend/replay/cassette.py)
+sys.path.append(os.path.join(os.path.dirname(PROJECT_ROOT), "replay"))
+from cassette import get_cassette
+
 cred_path = os.path.join(os.path.dirname(PROJECT_ROOT), "credentials", "ai-anchor-462506-7887b7105f6a.json")
-assert os.path.exists(cred_path), f"❌ 憑證不存在: {cred_path}"
+# replay 模式完全離線，不需要憑證
+if not get_cassette().is_replay:
+    assert os.path.exists(cred_path), f"❌ 憑證不存在: {cred_path}"
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
 
+# TTS client 延遲建立：replay 模式下完全不會建立連線
+client = None
+beta_client = None
+_client_lock = threading.Lock()
 
-client = texttospeech.TextToSpeechClient()
+def get_client():
+    global client
+    with _client_lock:
+        if client is None:
+            client = texttospeech.TextToSpeechClient()
+        return client
+
+def get_beta_client():
+    # 整段合成需要 timepoints (<mark> 時間點)，目前只有 v1beta1 提供
+    global beta_client
+    with _client_lock:
+        if beta_client is None:
+            beta_client = texttospeech_v1beta1.TextToSpeechClient()
+        return beta_client
 
 # ========== 參數設定 ==========
 # 全域預設語速 (當 JSON 裡沒有 speed 時的備案)
 # 體育解說通常比朗讀快，建議設 1.2 左右
 GLOBAL_DEFAULT_RATE = 1.2
 
+DEFAULT_VOICE = "cmn-TW-Wavenet-A"
+# 輸出格式：
+#   "mp3" -> 預設，與過去相同
+#   "wav" -> LINEAR16 原始 PCM，直接以最終混音取樣率輸出；merge 以記憶體映射讀取，
+#            省去每句一次 mp3 編碼與一次解碼
+TTS_AUDIO_FORMAT = "mp3"
+MIX_SAMPLE_RATE = 44100        # 與 merge_audio/pcm_audio.py 的 MIX_SAMPLE_RATE 一致
+AUDIO_EXT = "wav" if TTS_AUDIO_FORMAT == "wav" else "mp3"
+# 每個片段資料夾的索引檔 (merge_audio 以此查找音檔)
+MANIFEST_NAME = "manifest.json"
+
+# 影響音檔內容的音訊設定 (一併納入快取鍵)
+if TTS_AUDIO_FORMAT == "wav":
+    AUDIO_CONFIG = {"audio_encoding": "LINEAR16", "sample_rate_hertz": MIX_SAMPLE_RATE}
+else:
+    AUDIO_CONFIG = {"audio_encoding": "MP3"}
+
+# 整段單次合成：一個片段組成一份 SSML，每句前放一個 <mark>，
+# 只呼叫一次 TTS，再依 mark 時間點在本地切回逐句 mp3
+# 切出的音檔含句間停頓、與逐句合成不完全相同 (快取鍵也不同)，預設關閉，需要時再開啟
+TTS_BATCH_MODE = False
+SSML_MAX_BYTES = 5000          # Google TTS 單次請求的輸入上限
+BATCH_SAMPLE_RATE = 24000      # 整段合成以 LINEAR16 取回，方便精準切割
+# 整段合成的句子是 LINEAR16 切片再轉檔 (含句間停頓)，與逐句合成的音檔不同，快取鍵另外區分
+BATCH_AUDIO_CONFIG = dict(AUDIO_CONFIG, batch=True,
+                          batch_sample_rate=MIX_SAMPLE_RATE if AUDIO_EXT == "wav" else BATCH_SAMPLE_RATE)
+
+# 時長回饋：合成後立即量測實際長度，超出 Stage 2 排定的時段就提高語速重新合成
+SLOT_TOLERANCE = 0.1           # 允許超出時段的秒數 (與 merge_audio 的截斷容忍度一致)
+MAX_TTS_RATE = 2.0
+MAX_RESYNTH_ATTEMPTS = 2
+RESYNTH_MARGIN = 1.03          # 修正語速時多留一點餘裕
+
+# 並行合成：同時進行的 TTS 請求數，與每分鐘請求上限 (依專案配額調整)
+TTS_CONCURRENCY = 8
+TTS_REQUESTS_PER_MINUTE = 600
+
 # 情緒到語速(rate)和音量(volume_gain_db)的映射
 EMOTION_TTS_PARAMS = {
     "平穩": {"volume_gain_db": 0.0},
@@ -35,6 +109,26 @@ EMOTION_TTS_PARAMS = {
     "疑問": {"volume_gain_db": 1.5},   # 稍微提高音量以示疑問
 }
 
+class RateLimiter:
+    """每分鐘請求數上限：各執行緒依序領取發送時間點，間隔 60 / per_minute 秒。"""
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+rate_limiter = RateLimiter(TTS_REQUESTS_PER_MINUTE)
+tts_cache = TTSCache()
+
 def clean_emotion_tag(text):
     m = re.match(r"【(.+?)】(.*)", text)
     if m:
@@ -42,23 +136,21 @@ def clean_emotion_tag(text):
     else:
         return "平穩", text  # 沒標籤就當平穩
 
-def synthesize_sentence(sentence_text, emotion, output_path, custom_speed=None, voice="cmn-TW-Wavenet-A"):
-    # 1. 取得情緒參數 (只拿音量)
-    params = EMOTION_TTS_PARAMS.get(emotion, EMOTION_TTS_PARAMS["平穩"])
-    volume_db = params["volume_gain_db"]
-    
-    # 2. 決定語速 (Rate) - 徹底解耦邏輯
+def resolve_rate(custom_speed=None):
+    # 決定語速 (Rate) - 徹底解耦邏輯
     # 優先權：JSON 指定值 > 全域預設值
     if custom_speed is not None and float(custom_speed) > 0:
         raw_rate = float(custom_speed)
         # 加上安全限制 (0.75 ~ 2.0) 防止極端值
-        final_rate = max(0.75, min(raw_rate, 2.0))
-        # print(f"   ⚡ [Stage2控制] 語速: {final_rate}") 
-    else:
-        final_rate = GLOBAL_DEFAULT_RATE
-        # print(f"   ⚓ [全域預設] 語速: {final_rate}")
+        return max(0.75, min(raw_rate, 2.0))
+    return GLOBAL_DEFAULT_RATE
+
+def build_prosody(sentence_text, emotion, final_rate):
+    # 1. 取得情緒參數 (只拿音量)
+    params = EMOTION_TTS_PARAMS.get(emotion, EMOTION_TTS_PARAMS["平穩"])
+    volume_db = params["volume_gain_db"]
 
-    # 3. 動態停頓 (語速越快，標點停頓越短)
+    # 2. 動態停頓 (語速越快，標點停頓越短)
     pause_scale = 1.0 / max(final_rate, 0.8)
     
     ssml_text = sentence_text
@@ -67,8 +159,17 @@ def synthesize_sentence(sentence_text, emotion, output_path, custom_speed=None,
     ssml_text = ssml_text.replace("。", f"<break time='{int(400*pause_scale)}ms'/>")
     ssml_text = ssml_text.replace("！", f"<break time='{int(500*pause_scale)}ms'/>")
     
-    # 4. 組合 SSML (Rate 來自變數, Volume 來自情緒表)
-    ssml = f"<speak><prosody rate='{final_rate}' volume='{volume_db}dB'>{ssml_text}</prosody></speak>"
+    # 3. 組合 SSML (Rate 來自變數, Volume 來自情緒表)
+    return f"<prosody rate='{final_rate}' volume='{volume_db}dB'>{ssml_text}</prosody>"
+
+def build_ssml(sentence_text, emotion, final_rate):
+    return f"<speak>{build_prosody(sentence_text, emotion, final_rate)}</speak>"
+
+def synthesize_audio(sentence_text, emotion, custom_speed=None, voice=DEFAULT_VOICE):
+    """呼叫 TTS 並回傳音檔 bytes (失敗時拋出例外)。"""
+    final_rate = resolve_rate(custom_speed)
+    volume_db = EMOTION_TTS_PARAMS.get(emotion, EMOTION_TTS_PARAMS["平穩"])["volume_gain_db"]
+    ssml = build_ssml(sentence_text, emotion, final_rate)
 
     synthesis_input = texttospeech.SynthesisInput(ssml=ssml)
     voice_params = texttospeech.VoiceSelectionParams(
@@ -76,25 +177,181 @@ def synthesize_sentence(sentence_text, emotion, output_path, custom_speed=None,
         name=voice,
         ssml_gender=texttospeech.SsmlVoiceGender.FEMALE,
     )
-    audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=getattr(texttospeech.AudioEncoding, AUDIO_CONFIG["audio_encoding"]),
+        sample_rate_hertz=AUDIO_CONFIG.get("sample_rate_hertz", 0),
+    )
 
-    try:
-        response = client.synthesize_speech(
+    def _call():
+        rate_limiter.wait()
+        response = get_client().synthesize_speech(
             input=synthesis_input,
             voice=voice_params,
             audio_config=audio_config,
         )
+        return response.audio_content
+
+    # 經過卡帶層：record 模式錄下音檔與耗時，replay 模式直接讀回
+    request = {"ssml": ssml, "language_code": "cmn-TW", "voice": voice, **AUDIO_CONFIG}
+    audio_content = get_cassette().call("tts", request, _call)
+
+    # Log 顯示現在的狀況
+    print(f"✅ 生成: {emotion} | 🔊 {volume_db}dB | ⏩ x{final_rate}")
+    return audio_content
+
+def synthesize_sentence(sentence_text, emotion, output_path, custom_speed=None, voice=DEFAULT_VOICE):
+    try:
+        audio_content = synthesize_audio(sentence_text, emotion, custom_speed=custom_speed, voice=voice)
         with open(output_path, "wb") as f:
-            f.write(response.audio_content)
-        
-        # Log 顯示現在的狀況
-        print(f"✅ 生成: {emotion} | 🔊 {volume_db}dB | ⏩ x{final_rate}")
+            f.write(audio_content)
         return {"status": "success", "output": output_path, "emotion": emotion}
     except Exception as e:
         print(f"❌ 生成失敗: {e}")
         return {"status": "error", "message": str(e), "output": output_path}
 
-def process_segment_json(json_path, output_base_dir):
+def build_batch_ssml(lines):
+    """lines: [(text, emotion, speed)] -> 每句前一個 <mark name='L{i}'/>，最後一個 END。"""
+    parts = [f"<mark name='L{i}'/>{build_prosody(text, emotion, resolve_rate(speed))}" for i, (text, emotion, speed) in enumerate(lines)]
+    return "<speak>" + "".join(parts) + "<mark name='END'/></speak>"
+
+def encode_mp3(pcm_bytes, sample_rate, channels=1):
+    """把 16-bit PCM 以 ffmpeg 編成 mp3 (與逐句模式相同的輸出格式)。"""
+    cmd = [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-v", "error",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        "-codec:a", "libmp3lame", "-b:a", "64k", "-f", "mp3", "pipe:1",
+    ]
+    proc = subprocess.run(cmd, input=pcm_bytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return proc.stdout
+
+def encode_wav(pcm_bytes, sample_rate, channels=1):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm_bytes)
+    return buf.getvalue()
+
+def synthesize_batch(lines, voice=DEFAULT_VOICE):
+    """
+    整段單次合成：一次 TTS 請求取回所有句子，依 <mark> 時間點切回逐句音檔。
+    回傳與 lines 同順序的音檔 bytes 列表 (mark 缺漏時拋出例外，由呼叫端退回逐句模式)。
+    """
+    ssml = build_batch_ssml(lines)
+    # wav 輸出直接以混音取樣率取回，切割後不需再轉檔
+    batch_rate = BATCH_AUDIO_CONFIG["batch_sample_rate"]
+    tts = texttospeech_v1beta1
+
+    def _call():
+        rate_limiter.wait()
+        response = get_beta_client().synthesize_speech(
+            input=tts.SynthesisInput(ssml=ssml),
+            voice=tts.VoiceSelectionParams(language_code="cmn-TW", name=voice, ssml_gender=tts.SsmlVoiceGender.FEMALE),
+            audio_config=tts.AudioConfig(audio_encoding=tts.AudioEncoding.LINEAR16, sample_rate_hertz=batch_rate),
+            enable_time_pointing=[tts.SynthesizeSpeechRequest.TimepointType.SSML_MARK],
+        )
+        return {
+            "audio_content": response.audio_content,
+            "timepoints": [[tp.mark_name, tp.time_seconds] for tp in response.timepoints],
+        }
+
+    request = {"ssml": ssml, "language_code": "cmn-TW", "voice": voice, "audio_encoding": "LINEAR16",
+               "sample_rate_hertz": batch_rate, "time_pointing": "SSML_MARK"}
+    result = get_cassette().call("tts_batch", request, _call)
+
+    # LINEAR16 回傳的是含 WAV 標頭的 PCM
+    with wave.open(io.BytesIO(result["audio_content"]), "rb") as wf:
+        sample_rate = wf.getframerate()
+        channels = wf.getnchannels()
+        frame_bytes = wf.getsampwidth() * channels
+        pcm = wf.readframes(wf.getnframes())
+    total_frames = len(pcm) // frame_bytes
+
+    marks = dict(result["timepoints"])
+    missing = [f"L{i}" for i in range(len(lines)) if f"L{i}" not in marks]
+    if missing:
+        raise ValueError(f"TTS 回傳缺少 mark：{missing}")
+    bounds = [marks[f"L{i}"] for i in range(len(lines))] + [marks.get("END", total_frames / sample_rate)]
+
+    outputs = []
+    for i in range(len(lines)):
+        start = min(int(round(bounds[i] * sample_rate)), total_frames)
+        end = min(int(round(bounds[i + 1] * sample_rate)), total_frames)
+        chunk = pcm[start * frame_bytes:end * frame_bytes]
+        outputs.append(encode_wav(chunk, sample_rate, channels) if AUDIO_EXT == "wav" else encode_mp3(chunk, sample_rate, channels))
+
+    print(f"✅ 整段合成: {len(lines)} 句 / 1 次請求 | 🕒 {total_frames / sample_rate:.1f}s")
+    return outputs
+
+def split_batches(jobs):
+    """依 SSML 位元組上限把要合成的句子切成數批。"""
+    batches, current = [], []
+    for job in jobs:
+        candidate = current + [job]
+        ssml = build_batch_ssml([(j["text"], j["emotion"], j["speed"]) for j in candidate])
+        if current and len(ssml.encode("utf-8")) > SSML_MAX_BYTES:
+            batches.append(current)
+            current = [job]
+        else:
+            current = candidate
+    if current:
+        batches.append(current)
+    return batches
+
+# ========== 時長量測 ==========
+def line_duration(key, path):
+    """實際音檔長度；量過的長度存在快取索引，命中時不必再讀檔。"""
+    duration = tts_cache.get_meta(key).get("duration")
+    if duration is None:
+        duration = audio_duration(path)
+        if duration is not None:
+            tts_cache.set_meta(key, duration=round(duration, 3))
+    return duration
+
+def time_str_to_seconds(time_str):
+    """將 H:MM:SS.f / MM:SS.f / SS.f 時間碼轉換為秒數。"""
+    try:
+        seconds = 0.0
+        for part in time_str.split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except (AttributeError, ValueError):
+        return None
+
+def corrected_speed(job, duration):
+    """超出時段時回傳修正後的語速，不需要 (或已到上限) 則回傳 None。"""
+    slot = job.get("slot")
+    if not slot or duration is None or duration <= slot + SLOT_TOLERANCE:
+        return None
+    rate = resolve_rate(job["speed"])
+    if rate >= MAX_TTS_RATE:
+        return None
+    return round(min(MAX_TTS_RATE, rate * duration / slot * RESYNTH_MARGIN), 2)
+
+def line_key(text, emotion, speed, voice):
+    # 以內容定址：相同 文本/情緒/語速/聲音/音訊設定 在任何片段、任何比賽都共用同一個音檔
+    return cache_key(text, emotion, resolve_rate(speed), voice, AUDIO_CONFIG)
+
+def batch_key(job):
+    return cache_key(job["text"], job["emotion"], resolve_rate(job["speed"]), job["voice"], BATCH_AUDIO_CONFIG)
+
+def with_speed(job, speed):
+    return dict(job, speed=speed, key=line_key(job["text"], job["emotion"], speed, job["voice"]))
+
+# ========== 片段處理 ==========
+def remove_stale_line_files(segment_dir, idx, keep_name):
+    """同一句換了情緒 (或輸出格式) 後，舊的 {idx}_{舊情緒}.mp3/.wav / 舊版 .hash 側檔一併清掉。"""
+    prefix = f"{idx+1:03d}_"
+    for f in os.listdir(segment_dir):
+        if f.startswith(prefix) and f != keep_name and f.endswith((".mp3", ".wav", ".hash")):
+            os.remove(os.path.join(segment_dir, f))
+
+def plan_segment_jobs(json_path, output_base_dir, voice=DEFAULT_VOICE):
+    """
+    依序決定這個片段每一句的輸出檔、快取鍵與可用時段。
+    回傳 (segment_name, jobs, warning)；jobs 依旁白順序排列，可交給執行緒池並行處理。
+    """
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
@@ -105,75 +362,251 @@ def process_segment_json(json_path, output_base_dir):
     if not commentary:
         msg = f"⚠️ 空旁白，跳過：{segment_name}"
         print(msg)
-        return {"status": "warning", "message": msg, "segment": segment_name}
+        return segment_name, [], {"status": "warning", "message": msg, "segment": segment_name}
 
     segment_dir = os.path.join(output_base_dir, segment_name)
     os.makedirs(segment_dir, exist_ok=True)
 
-    results = []
-    seen_texts = set()
+    jobs = []
     for idx, item in enumerate(commentary):
         # <<<< 修正點：直接讀取獨立的 emotion 欄位 >>>>
         text = item["text"]
         emotion = item.get("emotion", "平穩") # 如果沒有 emotion 欄位，預設為平穩
-        speed_val = item.get("speed")
-
-        # 1. 計算當前文本的 SHA256 雜湊值
-        # 👇 修改：將 speed 也加入 hash 計算，確保速度變更時會重產
-        hash_content = f"{text}|{emotion}|{speed_val}"
-        text_hash = hashlib.sha256(hash_content.encode('utf-8')).hexdigest()
-        
-        # 2. 定義 MP3 檔案和伴隨的雜湊檔案路徑
-        out_path_mp3 = os.path.join(segment_dir, f"{idx+1:03d}_{emotion}.mp3")
-        out_path_hash = os.path.join(segment_dir, f"{idx+1:03d}_{emotion}.hash")
-
-        # 3. 檢查跳過條件 (只有 MP3 和 Hash 文件都存在且雜湊匹配時才跳過)
-        is_mp3_present = os.path.exists(out_path_mp3)
-        is_hash_present = os.path.exists(out_path_hash)
-
-        should_regenerate = True
-        
-        if is_mp3_present and is_hash_present:
-            with open(out_path_hash, 'r', encoding='utf-8') as hf:
-                stored_hash = hf.read().strip()
-            
-            if stored_hash == text_hash:
-                print(f"✅ 語音已存在且文本未修改，跳過生成：{out_path_mp3}")
-                should_regenerate = False
+        # 上次 TTS 已修正過語速就直接沿用 (Stage 2 重跑時整份 JSON 會被覆寫，tts_* 欄位自然消失)
+        speed_val = item.get("tts_speed", item.get("speed"))
+
+        # Stage 2 排定的時段 = 這句最多能講多久
+        start = time_str_to_seconds(item.get("start_time"))
+        end = time_str_to_seconds(item.get("end_time"))
+        slot = (end - start) if start is not None and end is not None and end > start else None
+
+        file_name = f"{idx+1:03d}_{emotion}.{AUDIO_EXT}"
+        remove_stale_line_files(segment_dir, idx, file_name)
+
+        jobs.append({
+            "index": idx,
+            "text": text,
+            "emotion": emotion,
+            "speed": speed_val,
+            "voice": voice,
+            "slot": slot,
+            "key": line_key(text, emotion, speed_val, voice),
+            "output_path": os.path.join(segment_dir, file_name),
+        })
+
+    return segment_name, jobs, None
+
+def line_result(job, cached):
+    return {
+        "status": "success",
+        "index": job["index"],
+        "output": job["output_path"],
+        "text": job["text"],
+        "emotion": job["emotion"],
+        "hash": job["key"],
+        "cached": cached,
+        "speed": job["speed"],
+        "rate": resolve_rate(job["speed"]),
+        "duration": line_duration(job["key"], job["output_path"]),
+    }
+
+def produce_line(job):
+    out_path = job["output_path"]
+
+    # 1. 片段內已經是同一個快取檔的連結 -> 完全不用動
+    cached_path = tts_cache.lookup(job["key"])
+    if cached_path and TTSCache.is_linked(cached_path, out_path):
+        print(f"✅ 語音已存在且文本未修改，跳過生成：{out_path}")
+        return line_result(job, cached=True)
+
+    # 2. 快取命中直接連結；否則合成一次存入快取 (同一句同時只會合成一次)
+    try:
+        cached_path, hit = tts_cache.get_or_create(
+            job["key"],
+            lambda: synthesize_audio(job["text"], job["emotion"], custom_speed=job["speed"], voice=job["voice"]),
+            ext=AUDIO_EXT,
+            meta={"text": job["text"], "emotion": job["emotion"], "rate": resolve_rate(job["speed"]), "voice": job["voice"]},
+        )
+        TTSCache.link_to(cached_path, out_path)
+    except Exception as e:
+        print(f"❌ 生成失敗: {e}")
+        return {"status": "error", "index": job["index"], "message": str(e), "output": out_path}
+
+    if hit:
+        print(f"♻️ 快取命中：{job['text']} -> {out_path}")
+    return line_result(job, cached=hit)
+
+def run_job(job):
+    """逐句模式：合成 -> 量測 -> 超出時段就以修正後的語速重新合成。"""
+    res = produce_line(job)
+    for _ in range(MAX_RESYNTH_ATTEMPTS):
+        if res["status"] != "success":
+            break
+        new_speed = corrected_speed(job, res["duration"])
+        if new_speed is None:
+            break
+        print(f"⏱️ 超出時段 {res['duration']:.2f}s > {job['slot']:.2f}s，語速 x{res['rate']} -> x{new_speed} 重新合成")
+        job = with_speed(job, new_speed)
+        res = produce_line(job)
+    return res
+
+def synthesize_segment_batch(jobs):
+    """
+    整段單次合成模式：快取命中的句子直接連結，其餘句子組成一份 SSML 一次合成。
+    整段合成失敗時退回逐句模式。回傳與 jobs 同順序的結果。
+    """
+    results = [None] * len(jobs)
+    misses = {}
+    # 整段合成的音檔以 batch_key 存取；退回逐句模式時仍用原本的 job (逐句快取鍵)
+    batch_jobs = [dict(job, key=batch_key(job)) for job in jobs]
+    for i, job in enumerate(batch_jobs):
+        cached_path = tts_cache.lookup(job["key"])
+        if cached_path:
+            if TTSCache.is_linked(cached_path, job["output_path"]):
+                print(f"✅ 語音已存在且文本未修改，跳過生成：{job['output_path']}")
             else:
-                print(f"⚠️ 文本已修改，需要重新生成語音：{out_path_mp3}")
-        
-        if not should_regenerate:
-            continue # 跳過 TTS API 呼叫
-
-        # 4. 原有的重複文本檢查 (防止同一 JSON 內重複生成)
-        if text in seen_texts:
-            print(f"⚠️ 重複旁白，跳過：{text}")
+                TTSCache.link_to(cached_path, job["output_path"])
+            results[i] = line_result(job, cached=True)
+        else:
+            # 同一段裡重複的句子只合成一次
+            misses.setdefault(job["key"], []).append(i)
+
+    unique_jobs = [batch_jobs[idxs[0]] for idxs in misses.values()]
+    for batch in split_batches(unique_jobs):
+        try:
+            audios = synthesize_batch([(j["text"], j["emotion"], j["speed"]) for j in batch], voice=batch[0]["voice"])
+        except Exception as e:
+            print(f"⚠️ 整段合成失敗，改為逐句合成：{e}")
+            for job in batch:
+                for i in misses[job["key"]]:
+                    results[i] = produce_line(jobs[i])
+            continue
+
+        for job, audio in zip(batch, audios):
+            # 經過鍵鎖寫入：其他片段同時合成了同一句 (例如固定的補白、結尾) 時沿用先寫入的那份
+            cached_path, hit = tts_cache.get_or_create(job["key"], lambda audio=audio: audio, ext=AUDIO_EXT, meta={
+                "text": job["text"], "emotion": job["emotion"], "rate": resolve_rate(job["speed"]), "voice": job["voice"],
+                "batch": True,
+            })
+            for n, i in enumerate(misses[job["key"]]):
+                TTSCache.link_to(cached_path, batch_jobs[i]["output_path"])
+                results[i] = line_result(batch_jobs[i], cached=hit or n > 0)
+    return results
+
+def run_segment_batch(jobs):
+    """整段模式：整段合成 -> 量測 -> 超出時段的句子以修正後的語速再整批合成一次。"""
+    jobs = list(jobs)
+    results = synthesize_segment_batch(jobs)
+    for _ in range(MAX_RESYNTH_ATTEMPTS):
+        retry = []
+        for i, (job, res) in enumerate(zip(jobs, results)):
+            if res["status"] != "success":
+                continue
+            new_speed = corrected_speed(job, res["duration"])
+            if new_speed is not None:
+                print(f"⏱️ 超出時段 {res['duration']:.2f}s > {job['slot']:.2f}s，語速 x{res['rate']} -> x{new_speed} 重新合成")
+                jobs[i] = with_speed(job, new_speed)
+                retry.append(i)
+        if not retry:
+            break
+        for i, res in zip(retry, synthesize_segment_batch([jobs[i] for i in retry])):
+            results[i] = res
+    return results
+
+def record_tts_results(json_path, results):
+    """把實際語速與量測長度寫回片段 JSON，merge 階段不必再解碼音檔就知道長度。"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    commentary = data.get("commentary", [])
+
+    for res in results:
+        if res["status"] != "success":
             continue
+        item = commentary[res["index"]]
+        item["tts_rate"] = res["rate"]
+        item["tts_duration"] = round(res["duration"], 3) if res["duration"] is not None else None
+        if res["speed"] != item.get("speed"):
+            item["tts_speed"] = res["speed"]
+        else:
+            item.pop("tts_speed", None)
+
+    tmp_path = f"{json_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, json_path)
+
+def write_segment_manifest(segment_dir, results):
+    """
+    片段索引 manifest.json：旁白序號 -> 音檔 / 實測長度 / 快取鍵。
+    merge 直接查表，不必掃描資料夾或依賴檔名規則。
+    """
+    lines = {}
+    for res in results:
+        if res["status"] != "success":
+            continue
+        lines[str(res["index"])] = {
+            "file": os.path.basename(res["output"]),
+            "text": res["text"],
+            "emotion": res["emotion"],
+            "duration": round(res["duration"], 3) if res["duration"] is not None else None,
+            "hash": res["hash"],
+        }
+
+    manifest_path = os.path.join(segment_dir, MANIFEST_NAME)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"segment": os.path.basename(segment_dir), "lines": lines}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
 
-        seen_texts.add(text)
-        
-        # 5. 執行語音生成 (如果文件不存在或雜湊不匹配)
-        res = synthesize_sentence(text, emotion, out_path_mp3, custom_speed=speed_val)
-        
-        # 6. 如果生成成功，儲存新的雜湊值到 .hash 檔案
-        if res['status'] == 'success':
-            with open(out_path_hash, 'w', encoding='utf-8') as hf:
-                hf.write(text_hash)
-            
-        results.append(res)
+def process_segment_json(json_path, output_base_dir, concurrency=TTS_CONCURRENCY):
+    segment_name, jobs, warning = plan_segment_jobs(json_path, output_base_dir)
+    if warning:
+        return warning
+
+    if TTS_BATCH_MODE:
+        results = run_segment_batch(jobs)
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            results = list(executor.map(run_job, jobs))
+    tts_cache.flush()
+    record_tts_results(json_path, results)
+    write_segment_manifest(os.path.join(output_base_dir, segment_name), results)
 
     return {"status": "success", "segment": segment_name, "results": results}
 
-def batch_process(input_json_folder, output_folder):
+def batch_process(input_json_folder, output_folder, concurrency=TTS_CONCURRENCY):
     os.makedirs(output_folder, exist_ok=True)
     json_files = [f for f in os.listdir(input_json_folder) if f.endswith(".json")]
 
+    # 先依序規劃所有片段，再把整場比賽的句子丟進同一個執行緒池，
+    # 片段之間也能重疊，不必等上一段最後一句回來
     all_results = []
-    for jf in sorted(json_files):
-        json_path = os.path.join(input_json_folder, jf)
-        res = process_segment_json(json_path, output_folder)
-        all_results.append(res)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        pending = []
+        for jf in sorted(json_files):
+            json_path = os.path.join(input_json_folder, jf)
+            segment_name, jobs, warning = plan_segment_jobs(json_path, output_folder)
+            if warning:
+                pending.append((json_path, segment_name, warning, None))
+            elif TTS_BATCH_MODE:
+                # 整段模式：一個片段就是一個工作 (一次請求)
+                pending.append((json_path, segment_name, None, executor.submit(run_segment_batch, jobs)))
+            else:
+                pending.append((json_path, segment_name, None, [executor.submit(run_job, job) for job in jobs]))
+
+        for json_path, segment_name, warning, futures in pending:
+            if warning:
+                all_results.append(warning)
+                continue
+            results = futures.result() if TTS_BATCH_MODE else [fu.result() for fu in futures]
+            record_tts_results(json_path, results)
+            write_segment_manifest(os.path.join(output_folder, segment_name), results)
+            all_results.append({"status": "success", "segment": segment_name, "results": results})
+    tts_cache.flush()
+
+    synthesized = sum(1 for d in all_results for r in d.get("results", []) if r["status"] == "success" and not r.get("cached"))
+    print(f"📦 TTS 快取：本次新合成 {synthesized} 句，快取大小 {tts_cache.total_bytes() / 1024 ** 2:.1f} MB")
 
     return {"status": "success", "processed_files": len(json_files), "details": all_results}
 
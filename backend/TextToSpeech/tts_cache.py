@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+# ========== 參數設定 ==========
+TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache")
+# 快取容量上限 (超過時依最久未使用 LRU 淘汰)
+TTS_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# 索引不在每次寫入時重寫 (整份 JSON，O(n))；累積這麼多次變更才寫一次，其餘由 flush() 寫出
+INDEX_FLUSH_EVERY = 100
+
+
+def cache_key(text, emotion, rate, voice, audio_config):
+    """以 文本 / 情緒 / 語速 / 聲音 / 音訊設定 計算內容定址的快取鍵。"""
+    payload = json.dumps(
+        {"text": text, "emotion": emotion, "rate": rate, "voice": voice, "audio_config": audio_config},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    全域 TTS 音檔快取 (跨片段、跨比賽共用)。
+    - 音檔存放在 objects/<鍵前兩碼>/<鍵>.<副檔名>
+    - index.json 記錄每個鍵的檔案、大小、最後使用時間與原始參數
+    - 片段資料夾內的音檔是快取檔的硬連結 (不支援時改為複製)
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._dirty = 0          # 上次寫出索引後的變更次數
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.entries = self._load_index()
+
+    # ---------- 索引 ----------
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("entries", {})
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 快取索引損毀，重新建立：{e}")
+            return {}
+        # 檔案被手動刪掉的項目直接丟棄
+        return {k: v for k, v in entries.items() if os.path.exists(os.path.join(self.directory, v["file"]))}
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = 0
+
+    def _mark_dirty(self):
+        """記錄一次變更 (呼叫端需持有 self._lock)；累積 INDEX_FLUSH_EVERY 次才寫出索引。"""
+        self._dirty += 1
+        if self._dirty >= INDEX_FLUSH_EVERY:
+            self._save_index()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(e["size"] for e in self.entries.values())
+
+    # ---------- 查詢 / 寫入 ----------
+    def lookup(self, key):
+        """回傳快取檔路徑 (並更新最後使用時間)，沒有則回傳 None。"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            path = os.path.join(self.directory, entry["file"])
+            if not os.path.exists(path):
+                del self.entries[key]
+                return None
+            entry["last_used"] = time.time()
+            self._mark_dirty()
+            return path
+
+    def get_meta(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            return dict(entry["meta"]) if entry else {}
+
+    def set_meta(self, key, **fields):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry:
+                entry["meta"].update(fields)
+                self._mark_dirty()
+
+    def store(self, key, audio_bytes, ext="mp3", meta=None):
+        rel_path = os.path.join("objects", key[:2], f"{key}.{ext}")
+        path = os.path.join(self.directory, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio_bytes)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            self.entries[key] = {
+                "file": rel_path,
+                "size": len(audio_bytes),
+                "created": now,
+                "last_used": now,
+                "meta": meta or {},
+            }
+            self._evict(keep=key)
+            self._mark_dirty()
+        return path
+
+    def get_or_create(self, key, producer, ext="mp3", meta=None):
+        """
+        命中則直接回傳；否則呼叫 producer() 取得音檔 bytes 後存入。
+        同一個鍵同時只會有一個執行緒在合成，其餘等待結果。
+        回傳 (快取檔路徑, 是否命中)。
+        """
+        path = self.lookup(key)
+        if path:
+            return path, True
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            path = self.lookup(key)
+            if path:
+                return path, True
+            return self.store(key, producer(), ext=ext, meta=meta), False
+
+    def _evict(self, keep=None):
+        """LRU 淘汰到容量上限以下 (呼叫端需持有 self._lock)。"""
+        total = sum(e["size"] for e in self.entries.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            total -= entry["size"]
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+
+    # ---------- 輸出 ----------
+    @staticmethod
+    def is_linked(cache_path, dest_path):
+        try:
+            return os.path.samefile(cache_path, dest_path)
+        except OSError:
+            return False
+
+    @staticmethod
+    def link_to(cache_path, dest_path):
+        """把快取檔以硬連結放到片段資料夾 (跨磁碟等不支援時改為複製)。"""
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(cache_path, dest_path)
+        except OSError:
+            shutil.copyfile(cache_path, dest_path)
+        return dest_path
@@ -0,0 +1,109 @@
+import sys
+import numpy as np
+from tracking_store import ACTION_NAMES, ACTION_CODES, load_tracking, landmark_tensor
+
+# ========== 參數設定 ==========
+# MediaPipe PoseLandmark 索引
+LEFT_SHOULDER, RIGHT_SHOULDER = 11, 12
+LEFT_WRIST, RIGHT_WRIST = 15, 16
+LEFT_HIP, RIGHT_HIP = 23, 24
+
+# 預設門檻 = detection.classify_badminton_action 的規則
+DEFAULT_THRESHOLDS = {
+    "smash_hip_diff": 0.1,   # 手高於肩時，左右髖高低差超過此值判為 Smash，否則 Drop Shot
+    "raise_margin": 0.0,     # 手腕需高於 / 低於肩膀超過此值才算上手 / 下手 (0 = 舊版規則)
+    "drive_band": 0.05,      # 介於上下手之間、且手腕與肩膀差距小於此值判為 Drive
+}
+
+SMASH, DROP_SHOT, LIFT, NET_SHOT, DRIVE, TRANSITION = (ACTION_CODES[n] for n in ACTION_NAMES)
+NO_ACTION = -1
+
+
+def classify_actions(landmarks, thresholds=None, smooth_window=1):
+    """
+    向量化動作分類。
+    landmarks：(..., 33, 4) 陣列，例如 (影格, 追蹤對象, 33, 4)；沒有骨架處為 NaN
+    回傳：(...) int8 動作代碼 (-1 = 無)，預設門檻下與 classify_badminton_action 逐一相同
+    smooth_window：> 1 時沿第 0 軸 (影格) 做多數決平滑，需為 (影格, 追蹤對象, 33, 4)
+    """
+    th = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    # 以 float64 計算，與原版 Python float 的運算結果一致
+    y = np.asarray(landmarks, dtype=np.float64)[..., 1]
+
+    wrist_y = (y[..., RIGHT_WRIST] + y[..., LEFT_WRIST]) / 2
+    shoulder_y = (y[..., RIGHT_SHOULDER] + y[..., LEFT_SHOULDER]) / 2
+    hip_y = (y[..., RIGHT_HIP] + y[..., LEFT_HIP]) / 2
+    hip_diff = np.abs(y[..., RIGHT_HIP] - y[..., LEFT_HIP])
+
+    above = wrist_y < shoulder_y - th["raise_margin"]
+    below = ~above & (wrist_y > shoulder_y + th["raise_margin"])
+    valid = ~np.isnan(wrist_y) & ~np.isnan(shoulder_y) & ~np.isnan(hip_y)
+
+    codes = np.select(
+        [
+            ~valid,
+            above & (hip_diff > th["smash_hip_diff"]),
+            above,
+            below & (wrist_y > hip_y),
+            below,
+            np.abs(wrist_y - shoulder_y) < th["drive_band"],
+        ],
+        [NO_ACTION, SMASH, DROP_SHOT, LIFT, NET_SHOT, DRIVE],
+        default=TRANSITION,
+    ).astype(np.int8)
+
+    if smooth_window > 1:
+        codes = smooth_actions(codes, smooth_window)
+    return codes
+
+
+def smooth_actions(codes, window):
+    """
+    沿影格軸 (第 0 軸) 的滑動視窗多數決；沒有骨架 (-1) 的位置維持 -1，也不參與投票。
+    以 one-hot 累加和一次算完所有追蹤對象。
+    """
+    n_frames = codes.shape[0]
+    one_hot = (codes[..., None] == np.arange(len(ACTION_NAMES))).astype(np.int32)
+    csum = np.concatenate([np.zeros((1,) + one_hot.shape[1:], dtype=np.int32), np.cumsum(one_hot, axis=0)])
+    half = window // 2
+    idx = np.arange(n_frames)
+    lo = np.clip(idx - half, 0, n_frames)
+    hi = np.clip(idx - half + window, 0, n_frames)
+    votes = csum[hi] - csum[lo]
+    smoothed = votes.argmax(axis=-1).astype(np.int8)
+    return np.where(codes == NO_ACTION, NO_ACTION, smoothed).astype(np.int8)
+
+
+def action_names(codes):
+    names = np.array(ACTION_NAMES + [None], dtype=object)
+    return names[np.asarray(codes)].tolist()
+
+
+def action_histogram(codes):
+    valid = codes[codes >= 0]
+    counts = np.bincount(valid, minlength=len(ACTION_NAMES))
+    return dict(zip(ACTION_NAMES, counts.tolist()))
+
+
+def sweep(landmarks, name, values, smooth_window=1, **base_thresholds):
+    """對單一門檻掃描多個值，回傳 [(值, 動作分布)]。"""
+    return [
+        (v, action_histogram(classify_actions(landmarks, dict(base_thresholds, **{name: v}), smooth_window)))
+        for v in values
+    ]
+
+
+# ========== 獨立運行模式 (對已存的追蹤資料重新分類 / 掃描門檻) ==========
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python action_classifier.py <片段>_tracking/ [門檻名稱 值1,值2,...]")
+        sys.exit(1)
+
+    tensor, frames, tracks = landmark_tensor(load_tracking(sys.argv[1], columns=("frame", "track_id", "landmarks")))
+    print(f"📦 {len(frames)} 格 x {len(tracks)} 個追蹤對象")
+    print(f"   預設門檻：{action_histogram(classify_actions(tensor))}")
+
+    if len(sys.argv) >= 4:
+        values = [float(v) for v in sys.argv[3].split(",")]
+        for value, hist in sweep(tensor, sys.argv[2], values):
+            print(f"   {sys.argv[2]}={value}: {hist}")
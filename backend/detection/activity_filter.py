@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import cv2
+import numpy as np
+import imageio_ffmpeg
+from inference_backend import create_backend
+
+# ========== 參數設定 ==========
+# 取樣間隔 (秒)：只看稀疏影格，30 秒片段約 60 格
+SAMPLE_INTERVAL = 0.5
+DETECT_BATCH = 8
+# 偵測後端 (見 inference_backend.py)；預先過濾只需要人數，用 CPU 量化版即可
+ACTIVITY_BACKEND = "onnx"
+# 比賽畫面：場上人數介於此範圍 (觀眾特寫人數過多、球員特寫 / 重播人數過少)
+MIN_PERSONS = 2
+MAX_PERSONS = 8
+# 相鄰取樣的灰階平均差 (0~255，縮小到 MOTION_WIDTH 寬度後計算)，低於此值視為靜止 (死球、休息)
+MOTION_THRESHOLD = 2.0
+MOTION_WIDTH = 160
+# 活動區間前後保留的秒數，以及短於此長度的活動 / 空檔會被忽略
+PADDING = 1.5
+MIN_ACTIVE_SEC = 1.0
+MIN_GAP_SEC = 3.0
+# 活動比例超過此值時不剪輯，直接上傳原片段 (省下的 token 不值得重新編碼)
+MAX_ACTIVE_RATIO = 0.9
+
+FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def motion_energy(prev_gray, gray):
+    return float(np.mean(cv2.absdiff(prev_gray, gray))) if prev_gray is not None else 0.0
+
+
+def sample_activity(video_path, detector, interval=SAMPLE_INTERVAL):
+    """
+    每 interval 秒取一格 (其餘影格只 grab 不解碼)，回傳 (取樣時間, 人數, 動態能量) 三個陣列與片段長度。
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"無法開啟影片：{video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    step = max(1, int(round(interval * fps)))
+
+    times, counts, motion = [], [], []
+    batch, prev_gray = [], None
+    frame_index = 0
+    try:
+        while True:
+            if frame_index % step == 0:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                h, w = frame.shape[:2]
+                small = cv2.resize(frame, (MOTION_WIDTH, max(1, int(h * MOTION_WIDTH / w))))
+                gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+                motion.append(motion_energy(prev_gray, gray))
+                prev_gray = gray
+                times.append(frame_index / fps)
+                batch.append(frame)
+                if len(batch) == DETECT_BATCH:
+                    counts.extend(len(d) for d in detector.detect(batch))
+                    batch = []
+            elif not cap.grab():
+                break
+            frame_index += 1
+        if batch:
+            counts.extend(len(d) for d in detector.detect(batch))
+    finally:
+        cap.release()
+
+    motion = np.array(motion, dtype=np.float32)
+    if len(motion) > 1:
+        motion[0] = motion[1]   # 第一格沒有前一格可比，沿用第二格
+    duration = (total_frames or frame_index) / fps
+    return np.array(times, dtype=np.float32), np.array(counts, dtype=np.int32), motion, duration
+
+
+def _runs(mask):
+    """布林陣列中連續 True 的區段：[(起點索引, 終點索引 (不含))]。"""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def _merge_spans(spans):
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def active_windows(times, counts, motion, duration, interval=SAMPLE_INTERVAL, padding=PADDING):
+    """
+    依取樣結果決定要送去分析的區間。
+    回傳 (windows, gaps)：皆為 [[開始秒數, 結束秒數]]，兩者互補、覆蓋整個片段。
+    """
+    active = (counts >= MIN_PERSONS) & (counts <= MAX_PERSONS) & (motion >= MOTION_THRESHOLD)
+
+    # 先補掉短暫的靜止 (擊球間的停頓)，再去掉零星的誤判
+    for start, end in _runs(~active):
+        if 0 < start and end < len(active) and (end - start) * interval < MIN_GAP_SEC:
+            active[start:end] = True
+    spans = []
+    for start, end in _runs(active):
+        if (end - start) * interval >= MIN_ACTIVE_SEC:
+            spans.append((max(0.0, float(times[start]) - padding),
+                          min(duration, float(times[end - 1]) + interval + padding)))
+    windows = _merge_spans(spans)
+
+    gaps, cursor = [], 0.0
+    for start, end in windows:
+        if start - cursor > 0:
+            gaps.append([round(cursor, 2), round(start, 2)])
+        cursor = end
+    if duration - cursor > 0:
+        gaps.append([round(cursor, 2), round(duration, 2)])
+    windows = [[round(s, 2), round(e, 2)] for s, e in windows]
+    return windows, [g for g in gaps if g[1] - g[0] >= 0.1]
+
+
+def cut_active_clip(video_path, windows, output_path):
+    """
+    只保留 windows 的畫面，依序接成一支短片 (不含音軌)。
+    需要精確的剪輯點才能把 Stage 1 的時間換算回原片段，因此以 ultrafast 重新編碼，不用串流複製。
+    """
+    parts = []
+    for i, (start, end) in enumerate(windows):
+        parts.append(f"[0:v]trim=start={start}:end={end},setpts=PTS-STARTPTS[v{i}]")
+    concat = "".join(f"[v{i}]" for i in range(len(windows)))
+    filter_graph = ";".join(parts) + f";{concat}concat=n={len(windows)}:v=1:a=0[out]"
+    cmd = [FFMPEG_EXE, "-y", "-v", "error", "-i", video_path, "-filter_complex", filter_graph,
+           "-map", "[out]", "-an", "-c:v", "libx264", "-preset", "ultrafast", "-crf", "23", output_path]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", "ignore").strip()[-500:])
+    return output_path
+
+
+_detector = None
+_detector_error = None     # 建立失敗時記下原因，之後的片段不再重試 (例如缺少權重或 onnxruntime)
+
+
+def prefilter_segment(video_path, output_folder, detector=None):
+    """
+    片段預先過濾：找出比賽進行中的區間，剪成短片供 Stage 1 上傳。
+    回傳：{"status", "segment", "duration", "windows", "known_gaps", "active_ratio", "clip", "elapsed"}
+      clip 為 None 表示不剪輯 (直接上傳原片段)；找不到比賽區間時也是上傳整段，只憑啟發式不丟掉片段
+    """
+    global _detector, _detector_error
+    t0 = time.perf_counter()
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    if detector is None and _detector is None:
+        if _detector_error is None:
+            try:
+                _detector, _ = create_backend(ACTIVITY_BACKEND)
+            except Exception as e:
+                _detector_error = str(e)
+                print(f"⚠️ [Activity] 偵測器無法建立：{e}，之後的片段一律整段上傳")
+        if _detector is None:
+            return {"status": "error", "segment": video_path, "reason": _detector_error}
+    try:
+        detector = detector or _detector
+        times, counts, motion, duration = sample_activity(video_path, detector)
+        windows, gaps = active_windows(times, counts, motion, duration)
+    except Exception as e:
+        print(f"⚠️ [Activity] {base_name}: {e}，改為整段上傳")
+        return {"status": "error", "segment": video_path, "reason": str(e)}
+
+    active = sum(e - s for s, e in windows)
+    ratio = active / duration if duration else 1.0
+    clip = None
+    if windows and ratio <= MAX_ACTIVE_RATIO:
+        os.makedirs(output_folder, exist_ok=True)
+        clip = os.path.join(output_folder, f"{base_name}_active.mp4")
+        try:
+            cut_active_clip(video_path, windows, clip)
+        except Exception as e:
+            print(f"⚠️ [Activity] {base_name} 剪輯失敗：{e}，改為整段上傳")
+            clip = None
+    if clip is None:
+        if not windows:
+            print(f"⚠️ [Activity] {base_name}: 找不到比賽區間，仍整段上傳")
+        windows, gaps = [[0.0, round(duration, 2)]], []
+
+    elapsed = time.perf_counter() - t0
+    print(f"🎯 [Activity] {base_name}: 比賽畫面 {active:.1f}/{duration:.1f}s ({ratio:.0%})，"
+          f"{len(windows)} 個區間 | {elapsed:.1f}s")
+    return {
+        "status": "success",
+        "segment": video_path,
+        "duration": round(duration, 2),
+        "windows": windows,
+        "known_gaps": gaps,
+        "active_ratio": round(ratio, 4),
+        "clip": clip,
+        "elapsed": round(elapsed, 2),
+    }
+
+
+# ========== 獨立運行模式 ==========
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python activity_filter.py <片段.mp4 或資料夾> [輸出資料夾]")
+        sys.exit(1)
+    target = sys.argv[1]
+    output_folder = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(os.path.abspath(target)), "active_clips")
+    paths = [os.path.join(target, f) for f in sorted(os.listdir(target)) if f.endswith(".mp4")] if os.path.isdir(target) else [target]
+
+    results = [prefilter_segment(path, output_folder) for path in paths]
+    total = sum(r.get("duration", 0) for r in results)
+    kept = sum(sum(e - s for s, e in r.get("windows", [])) for r in results if r["status"] == "success")
+    print(f"📉 送往 Stage 1 的影片長度：{kept:.1f}/{total:.1f}s ({kept / total if total else 1:.0%})")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
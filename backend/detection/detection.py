@@ -1,34 +1,85 @@
+import os
 import cv2
 import json
+import time
+import argparse
 import numpy as np
 import mediapipe as mp
-from ultralytics import YOLO
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from deep_sort_realtime.deepsort_tracker import DeepSort
+from frame_reader import FrameRingBuffer
+from pose_stride import PoseStrideScheduler, POSE_STRIDE, landmarks_to_array
+from tracking_store import TrackingWriter
+from action_classifier import classify_actions, action_names
+from inference_backend import create_backend, cuda_available, benchmark_backends
 
 # --------------------
-# 0. 載入球員資訊
+# 0. 路徑與參數
 # --------------------
-with open("./detection/player.json", "r", encoding="utf-8") as f:
-    player_data = json.load(f)
-    players_dict = {player["id"]: player for player in player_data["players"]}
+DETECTION_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(DETECTION_DIR)
+PLAYER_JSON = os.path.join(DETECTION_DIR, "player.json")
+YOLO_WEIGHTS = os.path.join(BACKEND_DIR, "yolo", "yolov8l.pt")
+
+# 畫骨架與顯示資訊開關
+draw_skeleton = True
+show_player_info = False
+
+# 推論方式："batched" 解碼執行緒 + 每 BATCH_SIZE 格一次 predict；"legacy" 逐格讀取逐格推論
+INFERENCE_MODE = "batched"
+BATCH_SIZE = 8
+RING_SLOTS = 32          # 環狀緩衝區大小 (需大於 BATCH_SIZE)
+BENCHMARK_FRAMES = 240
+# 偵測 / 外觀特徵後端："torch" (ultralytics + mobilenet)；"onnx" INT8 靜態量化 CPU 推論 (見 inference_backend.py)
+DETECTOR_BACKEND = "torch"
+# 追蹤資料格式："npz" 欄式分塊串流寫入 (記憶體固定)；"json" 為舊版整段 json.dump
+TRACKING_FORMAT = "npz"
+
+mp_pose = mp.solutions.pose
+mp_drawing = mp.solutions.drawing_utils
+
+# 模型於第一次使用時才載入 (import 本模組不會載入任何模型)；
+# 行程池中每個 worker 各自載入一份
+detector = None
+embedder = None          # None = 使用 DeepSORT 內建的 mobilenet embedder
+backend_name = None
+pose = None
+players_dict = {}
 
 # --------------------
 # 1. 初始化模型與 DeepSORT
 # --------------------
-model = YOLO("yolo/yolov8l.pt")
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
-pose = mp_pose.Pose()
-tracker = DeepSort(
-    max_age = 50,  # 最大跟踪年龄
-    n_init = 5,     # 初始化跟踪器所需的帧数
-    max_cosine_distance = 0.6,  # 最大余弦距离
-    max_iou_distance = 0.6,  # 最大 IOU 距离
-    embedder = "mobilenet", # 啟用外觀特徵提取
-    embedder_gpu = True,  # 使用 GPU 进行特征提取
-    half = True,  # 使用半精度计算
-    bgr = True  # 输入图像为 BGR 格式
-)
+def load_players(path=PLAYER_JSON):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        player_data = json.load(f)
+    return {player["id"]: player for player in player_data["players"]}
+
+def init_models(backend=None, threads=0):
+    global detector, embedder, backend_name, pose, players_dict
+    backend = backend or DETECTOR_BACKEND
+    if detector is None or backend_name != backend:
+        detector, embedder = create_backend(backend, threads=threads, weights=YOLO_WEIGHTS)
+        backend_name = backend
+    if pose is None:
+        pose = mp_pose.Pose()
+        players_dict = load_players()
+    return detector
+
+def create_tracker():
+    """DeepSORT 帶有跨影格狀態，每個片段各自建立一個；ONNX 後端時外觀特徵由 embedder 提供。"""
+    gpu = cuda_available()
+    return DeepSort(
+        max_age = 50,  # 最大跟踪年龄
+        n_init = 5,     # 初始化跟踪器所需的帧数
+        max_cosine_distance = 0.6,  # 最大余弦距离
+        max_iou_distance = 0.6,  # 最大 IOU 距离
+        embedder = "mobilenet" if embedder is None else None, # 啟用外觀特徵提取
+        embedder_gpu = gpu,  # 有 GPU 才用 GPU 进行特征提取
+        half = gpu,  # 半精度计算只在 GPU 上有效
+        bgr = True  # 输入图像为 BGR 格式
+    )
 
 # --------------------
 # 2. 動作分類
@@ -48,57 +99,35 @@ def classify_badminton_action(landmarks):
         return "Drive"
     return "Transition"
 
+def classify_landmark_array(arr):
+    """(N, 33, 4) 陣列 -> N 個動作名稱 (向量化版，規則與上方相同，見 action_classifier.py)。"""
+    return action_names(classify_actions(arr))
+
 # --------------------
 # 3. 初始化影片 I/O
 # --------------------
 def init_video_io(video_path, output_path):
+    """output_path 為 None 時不輸出標註影片 (只要追蹤資料)。"""
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError(f"無法開啟影片：{video_path}")
     fps = int(cap.get(cv2.CAP_PROP_FPS))
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    out = None
+    if output_path:
+        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
     return cap, out, fps
 
 # --------------------
-# 4. 設定參數（畫骨架與顯示資訊開關）
+# 4. 單格處理：追蹤 + 姿態 + 繪圖 (兩種推論迴圈共用)
 # --------------------
-draw_skeleton = True
-show_player_info = False
-
-# --------------------
-# 5. 主程式邏輯
-# --------------------
-video_path = "D:/Vs.code/AI_Anchor/video_splitter/badminton_segments/segment_005.mp4"
-output_path = "D:/Vs.code/AI_Anchor/detection/badminton/segment_005_output.mp4"
-json_output_path = "D:/Vs.code/AI_Anchor/detection/badminton/segment_005_tracking.json"
-
-cap, out, fps = init_video_io(video_path, output_path)
-tracking_data = []
-frame_count = 0
-
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    frame_count += 1
+def process_frame(frame, frame_count, detections, tracker, stride=None):
+    """stride：PoseStrideScheduler；非關鍵影格不跑姿態，之後由排程器內插填回。"""
     frame_detections = []
-
-    results = model.predict(frame, conf=0.5, classes=[0])
-
-    detections = []
-    for result in results:
-        if hasattr(result, 'boxes'):
-            for box, conf, cls in zip(result.boxes.xyxy, result.boxes.conf, result.boxes.cls):
-                if model.names[int(cls)] == "person":
-                    x1, y1, x2, y2 = map(int, box[:4])
-                    w, h = x2 - x1, y2 - y1
-                    detections.append(([x1, y1, w, h], float(conf), None))
-
-    tracks = tracker.update_tracks(detections, frame=frame)
+    embeds = embedder.embed(frame, detections) if embedder is not None else None
+    tracks = tracker.update_tracks(detections, embeds=embeds, frame=frame)
 
     for track in tracks:
         if not track.is_confirmed():
@@ -111,13 +140,17 @@ while cap.isOpened():
         if person_roi.size == 0:
             continue
 
-        person_roi_rgb = cv2.cvtColor(person_roi, cv2.COLOR_BGR2RGB)
-        results_pose = pose.process(person_roi_rgb)
-
         action = None
         landmarks_list = None
+        run_pose = stride is None or stride.should_run(track_id, frame_count, (x1, y1, x2, y2))
+
+        if run_pose:
+            person_roi_rgb = cv2.cvtColor(person_roi, cv2.COLOR_BGR2RGB)
+            results_pose = pose.process(person_roi_rgb)
+        else:
+            results_pose = None
 
-        if results_pose.pose_landmarks:
+        if results_pose is not None and results_pose.pose_landmarks:
             if draw_skeleton:
                 mp_drawing.draw_landmarks(person_roi, results_pose.pose_landmarks, mp_pose.POSE_CONNECTIONS)
             action = classify_badminton_action(results_pose.pose_landmarks)
@@ -139,33 +172,288 @@ while cap.isOpened():
             player_info = None
 
         # 儲存追蹤結果
-        frame_detections.append({
+        detection = {
             "id": track_id,
             "bounding_box": [x1, y1, x2, y2],
             "confidence": 1.0,
             "action": action,
             "player_info": player_info,
             "landmarks": landmarks_list
-        })
+        }
+        frame_detections.append(detection)
+        if stride is not None:
+            if run_pose:
+                stride.add_keyframe(track_id, frame_count, (x1, y1, x2, y2),
+                                    landmarks_to_array(landmarks_list) if landmarks_list else None)
+            else:
+                stride.add_pending(track_id, frame_count, detection)
 
 
         frame[y1:y2, x1:x2] = person_roi
         cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
 
-    tracking_data.append({"frame": frame_count, "detections": frame_detections})
-    cv2.imshow("YOLO + DeepSORT + MediaPipe Pose", frame)
-    out.write(frame)
+    return {"frame": frame_count, "detections": frame_detections}
+
+def show_and_write(frame, out, show=False):
+    """回傳 False 表示使用者按下 q 中止 (只有 show=True 時才開視窗)。"""
+    if out is not None:
+        out.write(frame)
+    if show:
+        cv2.imshow("YOLO + DeepSORT + MediaPipe Pose", frame)
+        return not (cv2.waitKey(1) & 0xFF == ord("q"))
+    return True
+
+# --------------------
+# 5. 推論迴圈
+# --------------------
+def run_legacy(cap, out, tracking_data, tracker=None, max_frames=None, process=True, show=False, stride=None):
+    """舊版：逐格讀取、逐格推論。"""
+    frame_count = 0
+    while cap.isOpened():
+        if max_frames and frame_count >= max_frames:
+            break
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        frame_count += 1
+        detections = detector.detect([frame])[0]
+        if not process:
+            continue
+
+        tracking_data.append(process_frame(frame, frame_count, detections, tracker, stride))
+        if not show_and_write(frame, out, show):
+            break
+    return frame_count
+
+def run_batched(cap, out, tracking_data, tracker=None, max_frames=None, process=True, show=False, stride=None):
+    """
+    批次：解碼執行緒把影格寫進預先配置的環狀緩衝區，推論端一次取 BATCH_SIZE 格送進 predict。
+    DeepSORT 與姿態估計需要依序處理，批次推論後仍逐格執行。
+    """
+    reader = FrameRingBuffer(cap, slots=RING_SLOTS)
+    frame_count = 0
+    try:
+        while True:
+            n = BATCH_SIZE if not max_frames else min(BATCH_SIZE, max_frames - frame_count)
+            batch = reader.next_batch(n) if n > 0 else []
+            if not batch:
+                break
+            slots = [slot for _, slot in batch]
+            frames = [reader.frames[slot] for slot in slots]
+            batch_detections = detector.detect(frames)
+            frame_count += len(batch)
+
+            if process:
+                for (index, slot), frame, detections in zip(batch, frames, batch_detections):
+                    tracking_data.append(process_frame(frame, index, detections, tracker, stride))
+                    if not show_and_write(frame, out, show):
+                        return frame_count
+            reader.release(slots)
+    finally:
+        reader.close()
+    return frame_count
+
+def benchmark_inference(video_path, max_frames=BENCHMARK_FRAMES):
+    """只比較 讀取 + YOLO 推論 的 FPS (不含追蹤與姿態)，CPU 上兩者差異即為批次與重疊解碼的效益。"""
+    init_models()
+    report = {}
+    for name, loop in (("legacy", run_legacy), ("batched", run_batched)):
+        cap = cv2.VideoCapture(video_path)
+        t0 = time.perf_counter()
+        frames = loop(cap, None, [], max_frames=max_frames, process=False)
+        elapsed = time.perf_counter() - t0
+        cap.release()
+        report[name] = frames / elapsed if elapsed > 0 else 0.0
+        print(f"⏱️ [{name}] {frames} 格 / {elapsed:.2f}s = {report[name]:.1f} FPS")
+    if report["legacy"]:
+        print(f"⚡ 批次推論 (BATCH_SIZE={BATCH_SIZE}) 加速 {report['batched'] / report['legacy']:.2f}x")
+    return report
+
+def benchmark_pose_stride(video_path, strides=(1, 2, 3, 5), max_frames=BENCHMARK_FRAMES):
+    """
+    比較不同 pose stride 的處理速度與動作分類偏移：
+    以 stride=1 (每格都跑姿態) 的動作為基準，計算相同 (影格, 追蹤 ID) 的動作一致率。
+    """
+    init_models()
+    report, reference = [], None
+    for k in strides:
+        cap = cv2.VideoCapture(video_path)
+        tracking_data = []
+        stride = PoseStrideScheduler(k, classify_fn=classify_landmark_array) if k > 1 else None
+        t0 = time.perf_counter()
+        frames = run_batched(cap, None, tracking_data, tracker=create_tracker(), max_frames=max_frames, stride=stride)
+        if stride is not None:
+            stride.flush()
+        elapsed = time.perf_counter() - t0
+        cap.release()
+
+        actions = {(fd["frame"], d["id"]): d["action"]
+                   for fd in tracking_data for d in fd["detections"] if d["action"]}
+        if reference is None:
+            reference = actions
+        common = [key for key in reference if key in actions]
+        agreement = sum(reference[key] == actions[key] for key in common) / len(common) if common else 1.0
+        fps = frames / elapsed if elapsed else 0.0
+        report.append({"stride": k, "fps": round(fps, 2), "agreement": round(agreement, 4), "compared": len(common)})
+        print(f"⏱️ stride={k}: {fps:.1f} FPS | 動作與 stride=1 一致 {agreement:.1%} ({len(common)} 筆)")
+    return report
 
-    if cv2.waitKey(1) & 0xFF == ord("q"):
-        break
+# --------------------
+# 6. 單一片段 (無視窗，可在伺服器上執行)
+# --------------------
+def process_segment(video_path, output_dir, write_video=True, show=False, mode=None, pose_stride=POSE_STRIDE, backend=None):
+    """
+    處理單一片段：偵測 -> 追蹤 -> 姿態 -> 動作分類，輸出追蹤資料 (與標註影片)。
+    追蹤資料依 TRACKING_FORMAT 寫成 <片段>_tracking/ (分塊 .npz，見 tracking_store.py) 或 <片段>_tracking.json。
+    pose_stride：每個追蹤對象每幾格跑一次姿態 (1 = 每格)，中間影格以內插補上。
+    backend：偵測後端 ("torch" / "onnx")，預設 DETECTOR_BACKEND
+    回傳：{"status", "segment", "frames", "fps", "backend", "tracking", "video", "pose_runs", "interpolated"}
+    """
+    mode = mode or INFERENCE_MODE
+    backend = backend or DETECTOR_BACKEND
+    os.makedirs(output_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    output_path = os.path.join(output_dir, f"{base_name}_output.mp4") if write_video else None
+    if TRACKING_FORMAT == "npz":
+        tracking_output_path = os.path.join(output_dir, f"{base_name}_tracking")
+    else:
+        tracking_output_path = os.path.join(output_dir, f"{base_name}_tracking.json")
+
+    try:
+        init_models(backend)
+        cap, out, fps = init_video_io(video_path, output_path)
+    except Exception as e:
+        print(f"❌ [Detection] {base_name}: {e}")
+        return {"status": "error", "segment": video_path, "reason": str(e)}
+
+    tracker = create_tracker()
+    stride = PoseStrideScheduler(pose_stride, classify_fn=classify_landmark_array) if pose_stride > 1 else None
+    if TRACKING_FORMAT == "npz":
+        # 內插會回頭填補：等待中的影格跨度 < stride，且 settle 只補齊落後 stride 格以上的對象，
+        # 因此保留最近 2 * stride 格在記憶體，確定後再寫出
+        tracking_data = TrackingWriter(
+            tracking_output_path,
+            hold_frames=2 * pose_stride if stride else 0,
+            settle_fn=stride.settle if stride else None,
+            meta={"segment": os.path.basename(video_path), "fps": fps, "pose_stride": pose_stride},
+        )
+    else:
+        tracking_data = []
+    t_start = time.perf_counter()
+    try:
+        loop = run_batched if mode == "batched" else run_legacy
+        frame_count = loop(cap, out, tracking_data, tracker=tracker, show=show, stride=stride)
+        if stride is not None:
+            stride.flush()
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+        if show:
+            cv2.destroyAllWindows()
+    elapsed = time.perf_counter() - t_start
 
-cap.release()
-out.release()
-cv2.destroyAllWindows()
+    if TRACKING_FORMAT == "npz":
+        tracking_data.close()
+    else:
+        with open(tracking_output_path, "w", encoding="utf-8") as f:
+            json.dump(tracking_data, f, ensure_ascii=False, indent=4)
 
-with open(json_output_path, "w", encoding="utf-8") as f:
-    json.dump(tracking_data, f, ensure_ascii=False, indent=4)
+    processing_fps = frame_count / elapsed if elapsed else 0.0
+    print(f"✅ [Detection] {base_name}: {frame_count} 格 / {elapsed:.1f}s = {processing_fps:.1f} FPS ({mode}, {backend})")
+    return {
+        "status": "success",
+        "segment": video_path,
+        "frames": frame_count,
+        "fps": round(processing_fps, 2),
+        "backend": backend,
+        "tracking": tracking_output_path,
+        "video": output_path,
+        "pose_runs": stride.pose_runs if stride else None,
+        "interpolated": stride.interpolated if stride else 0,
+    }
+
+# --------------------
+# 7. 多片段批次 (行程池，每個 worker 一份模型)
+# --------------------
+def _init_detection_worker(threads, backend=None):
+    # 限制每個 worker 的執行緒數，N 個 worker 才不會互搶核心
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    init_models(backend, threads=threads)
+
+def batch_process_segments(video_folder, output_dir, workers=1, write_video=False, mode=None, pose_stride=POSE_STRIDE, backend=None):
+    """
+    將資料夾中的所有片段分給 workers 個行程處理，回傳依檔名排序的 results。
+    """
+    video_files = sorted(f for f in os.listdir(video_folder) if f.endswith(".mp4"))
+    if not video_files:
+        print(f"❌ 錯誤：在 {video_folder} 找不到任何 .mp4 影片")
+        return {"status": "error", "reason": "no_videos_found"}
+
+    paths = [os.path.join(video_folder, f) for f in video_files]
+    results = [None] * len(paths)
+    t0 = time.perf_counter()
+    workers = max(1, min(workers, len(paths)))
+    if workers == 1:
+        for i, path in enumerate(paths):
+            results[i] = process_segment(path, output_dir, write_video=write_video, mode=mode,
+                                         pose_stride=pose_stride, backend=backend)
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"⚙️ 平行偵測：{workers} 個行程，每個 {threads} 執行緒")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_detection_worker,
+                                 initargs=(threads, backend)) as executor:
+            futures = {executor.submit(process_segment, path, output_dir, write_video, False, mode, pose_stride, backend): i
+                       for i, path in enumerate(paths)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    results[i] = {"status": "error", "segment": paths[i], "reason": str(e)}
+
+    elapsed = time.perf_counter() - t0
+    total_frames = sum(r.get("frames", 0) for r in results)
+    print(f"🏁 [Detection] {len(paths)} 段 / {total_frames} 格 / {elapsed:.1f}s = {total_frames / elapsed if elapsed else 0:.1f} FPS (整體)")
+    return {"status": "done", "results": results, "elapsed": round(elapsed, 2)}
+
+# --------------------
+# 8. 命令列
+# --------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="YOLO + DeepSORT + MediaPipe 對照組 (無視窗)")
+    parser.add_argument("input", help="單一片段 .mp4，或片段資料夾 (批次)")
+    parser.add_argument("--output-dir", default=os.path.join(DETECTION_DIR, "badminton"))
+    parser.add_argument("--workers", type=int, default=1, help="批次模式的行程數")
+    parser.add_argument("--mode", choices=["batched", "legacy"], default=INFERENCE_MODE)
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=DETECTOR_BACKEND,
+                        help="偵測 / 外觀特徵後端 (onnx = INT8 量化 CPU 推論)")
+    parser.add_argument("--no-video", action="store_true", help="不輸出標註影片")
+    parser.add_argument("--show", action="store_true", help="顯示即時視窗 (需要桌面環境)")
+    parser.add_argument("--pose-stride", type=int, default=POSE_STRIDE, help="每幾格跑一次姿態估計 (1 = 每格)")
+    parser.add_argument("--benchmark", action="store_true", help="先比較逐格與批次推論的 FPS")
+    parser.add_argument("--benchmark-backend", action="store_true", help="先比較 PyTorch / ONNX FP32 / ONNX INT8 的 FPS 與偵測一致性")
+    parser.add_argument("--benchmark-stride", action="store_true", help="先比較不同 pose stride 的速度與動作偏移")
+    args = parser.parse_args()
 
-print(f"辨識結果已儲存至 {output_path}")
-print(f"追蹤資料已儲存至 {json_output_path}")
-print("處理完成！")
\ No newline at end of file
+    if os.path.isdir(args.input):
+        result = batch_process_segments(args.input, args.output_dir, workers=args.workers,
+                                        write_video=not args.no_video, mode=args.mode, pose_stride=args.pose_stride,
+                                        backend=args.backend)
+    else:
+        if args.benchmark:
+            benchmark_inference(args.input)
+        if args.benchmark_stride:
+            benchmark_pose_stride(args.input)
+        if args.benchmark_backend:
+            benchmark_backends(args.input)
+        result = process_segment(args.input, args.output_dir, write_video=not args.no_video,
+                                 show=args.show, mode=args.mode, pose_stride=args.pose_stride,
+                                 backend=args.backend)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
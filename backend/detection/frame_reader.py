@@ -0,0 +1,75 @@
+import queue
+import threading
+import cv2
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    解碼執行緒 + 固定大小的環狀緩衝區。
+    - 預先配置 slots 張 (H, W, 3) uint8 影格，解碼時直接寫入空槽，不會每格重新配置記憶體
+    - 緩衝區滿時解碼執行緒等待 (有上限，不會把整段影片讀進記憶體)
+    - 推論端以 next_batch(n) 一次取 n 格，用完後 release() 歸還槽位
+    解碼 (I/O + 解壓) 與推論因此可以重疊進行。
+    """
+
+    def __init__(self, cap, slots=32):
+        self.cap = cap
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frames = np.empty((slots, height, width, 3), dtype=np.uint8)
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._stop = threading.Event()
+        self.error = None
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self._thread.start()
+
+    def _decode_loop(self):
+        frame_count = 0
+        try:
+            while not self._stop.is_set():
+                slot = self._free.get()
+                if slot is None:
+                    break
+                ok, frame = self.cap.read(self.frames[slot])
+                if not ok:
+                    break
+                if not np.shares_memory(frame, self.frames[slot]):
+                    # OpenCV 另外配置了陣列：部分版本不寫入傳入的陣列，或實際尺寸與 CAP_PROP 回報不同 (旋轉、回報 0)
+                    if frame.shape != self.frames[slot].shape:
+                        if frame_count:
+                            raise ValueError(f"第 {frame_count + 1} 格尺寸 {frame.shape} 與先前影格 {self.frames.shape[1:]} 不同")
+                        # 還沒有交出任何影格，可以安全地依實際尺寸重新配置
+                        self.frames = np.empty((len(self.frames),) + frame.shape, dtype=np.uint8)
+                    self.frames[slot] = frame
+                frame_count += 1
+                self._filled.put((frame_count, slot))
+        except Exception as e:
+            self.error = e
+        self._filled.put(None)
+
+    def next_batch(self, n):
+        """回傳最多 n 個 (影格編號, 槽位)；影片結束時回傳空列表，解碼失敗時拋出例外。"""
+        batch = []
+        while len(batch) < n:
+            item = self._filled.get()
+            if item is None:
+                # 讓之後的呼叫也能立即知道已結束
+                self._filled.put(None)
+                if self.error is not None and not batch:
+                    raise self.error
+                break
+            batch.append(item)
+        return batch
+
+    def release(self, slots):
+        for slot in slots:
+            self._free.put(slot)
+
+    def close(self):
+        self._stop.set()
+        self._free.put(None)
+        self._thread.join(timeout=5)
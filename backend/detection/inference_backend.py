@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+# 偵測器 / DeepSORT 外觀特徵的推論後端
+# - "torch"：ultralytics YOLO + deep_sort_realtime 內建 mobilenet (原本的做法)
+# - "onnx" ：匯出的 ONNX 模型 + onnxruntime CPU，INT8 靜態量化 (QDQ)、較小輸入尺寸，適合沒有 GPU 的主機
+# 兩者的 detect(frames) 都回傳 DeepSORT 的輸入格式：每格一個 [([x, y, w, h], conf, None), ...]
+
+# ========== 參數設定 ==========
+DETECTION_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(DETECTION_DIR)
+YOLO_WEIGHTS = os.path.join(BACKEND_DIR, "yolo", "yolov8l.pt")
+ONNX_DIR = os.path.join(BACKEND_DIR, "yolo", "onnx")
+
+CONF_THRESHOLD = 0.5
+NMS_IOU = 0.45
+PERSON_CLASS = 0
+# ONNX 偵測器的輸入尺寸 (原本 640；CPU 上縮小可大幅提速，遠景球員仍清楚)
+ONNX_IMGSZ = 480
+# DeepSORT mobilenet 外觀特徵的輸入
+EMBED_SIZE = 224
+EMBED_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+EMBED_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+ONNX_THREADS = 0          # 0 = onnxruntime 自行決定；行程池中由 worker 設定
+# 偵測器靜態量化的校正資料：影片或片段資料夾，平均取 CALIB_FRAMES 格
+CALIB_SOURCE = os.path.join(BACKEND_DIR, "video_splitter", "badminton_segments")
+CALIB_FRAMES = 64
+
+
+def cuda_available():
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+# ========== PyTorch (ultralytics) ==========
+class TorchDetector:
+    def __init__(self, weights=YOLO_WEIGHTS):
+        from ultralytics import YOLO
+        self.model = YOLO(weights)
+        self.half = cuda_available()
+
+    def detect(self, frames):
+        results = self.model.predict(frames, conf=CONF_THRESHOLD, classes=[PERSON_CLASS], half=self.half, verbose=False)
+        batch = []
+        for result in results:
+            detections = []
+            if hasattr(result, 'boxes'):
+                for box, conf, cls in zip(result.boxes.xyxy, result.boxes.conf, result.boxes.cls):
+                    if self.model.names[int(cls)] == "person":
+                        x1, y1, x2, y2 = map(int, box[:4])
+                        detections.append(([x1, y1, x2 - x1, y2 - y1], float(conf), None))
+            batch.append(detections)
+        return batch
+
+
+# ========== ONNX Runtime (CPU, INT8) ==========
+def _session(path, threads=ONNX_THREADS):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def letterbox(frames, size):
+    """等比例縮放並補邊到 size x size，回傳 (N, 3, size, size) float32 與每格的 (比例, 左補, 上補)。"""
+    batch = np.full((len(frames), size, size, 3), 114, dtype=np.uint8)
+    params = []
+    for i, frame in enumerate(frames):
+        h, w = frame.shape[:2]
+        r = min(size / h, size / w)
+        nh, nw = int(round(h * r)), int(round(w * r))
+        top, left = (size - nh) // 2, (size - nw) // 2
+        batch[i, top:top + nh, left:left + nw] = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+        params.append((r, left, top))
+    # BGR -> RGB, HWC -> CHW, 0~1
+    tensor = batch[..., ::-1].transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+    return np.ascontiguousarray(tensor), params
+
+
+class OnnxDetector:
+    """YOLOv8 ONNX (輸出 (N, 4 + 類別數, 候選框數)) 的 CPU 推論與後處理。"""
+
+    def __init__(self, onnx_path, imgsz=ONNX_IMGSZ, threads=ONNX_THREADS):
+        self.session = _session(onnx_path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+
+    def detect(self, frames):
+        tensor, params = letterbox(frames, self.imgsz)
+        output = self.session.run(None, {self.input_name: tensor})[0]
+        batch = []
+        for pred, (r, left, top), frame in zip(output, params, frames):
+            scores = pred[4 + PERSON_CLASS]
+            keep = scores >= CONF_THRESHOLD
+            if not keep.any():
+                batch.append([])
+                continue
+            cx, cy, w, h = pred[:4, keep]
+            scores = scores[keep]
+            # 還原到原圖座標
+            x1 = (cx - w / 2 - left) / r
+            y1 = (cy - h / 2 - top) / r
+            bw, bh = w / r, h / r
+            boxes = np.stack([x1, y1, bw, bh], axis=1)
+            idx = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), CONF_THRESHOLD, NMS_IOU)
+            fh, fw = frame.shape[:2]
+            detections = []
+            for i in np.array(idx).reshape(-1):
+                bx1, by1 = max(0, int(boxes[i, 0])), max(0, int(boxes[i, 1]))
+                bx2 = min(fw, int(boxes[i, 0] + boxes[i, 2]))
+                by2 = min(fh, int(boxes[i, 1] + boxes[i, 3]))
+                detections.append(([bx1, by1, bx2 - bx1, by2 - by1], float(scores[i]), None))
+            batch.append(detections)
+        return batch
+
+
+class OnnxEmbedder:
+    """DeepSORT mobilenet 外觀特徵的 ONNX 版本；搭配 DeepSort(embedder=None) 由外部提供 embeds。"""
+
+    def __init__(self, onnx_path, threads=ONNX_THREADS):
+        self.session = _session(onnx_path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def embed(self, frame, detections):
+        if not detections:
+            return []
+        h, w = frame.shape[:2]
+        crops = np.empty((len(detections), EMBED_SIZE, EMBED_SIZE, 3), dtype=np.float32)
+        for i, ((x, y, bw, bh), _, _) in enumerate(detections):
+            x1, y1 = max(0, x), max(0, y)
+            x2, y2 = min(w, x + bw), min(h, y + bh)
+            crop = frame[y1:y2, x1:x2] if x2 > x1 and y2 > y1 else np.zeros((1, 1, 3), dtype=np.uint8)
+            crops[i] = cv2.resize(crop, (EMBED_SIZE, EMBED_SIZE))[..., ::-1] / 255.0
+        tensor = ((crops - EMBED_MEAN) / EMBED_STD).transpose(0, 3, 1, 2)
+        features = self.session.run(None, {self.input_name: np.ascontiguousarray(tensor, dtype=np.float32)})[0]
+        return list(features.reshape(len(detections), -1))
+
+
+# ========== 匯出 + INT8 量化 ==========
+# 偵測器：靜態量化 (QDQ)，以取樣影格校正 activation 範圍，卷積以 INT8 核心執行；
+#   動態量化會把 Conv 換成 ConvInteger，CPU 上常常比 FP32 還慢
+# 外觀特徵器：動態量化只處理 MatMul / Gemm，卷積維持 FP32
+# 檔名註明量化方式 (_int8_qdq / _int8_matmul)，舊版全動態量化的 _int8.onnx 不會被沿用
+def sample_frames(source, count=CALIB_FRAMES):
+    """從影片 (或片段資料夾) 平均取 count 格，作為靜態量化的校正資料。找不到影片時回傳 []。"""
+    if source and os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in sorted(os.listdir(source)) if f.endswith(".mp4")]
+    else:
+        paths = [source] if source and os.path.exists(source) else []
+    if not paths:
+        return []
+    per_video = max(1, -(-count // len(paths)))
+    frames = []
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for idx in np.linspace(0, max(0, total - 1), per_video).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+            ok, frame = cap.read()
+            if ok:
+                frames.append(frame)
+        cap.release()
+        if len(frames) >= count:
+            break
+    return frames[:count]
+
+
+def calibration_reader(input_name, frames, imgsz):
+    """letterbox 後一次提供一格給 quantize_static 收集 activation 範圍。"""
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.rewind()
+
+        def get_next(self):
+            return next(self.batches, None)
+
+        def rewind(self):
+            self.batches = iter({input_name: letterbox([frame], imgsz)[0]} for frame in frames)
+
+    return FrameReader()
+
+
+def detector_head_nodes(model_path):
+    """
+    最後一層 Conv 之後的後處理節點 (DFL 解碼、Sigmoid、框與分數的 Concat)。
+    框座標 (0~imgsz) 與類別分數 (0~1) 接在同一個輸出，共用一組量化刻度會把分數壓成 0，這些節點維持 FP32。
+    """
+    import onnx
+    graph = onnx.load(model_path).graph
+    producers = {out: node for node in graph.node for out in node.output}
+    excluded, stack = set(), [o.name for o in graph.output]
+    while stack:
+        node = producers.get(stack.pop())
+        if node is None or node.name in excluded or node.op_type == "Conv":
+            continue
+        excluded.add(node.name)
+        stack.extend(node.input)
+    return sorted(excluded)
+
+
+def quantize_detector_static(fp32_path, frames, imgsz=ONNX_IMGSZ):
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType, CalibrationMethod
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    int8_path = fp32_path.replace(".onnx", "_int8_qdq.onnx")
+    prep_path = fp32_path.replace(".onnx", "_prep.onnx")
+    quant_pre_process(fp32_path, prep_path)
+    try:
+        input_name = _session(prep_path).get_inputs()[0].name
+        quantize_static(prep_path, int8_path, calibration_reader(input_name, frames, imgsz),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        per_channel=True, calibrate_method=CalibrationMethod.MinMax,
+                        nodes_to_exclude=detector_head_nodes(prep_path))
+    finally:
+        os.remove(prep_path)
+    print(f"🧮 偵測器靜態量化 (QDQ，{len(frames)} 格校正)：{int8_path}")
+    return int8_path
+
+
+def quantize_int8(fp32_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = fp32_path.replace(".onnx", "_int8_matmul.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8, op_types_to_quantize=["MatMul", "Gemm"])
+    return int8_path
+
+
+def detector_onnx_path(weights=YOLO_WEIGHTS, imgsz=ONNX_IMGSZ, int8=True):
+    base = os.path.splitext(os.path.basename(weights))[0]
+    return os.path.join(ONNX_DIR, f"{base}_{imgsz}{'_int8_qdq' if int8 else ''}.onnx")
+
+
+def export_detector_onnx(weights=YOLO_WEIGHTS, imgsz=ONNX_IMGSZ):
+    from ultralytics import YOLO
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    exported = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    target = detector_onnx_path(weights, imgsz, int8=False)
+    os.replace(exported, target)
+    return target
+
+
+def prepare_detector_onnx(weights=YOLO_WEIGHTS, imgsz=ONNX_IMGSZ, calib_source=CALIB_SOURCE):
+    """回傳可用的偵測器 ONNX：已量化的 INT8；沒有校正影片可用時退回 FP32 (不做無校正的量化)。"""
+    int8_path = detector_onnx_path(weights, imgsz)
+    if os.path.exists(int8_path):
+        return int8_path
+    fp32_path = detector_onnx_path(weights, imgsz, int8=False)
+    if not os.path.exists(fp32_path):
+        print(f"📦 匯出 ONNX 偵測器：{fp32_path}")
+        export_detector_onnx(weights, imgsz)
+    frames = sample_frames(calib_source)
+    if not frames:
+        print(f"⚠️ 找不到校正影片 ({calib_source})，偵測器使用 FP32 ONNX")
+        return fp32_path
+    return quantize_detector_static(fp32_path, frames, imgsz)
+
+
+def export_embedder_onnx(output_dir=ONNX_DIR, quantize=True):
+    import torch
+    from deep_sort_realtime.embedder.embedder_pytorch import MobileNetv2_Embedder
+    os.makedirs(output_dir, exist_ok=True)
+    net = MobileNetv2_Embedder(half=False, gpu=False).model.eval()
+    target = os.path.join(output_dir, "mobilenetv2_embedder.onnx")
+    torch.onnx.export(net, torch.zeros(1, 3, EMBED_SIZE, EMBED_SIZE), target,
+                      input_names=["images"], output_names=["features"],
+                      dynamic_axes={"images": {0: "batch"}, "features": {0: "batch"}}, opset_version=13)
+    return quantize_int8(target) if quantize else target
+
+
+def create_backend(name="torch", threads=ONNX_THREADS, weights=YOLO_WEIGHTS, calib_source=CALIB_SOURCE):
+    """回傳 (偵測器, 外觀特徵器或 None)；None 表示使用 deep_sort_realtime 內建的 embedder。"""
+    if name == "onnx":
+        detector_path = prepare_detector_onnx(weights, calib_source=calib_source)
+        embedder_path = os.path.join(ONNX_DIR, "mobilenetv2_embedder_int8_matmul.onnx")
+        if not os.path.exists(embedder_path):
+            print(f"📦 匯出 ONNX 外觀特徵器：{embedder_path}")
+            embedder_path = export_embedder_onnx()
+        return OnnxDetector(detector_path, threads=threads), OnnxEmbedder(embedder_path, threads=threads)
+    return TorchDetector(weights), None
+
+
+# ========== 效能 / 一致性比較 ==========
+def _iou_matrix(a, b):
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    iw = np.clip(np.minimum(ax2[:, None], bx2) - np.maximum(a[:, None, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(ay2[:, None], by2) - np.maximum(a[:, None, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] * a[:, 3])[:, None] + b[:, 2] * b[:, 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def detection_agreement(reference, candidate, iou=0.5):
+    """以 reference (PyTorch) 為基準，IoU >= iou 視為同一個偵測，回傳 (precision, recall)。"""
+    matched = ref_total = cand_total = 0
+    for ref, cand in zip(reference, candidate):
+        ref_total += len(ref)
+        cand_total += len(cand)
+        if not ref or not cand:
+            continue
+        m = _iou_matrix([d[0] for d in ref], [d[0] for d in cand])
+        # 貪婪配對
+        while m.size and m.max() >= iou:
+            i, j = np.unravel_index(m.argmax(), m.shape)
+            matched += 1
+            m[i, :] = 0
+            m[:, j] = 0
+    precision = matched / cand_total if cand_total else 1.0
+    recall = matched / ref_total if ref_total else 1.0
+    return precision, recall
+
+
+def benchmark_backends(video_path, max_frames=240, batch_size=8, weights=YOLO_WEIGHTS):
+    """比較 PyTorch / ONNX FP32 / ONNX INT8 的 FPS，以及兩個 ONNX 版本與 PyTorch 的偵測一致性。"""
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        print(f"❌ 無法讀取影片：{video_path}")
+        return None
+
+    # 還沒有 INT8 模型時以這支影片校正
+    int8_path = prepare_detector_onnx(weights, calib_source=video_path)
+    detectors = {"torch": lambda: TorchDetector(weights),
+                 "onnx_fp32": lambda: OnnxDetector(detector_onnx_path(weights, int8=False))}
+    if int8_path != detector_onnx_path(weights, int8=False):
+        detectors["onnx_int8"] = lambda: OnnxDetector(int8_path)
+
+    outputs, report = {}, {}
+    for name, build in detectors.items():
+        detector = build()
+        detector.detect(frames[:1])  # 暖機
+        t0 = time.perf_counter()
+        outputs[name] = [d for i in range(0, len(frames), batch_size) for d in detector.detect(frames[i:i + batch_size])]
+        elapsed = time.perf_counter() - t0
+        report[name] = {"fps": round(len(frames) / elapsed, 2)}
+        print(f"⏱️ [{name}] {len(frames)} 格 / {elapsed:.2f}s = {report[name]['fps']:.1f} FPS")
+
+    for name in outputs:
+        if name == "torch":
+            continue
+        precision, recall = detection_agreement(outputs["torch"], outputs[name])
+        report[name].update(precision=round(precision, 4), recall=round(recall, 4),
+                            speedup_vs_torch=round(report[name]["fps"] / report["torch"]["fps"], 2))
+        print(f"🎯 [{name}] ({ONNX_IMGSZ}px) 與 PyTorch 偵測一致性：precision {precision:.1%} / recall {recall:.1%}"
+              f" | 加速 {report[name]['speedup_vs_torch']:.2f}x")
+    if "onnx_int8" in report:
+        report["int8_speedup_vs_fp32"] = round(report["onnx_int8"]["fps"] / report["onnx_fp32"]["fps"], 2)
+        print(f"⚡ INT8 靜態量化 vs FP32 ONNX：{report['int8_speedup_vs_fp32']:.2f}x")
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python inference_backend.py <片段.mp4>")
+        sys.exit(1)
+    benchmark_backends(sys.argv[1])
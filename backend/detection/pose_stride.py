@@ -0,0 +1,106 @@
+import numpy as np
+
+# ========== 參數設定 ==========
+# 每個追蹤對象每 POSE_STRIDE 格才跑一次完整姿態估計 (1 = 每格都跑，與舊版相同)
+# 預設維持舊版行為；先以 benchmark_pose_stride() (--benchmark-stride) 確認速度與動作偏移，再調大
+POSE_STRIDE = 1
+# 邊界框中心位移超過框高的此比例時，不等間隔立即重跑姿態
+POSE_MOTION_THRESHOLD = 0.25
+
+LANDMARK_FIELDS = ("x", "y", "z", "visibility")
+
+
+def landmarks_to_array(landmarks_list):
+    """[{"x", "y", "z", "visibility"} * 33] -> (33, 4) float32"""
+    return np.array([[lm[k] for k in LANDMARK_FIELDS] for lm in landmarks_list], dtype=np.float32)
+
+
+def array_to_landmarks(arr):
+    return [dict(zip(LANDMARK_FIELDS, map(float, row))) for row in arr]
+
+
+class PoseStrideScheduler:
+    """
+    決定每個追蹤對象哪些影格要跑姿態估計，其餘影格以線性內插補上。
+    - 關鍵影格：距上次估計滿 stride 格，或邊界框移動超過門檻
+    - 中間影格先記下偵測結果 (dict)，等下一個關鍵影格到達時一次向量化內插、原地填回
+    - 片段結束時仍在等待的影格沿用最後一次的姿態 (flush)
+    classify_fn：(N, 33, 4) 陣列 -> N 個動作名稱 (一次分類整批內插影格)
+    """
+
+    def __init__(self, stride=POSE_STRIDE, motion_threshold=POSE_MOTION_THRESHOLD, classify_fn=None):
+        self.stride = max(1, stride)
+        self.motion_threshold = motion_threshold
+        self.classify_fn = classify_fn
+        self._last = {}      # track_id -> (影格, 邊界框, (33, 4) 陣列)
+        self._pending = {}   # track_id -> [(影格, 偵測 dict)]
+        self.pose_runs = 0
+        self.interpolated = 0
+
+    def should_run(self, track_id, frame_count, bbox):
+        last = self._last.get(track_id)
+        if self.stride == 1 or last is None:
+            return True
+        last_frame, last_bbox, _ = last
+        if frame_count - last_frame >= self.stride:
+            return True
+        # 以框高為尺度衡量中心位移 (遠近不同的球員用同一個門檻)
+        x1, y1, x2, y2 = bbox
+        lx1, ly1, lx2, ly2 = last_bbox
+        height = max(1.0, ly2 - ly1)
+        shift = np.hypot((x1 + x2 - lx1 - lx2) / 2.0, (y1 + y2 - ly1 - ly2) / 2.0)
+        return shift / height > self.motion_threshold
+
+    def add_keyframe(self, track_id, frame_count, bbox, landmarks_arr):
+        """姿態估計完成 (landmarks_arr 為 None 表示沒有偵測到骨架)。"""
+        self.pose_runs += 1
+        last = self._last.get(track_id)
+        pending = self._pending.pop(track_id, [])
+        if pending and last is not None and landmarks_arr is not None:
+            self._interpolate(last[0], last[2], frame_count, landmarks_arr, pending)
+        elif pending and last is not None:
+            self._hold(last[2], pending)
+        if landmarks_arr is not None:
+            self._last[track_id] = (frame_count, bbox, landmarks_arr)
+        else:
+            self._last.pop(track_id, None)
+
+    def add_pending(self, track_id, frame_count, detection):
+        self._pending.setdefault(track_id, []).append((frame_count, detection))
+
+    def settle(self, frame_count):
+        """
+        追蹤對象消失後不會再有下一個關鍵影格：等待超過 stride 格的影格直接沿用最後姿態，
+        讓 frame_count - stride 之前的影格全部確定 (串流寫出前呼叫)。
+        """
+        for track_id in list(self._pending):
+            pending = self._pending[track_id]
+            if pending[-1][0] <= frame_count - self.stride:
+                last = self._last.get(track_id)
+                if last is not None:
+                    self._hold(last[2], pending)
+                del self._pending[track_id]
+
+    def flush(self):
+        for track_id, pending in self._pending.items():
+            last = self._last.get(track_id)
+            if last is not None:
+                self._hold(last[2], pending)
+        self._pending.clear()
+
+    def _interpolate(self, f0, a, f1, b, pending):
+        frames = np.array([f for f, _ in pending], dtype=np.float32)
+        t = ((frames - f0) / max(1, f1 - f0))[:, None, None]
+        filled = a[None] + (b - a)[None] * t          # (N, 33, 4) 一次算完
+        self._fill(pending, filled)
+
+    def _hold(self, arr, pending):
+        self._fill(pending, np.repeat(arr[None], len(pending), axis=0))
+
+    def _fill(self, pending, filled):
+        actions = self.classify_fn(filled) if self.classify_fn else [None] * len(pending)
+        for (_, detection), lm, action in zip(pending, filled, actions):
+            detection["landmarks"] = array_to_landmarks(lm)
+            detection["action"] = action
+            detection["interpolated"] = True
+        self.interpolated += len(pending)
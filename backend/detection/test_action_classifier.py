@@ -0,0 +1,91 @@
+import os
+import ast
+from types import SimpleNamespace
+import numpy as np
+
+from action_classifier import (
+    classify_actions, action_names, NO_ACTION,
+    LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_WRIST, RIGHT_WRIST, LEFT_HIP, RIGHT_HIP,
+)
+
+N_POSES = 20000
+
+
+def load_reference_rule():
+    """
+    直接取 detection.py 裡 classify_badminton_action 的原始碼執行，
+    以假的 mp_pose 代替 MediaPipe，不需要 import detection (OpenCV / MediaPipe / DeepSORT)。
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "detection.py")
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    func = next(n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == "classify_badminton_action")
+    pose_landmark = {
+        "LEFT_SHOULDER": LEFT_SHOULDER, "RIGHT_SHOULDER": RIGHT_SHOULDER,
+        "LEFT_WRIST": LEFT_WRIST, "RIGHT_WRIST": RIGHT_WRIST,
+        "LEFT_HIP": LEFT_HIP, "RIGHT_HIP": RIGHT_HIP,
+    }
+    namespace = {"mp_pose": SimpleNamespace(PoseLandmark=pose_landmark)}
+    exec(compile(ast.Module(body=[func], type_ignores=[]), path, "exec"), namespace)
+    return namespace["classify_badminton_action"]
+
+
+def to_mediapipe(pose):
+    """(33, 4) 陣列 -> 與 MediaPipe 結果相同介面的物件 (landmarks.landmark[i].y)。"""
+    return SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z, visibility=v) for x, y, z, v in pose.tolist()])
+
+
+def random_poses(n=N_POSES, seed=0):
+    """
+    一半取 0.05 的格點 (手腕與肩膀、手腕與髖部等高的情況很常見)，一半取連續值；
+    另外刻意造出手腕 = 肩膀、髖部高低差恰為 0.1 的邊界。
+    """
+    rng = np.random.default_rng(seed)
+    poses = rng.random((n, 33, 4))
+    grid = np.arange(n) % 2 == 0
+    poses[grid, :, 1] = rng.integers(0, 21, size=(grid.sum(), 33)) / 20
+
+    tie = np.arange(n) % 8 == 1
+    poses[tie, LEFT_WRIST, 1] = poses[tie, LEFT_SHOULDER, 1]
+    poses[tie, RIGHT_WRIST, 1] = poses[tie, RIGHT_SHOULDER, 1]
+    swapped = np.arange(n) % 8 == 3
+    poses[swapped, LEFT_WRIST, 1] = poses[swapped, RIGHT_SHOULDER, 1]
+    poses[swapped, RIGHT_WRIST, 1] = poses[swapped, LEFT_SHOULDER, 1]
+    hip_edge = np.arange(n) % 8 == 5
+    poses[hip_edge, RIGHT_HIP, 1] = poses[hip_edge, LEFT_HIP, 1] + 0.1
+    return poses
+
+
+def test_parity_with_classify_badminton_action():
+    reference = load_reference_rule()
+    poses = random_poses()
+
+    expected = [reference(to_mediapipe(pose)) for pose in poses]
+    actual = action_names(classify_actions(poses))
+    mismatches = [i for i, (a, b) in enumerate(zip(expected, actual)) if a != b]
+    assert not mismatches, f"{len(mismatches)} 筆不一致，例如第 {mismatches[0]} 筆：{expected[mismatches[0]]} != {actual[mismatches[0]]}"
+
+    # 確認邊界情況真的有被測到
+    y = poses[..., 1]
+    wrist_y = (y[:, RIGHT_WRIST] + y[:, LEFT_WRIST]) / 2
+    shoulder_y = (y[:, RIGHT_SHOULDER] + y[:, LEFT_SHOULDER]) / 2
+    assert (wrist_y == shoulder_y).sum() > 1000
+    assert set(expected) >= {"Smash", "Drop Shot", "Lift", "Net Shot", "Drive"}
+
+
+def test_parity_on_frame_track_tensor():
+    reference = load_reference_rule()
+    poses = random_poses(600, seed=1).reshape(100, 6, 33, 4)
+
+    codes = classify_actions(poses)
+    assert codes.shape == (100, 6)
+    expected = [[reference(to_mediapipe(p)) for p in frame] for frame in poses]
+    assert [action_names(row) for row in codes] == expected
+
+
+def test_missing_skeleton_is_no_action():
+    poses = random_poses(4)
+    poses[1] = np.nan
+    codes = classify_actions(poses)
+    assert codes[1] == NO_ACTION
+    assert (codes[[0, 2, 3]] != NO_ACTION).all()
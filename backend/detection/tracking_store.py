@@ -0,0 +1,128 @@
+import os
+import json
+import glob
+import numpy as np
+
+# ========== 參數設定 ==========
+# 每個區塊檔包含的影格數
+CHUNK_FRAMES = 300
+NUM_LANDMARKS = 33
+# 動作代碼 (-1 = 無動作 / 沒有骨架)
+ACTION_NAMES = ["Smash", "Drop Shot", "Lift", "Net Shot", "Drive", "Transition"]
+ACTION_CODES = {name: i for i, name in enumerate(ACTION_NAMES)}
+
+COLUMNS = ("frame", "track_id", "bbox", "action", "interpolated", "landmarks")
+
+
+def _track_id_to_int(track_id):
+    try:
+        return int(track_id)
+    except (TypeError, ValueError):
+        return -1
+
+
+class TrackingWriter:
+    """
+    追蹤結果的串流寫入器 (欄式、分塊的 .npz)，取代整段存在記憶體再 json.dump 的做法。
+    - 與 list 相同的 append(frame_record) 介面，可直接傳給推論迴圈
+    - 緩衝超過 CHUNK_FRAMES + hold_frames 格就寫出最舊的一塊，記憶體固定
+    - hold_frames：姿態內插會回頭填補最近幾格，這些影格先留在記憶體；
+      寫出前呼叫 settle_fn(最後影格) 讓排程器把逾期的等待影格補齊
+    輸出目錄：meta.json + chunk_00000.npz, chunk_00001.npz, ...
+    每列是一個 (影格, 追蹤對象)：frame, track_id, bbox(4), action, interpolated, landmarks(33, 4)
+    """
+
+    def __init__(self, directory, chunk_frames=CHUNK_FRAMES, hold_frames=0, settle_fn=None, meta=None):
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        self.hold_frames = hold_frames
+        self.settle_fn = settle_fn
+        self.meta = dict(meta or {})
+        self._buffer = []
+        self._chunks = 0
+        self._rows = 0
+        self._frames = 0
+        os.makedirs(directory, exist_ok=True)
+        for old in glob.glob(os.path.join(directory, "chunk_*.npz")):
+            os.remove(old)
+
+    def append(self, frame_record):
+        self._buffer.append(frame_record)
+        self._frames += 1
+        if len(self._buffer) >= self.chunk_frames + self.hold_frames:
+            if self.settle_fn:
+                self.settle_fn(frame_record["frame"])
+            self._write_chunk(self._buffer[:self.chunk_frames])
+            del self._buffer[:self.chunk_frames]
+
+    def close(self):
+        """寫出剩餘影格與 meta.json (呼叫前應先完成所有內插 flush)。"""
+        if self._buffer:
+            self._write_chunk(self._buffer)
+            self._buffer = []
+        meta = dict(self.meta, frames=self._frames, rows=self._rows, chunks=self._chunks,
+                    actions=ACTION_NAMES, columns=list(COLUMNS))
+        with open(os.path.join(self.directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return self.directory
+
+    def _write_chunk(self, records):
+        rows = [(fd["frame"], d) for fd in records for d in fd["detections"]]
+        n = len(rows)
+        frame = np.empty(n, dtype=np.int32)
+        track_id = np.empty(n, dtype=np.int32)
+        bbox = np.empty((n, 4), dtype=np.int32)
+        action = np.full(n, -1, dtype=np.int8)
+        interpolated = np.zeros(n, dtype=bool)
+        landmarks = np.full((n, NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+
+        for i, (frame_no, d) in enumerate(rows):
+            frame[i] = frame_no
+            track_id[i] = _track_id_to_int(d["id"])
+            bbox[i] = d["bounding_box"]
+            action[i] = ACTION_CODES.get(d.get("action"), -1)
+            interpolated[i] = bool(d.get("interpolated"))
+            lms = d.get("landmarks")
+            if lms:
+                landmarks[i] = [[lm["x"], lm["y"], lm["z"], lm["visibility"]] for lm in lms]
+
+        path = os.path.join(self.directory, f"chunk_{self._chunks:05d}.npz")
+        np.savez_compressed(path, frame=frame, track_id=track_id, bbox=bbox, action=action,
+                            interpolated=interpolated, landmarks=landmarks)
+        self._chunks += 1
+        self._rows += n
+
+
+# ========== 讀取 ==========
+def iter_chunks(directory, columns=COLUMNS):
+    """逐塊讀取 (記憶體只需一塊)，每次回傳 {欄位: 陣列}。"""
+    for path in sorted(glob.glob(os.path.join(directory, "chunk_*.npz"))):
+        with np.load(path) as data:
+            yield {c: data[c] for c in columns}
+
+
+def load_tracking(directory, columns=COLUMNS):
+    """一次載入整段：回傳 {欄位: 陣列}，各欄依列對齊。"""
+    parts = list(iter_chunks(directory, columns))
+    if not parts:
+        empty = {"frame": (0,), "track_id": (0,), "bbox": (0, 4), "action": (0,),
+                 "interpolated": (0,), "landmarks": (0, NUM_LANDMARKS, 4)}
+        return {c: np.zeros(empty[c]) for c in columns}
+    return {c: np.concatenate([p[c] for p in parts]) for c in columns}
+
+
+def load_meta(directory):
+    with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def landmark_tensor(data):
+    """
+    把列式資料轉為 (影格, 追蹤對象, 33, 4) 張量 (沒有資料處為 NaN)。
+    回傳 (張量, 影格編號陣列, 追蹤 ID 陣列)。
+    """
+    frames, frame_idx = np.unique(data["frame"], return_inverse=True)
+    tracks, track_idx = np.unique(data["track_id"], return_inverse=True)
+    tensor = np.full((len(frames), len(tracks), NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+    tensor[frame_idx, track_idx] = data["landmarks"]
+    return tensor, frames, tracks
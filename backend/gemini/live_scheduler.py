@@ -0,0 +1,125 @@
+import time
+import threading
+
+# ========== 參數設定 ==========
+# 每段端到端延遲目標 (片段「播出完畢」到解說稿完成的秒數)
+DEFAULT_TARGET_LATENCY = 20.0
+# 各階段耗時的指數移動平均權重
+EWMA_ALPHA = 0.3
+
+# 降級等級
+LEVEL_FULL = 0        # 正常處理
+LEVEL_SKIP_EXTRAS = 1 # 跳過 [Gap] / [Replay] 等非必要任務
+LEVEL_LITE = 2        # 再改用精簡版 Stage 2 Prompt
+LEVEL_DROP = 3        # 已追不上，整段放棄
+
+LEVEL_NAMES = {
+    LEVEL_FULL: "完整",
+    LEVEL_SKIP_EXTRAS: "略過補白",
+    LEVEL_LITE: "精簡 Prompt",
+    LEVEL_DROP: "跳過片段",
+}
+
+
+class LiveScheduler:
+    """
+    即時模式排程器：把第 i 段影片視為在 t0 + (i+1) * segment_length 時「播完」，
+    追蹤每段處理相對於牆鐘的落後程度 (lag)，落後時依預估完成時間逐級降級。
+    """
+
+    def __init__(self, segment_length=30.0, target_latency=DEFAULT_TARGET_LATENCY):
+        self.segment_length = float(segment_length)
+        self.target_latency = float(target_latency)
+        self.t0 = None
+        self.stage_estimates = {"stage1": 0.0, "stage2": 0.0}
+        self.records = {}
+        self._lock = threading.Lock()
+
+    # ---------- 時間軸 ----------
+    def start(self):
+        self.t0 = time.time()
+
+    def available_at(self, index):
+        """第 index 段 (0 起算) 完整可取得的牆鐘時間。"""
+        return self.t0 + (index + 1) * self.segment_length
+
+    def deadline(self, index):
+        return self.available_at(index) + self.target_latency
+
+    def lag(self, index, now=None):
+        """目前時間落後該段播出時間多少秒 (負值代表還沒播到)。"""
+        now = time.time() if now is None else now
+        return now - self.available_at(index)
+
+    def wait_until_available(self, index):
+        """模擬直播：片段還沒「播完」前不能開始處理。"""
+        remaining = self.available_at(index) - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    # ---------- 降級決策 ----------
+    def degrade_level(self, index, stage):
+        """
+        依「目前落後 + 剩餘階段預估耗時」決定降級等級。
+        stage1 只決定要不要整段放棄；stage2 才會逐級降級。
+        """
+        with self._lock:
+            if stage == "stage1":
+                remaining_cost = self.stage_estimates["stage1"] + self.stage_estimates["stage2"]
+            else:
+                remaining_cost = self.stage_estimates["stage2"]
+        projected = self.lag(index) + remaining_cost
+
+        if projected > self.target_latency * 2.0:
+            return LEVEL_DROP
+        if stage == "stage1":
+            return LEVEL_FULL
+        if projected > self.target_latency * 1.5:
+            return LEVEL_LITE
+        if projected > self.target_latency:
+            return LEVEL_SKIP_EXTRAS
+        return LEVEL_FULL
+
+    # ---------- 紀錄 ----------
+    def record_stage(self, index, stage, elapsed):
+        with self._lock:
+            prev = self.stage_estimates[stage]
+            self.stage_estimates[stage] = elapsed if prev == 0.0 else (EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * prev)
+            self.records.setdefault(index, {})[f"{stage}_time"] = elapsed
+
+    def record_done(self, index, level, skipped=False):
+        now = time.time()
+        with self._lock:
+            rec = self.records.setdefault(index, {})
+            rec["level"] = level
+            rec["skipped"] = skipped
+            rec["finished_at"] = now
+            rec["latency"] = self.lag(index, now)
+            return dict(rec)
+
+    def real_time_factor(self):
+        """
+        整體即時率 = 已花費牆鐘時間 / 已完成片段涵蓋的比賽時間。
+        小於等於 1 代表追得上直播。
+        """
+        with self._lock:
+            finished = [i for i, r in self.records.items() if "finished_at" in r]
+            if not finished or self.t0 is None:
+                return 0.0
+            last = max(finished)
+            elapsed = max(r["finished_at"] for r in self.records.values() if "finished_at" in r) - self.t0
+        return elapsed / ((last + 1) * self.segment_length)
+
+    def summary(self):
+        with self._lock:
+            done = [r for r in self.records.values() if "finished_at" in r]
+        latencies = [r["latency"] for r in done if not r["skipped"]]
+        return {
+            "segments": len(done),
+            "skipped": sum(1 for r in done if r["skipped"]),
+            "degraded": sum(1 for r in done if not r["skipped"] and r["level"] > LEVEL_FULL),
+            "max_latency": max(latencies) if latencies else 0.0,
+            "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "over_budget": sum(1 for l in latencies if l > self.target_latency),
+            "real_time_factor": self.real_time_factor(),
+        }
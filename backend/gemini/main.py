@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import threading
 import queue
@@ -7,6 +8,39 @@ from tqdm import tqdm
 # 引入我們之前改好的單檔處理函式
 from videogen_stage1 import process_single_video_stage1
 from videogen_stage2 import process_single_video_stage2
+from live_scheduler import LiveScheduler, LEVEL_DROP, LEVEL_NAMES
+
+# ========== 即時 (Live) 模式設定 ==========
+# 開啟後每段影片視為在 (i+1) * SEGMENT_LENGTH 秒時才「播完」，
+# 排程器追蹤落後程度，超出延遲預算時自動降級或跳過
+LIVE_MODE = False
+LIVE_TARGET_LATENCY = 20.0     # 每段端到端延遲目標 (秒)
+LIVE_SIMULATE_ARRIVAL = True   # 用預先切好的片段模擬直播到達時間
+SEGMENT_LENGTH = 30.0          # 與 video_splitter 的 segment_length 一致
+
+# ========== 預先過濾 (見 backend/detection/activity_filter.py) ==========
+# 開啟後先在本地以人數 + 畫面動態找出比賽進行中的區間，只把這些區間 (含前後緩衝) 剪成短片上傳給 Stage 1；
+# 略過的區間以 known_gaps 交給 Stage 2 排程。判斷不出比賽畫面時仍上傳整段，不會丟掉片段。
+# 需要 detection/ 的 OpenCV + ONNX 環境與 YOLO 權重，預設關閉
+ACTIVITY_FILTER = False
+
+def prefilter(video_path, clip_folder):
+    # 用到才載入 detection 模組，關閉時不需要 OpenCV / onnxruntime
+    detection_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "detection")
+    if detection_dir not in sys.path:
+        sys.path.append(detection_dir)
+    from activity_filter import prefilter_segment
+    return prefilter_segment(video_path, clip_folder)
+
+# ========== 精華優先 (見 backend/highlight/audio_highlight.py) ==========
+# 開啟後先以音訊能量 (歡呼聲浪 + 擊球撞擊) 為每段評分，分數高的片段優先跑 Stage 1 / Stage 2；
+# 設定 HIGHLIGHT_BUDGET 時超過期限就不再送出新的片段，先完成的都是最精彩的段落
+HIGHLIGHT_MODE = False
+HIGHLIGHT_BUDGET = None        # 精華包的時間預算 (秒)，None = 不限
+HIGHLIGHT_TOP_K = None         # 只處理分數最高的 K 段，None = 全部 (依分數排序)
+if HIGHLIGHT_MODE:
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "highlight"))
+    from audio_highlight import score_segments
 
 # 建立一個無限大小的佇列，用來傳遞 Stage 1 完成的任務給 Stage 2
 task_queue = queue.Queue()
@@ -19,30 +53,54 @@ def format_seconds(seconds):
     return f"{int(seconds // 60)}分 {int(seconds % 60)}秒"
 
 # ========== 執行緒 1：生產者 (負責跑 Stage 1) ==========
-def stage1_producer(video_files, video_folder, event_json_folder, intro_text):
+def stage1_producer(video_files, video_folder, event_json_folder, intro_text, scheduler=None, order=None, deadline=None):
+    """order：處理順序 (片段索引)，None = 依檔名；deadline：精華模式的截止時間 (epoch 秒)"""
     print("👁️ [Stage 1 執行緒] 啟動，開始分析影像...")
+    clip_folder = os.path.join(event_json_folder, "active_clips")
     
-    for i, file_name in enumerate(video_files):
+    for i in (order if order is not None else range(len(video_files))):
+        file_name = video_files[i]
         video_path = os.path.join(video_folder, file_name)
+
+        if deadline and time.time() >= deadline:
+            print(f"⏰ [Stage 1] 已達精華包時間預算，不再送出新的片段")
+            break
+
+        if scheduler:
+            if LIVE_SIMULATE_ARRIVAL:
+                scheduler.wait_until_available(i)
+            if scheduler.degrade_level(i, "stage1") == LEVEL_DROP:
+                scheduler.record_done(i, LEVEL_DROP, skipped=True)
+                print(f"⏭️ [Live] {file_name} 已落後 {scheduler.lag(i):.1f} 秒，跳過此片段")
+                continue
+
         print(f"\n[Stage 1] 正在分析第 {i+1} 支: {file_name}")
         
         # 執行 Stage 1
-        json_path = process_single_video_stage1(video_path, event_json_folder, intro_text)
+        t_start = time.time()
+        activity = prefilter(video_path, clip_folder) if ACTIVITY_FILTER else None
+        segment_deadline = scheduler.deadline(i) if scheduler else deadline
+        json_path = process_single_video_stage1(video_path, event_json_folder, intro_text, deadline=segment_deadline, activity=activity)
+        if scheduler:
+            scheduler.record_stage(i, "stage1", time.time() - t_start)
         
         if json_path and os.path.exists(json_path):
             # 成功！將任務打包放入佇列，讓 Stage 2 去撿
-            # 我們傳遞一個 tuple: (影片路徑, JSON路徑)
-            task_queue.put((video_path, json_path))
+            # 我們傳遞一個 tuple: (影片路徑, JSON路徑, 片段序號)
+            task_queue.put((video_path, json_path, i))
             print(f"✅ [Stage 1] {file_name} 完成 -> 已加入 Stage 2 佇列")
         else:
             print(f"❌ [Stage 1] {file_name} 失敗，不進行後續處理")
+            if scheduler:
+                # 與落後跳過相同，記為略過，summary / RTF 才會涵蓋這一段
+                scheduler.record_done(i, LEVEL_DROP, skipped=True)
 
     # 全部影片都處理完了，放入一個 "毒藥丸 (Poison Pill)" 告訴 Stage 2 可以下班了
     task_queue.put(None)
     print("🏁 [Stage 1 執行緒] 所有影片分析完畢，準備結束。")
 
 # ========== 執行緒 2：消費者 (負責跑 Stage 2) ==========
-def stage2_consumer(final_output_folder):
+def stage2_consumer(final_output_folder, scheduler=None, deadline=None):
     print("✍️ [Stage 2 執行緒] 待命，等待 Stage 1 的產出...")
     
     success_count = 0
@@ -56,14 +114,31 @@ def stage2_consumer(final_output_folder):
             task_queue.task_done()
             break
         
-        video_path, json_path = task
+        video_path, json_path, index = task
         file_name = os.path.basename(video_path)
+
+        if deadline and time.time() >= deadline:
+            print(f"   ⏰ [Stage 2] 已達精華包時間預算，跳過 {file_name}")
+            task_queue.task_done()
+            continue
+
+        level = scheduler.degrade_level(index, "stage2") if scheduler else 0
+        if level == LEVEL_DROP:
+            scheduler.record_done(index, level, skipped=True)
+            print(f"   ⏭️ [Live] {file_name} 已落後 {scheduler.lag(index):.1f} 秒，跳過 Stage 2")
+            task_queue.task_done()
+            continue
         
         print(f"\n   🚀 [Stage 2] 收到任務，開始生成敘事: {file_name}")
+        if level:
+            print(f"   ⚠️ [Live] 落後 {scheduler.lag(index):.1f} 秒，降級模式：{LEVEL_NAMES[level]}")
         
         # 執行 Stage 2
+        t_start = time.time()
         try:
-            result = process_single_video_stage2(video_path, json_path, final_output_folder)
+            segment_deadline = scheduler.deadline(index) if scheduler else deadline
+            result = process_single_video_stage2(video_path, json_path, final_output_folder, degrade_level=level,
+                                                 deadline=segment_deadline, segment_index=index)
             if result:
                 print(f"   ✅ [Stage 2] {file_name} 敘事生成完畢！")
                 success_count += 1
@@ -72,6 +147,11 @@ def stage2_consumer(final_output_folder):
         except Exception as e:
             print(f"   ❌ [Stage 2] 發生錯誤: {e}")
 
+        if scheduler:
+            scheduler.record_stage(index, "stage2", time.time() - t_start)
+            rec = scheduler.record_done(index, level)
+            print(f"   ⏱️ [Live] {file_name} 端到端延遲 {rec['latency']:.1f}s / 目標 {scheduler.target_latency:.0f}s | 即時率 RTF={scheduler.real_time_factor():.2f}")
+
         # 標記此任務已完成
         task_queue.task_done()
 
@@ -100,11 +180,27 @@ def main():
     
     global_start = time.time()
 
+    scheduler = None
+    if LIVE_MODE:
+        scheduler = LiveScheduler(segment_length=SEGMENT_LENGTH, target_latency=LIVE_TARGET_LATENCY)
+        scheduler.start()
+        print(f"📡 [Live 模式] 每段延遲目標 {LIVE_TARGET_LATENCY:.0f} 秒，落後時自動降級。\n")
+
+    # 精華優先：LLM 之前先以音訊能量排序 (直播模式必須依時間順序，不適用)
+    order, highlight_deadline = None, None
+    if HIGHLIGHT_MODE and not LIVE_MODE:
+        ranking = score_segments([os.path.join(video_folder, f) for f in video_files])
+        order = [r["index"] for r in ranking][:HIGHLIGHT_TOP_K]
+        highlight_deadline = global_start + HIGHLIGHT_BUDGET if HIGHLIGHT_BUDGET else None
+        print("🔥 [精華模式] 處理順序：" + ", ".join(f"{video_files[r['index']]}({r['score']:+.2f})" for r in ranking[:len(order)]))
+        if highlight_deadline:
+            print(f"   ⏰ 時間預算 {format_seconds(HIGHLIGHT_BUDGET)}\n")
+
     # 建立並啟動 Stage 1 執行緒
-    t1 = threading.Thread(target=stage1_producer, args=(video_files, video_folder, event_json_folder, intro_text))
+    t1 = threading.Thread(target=stage1_producer, args=(video_files, video_folder, event_json_folder, intro_text, scheduler, order, highlight_deadline))
     
     # 建立並啟動 Stage 2 執行緒
-    t2 = threading.Thread(target=stage2_consumer, args=(final_output_folder,))
+    t2 = threading.Thread(target=stage2_consumer, args=(final_output_folder, scheduler, highlight_deadline))
 
     # 開始跑！
     t1.start()
@@ -120,6 +216,10 @@ def main():
     print(f"🎉 所有流程完美結束！")
     print(f"⏱️ 總耗時：{format_seconds(total_time)}")
     print(f"⚡ 平均每支：{total_time/total_videos:.1f} 秒 (含並行加速)")
+    if scheduler:
+        stats = scheduler.summary()
+        print(f"📡 Live：即時率 RTF={stats['real_time_factor']:.2f} | 平均延遲 {stats['avg_latency']:.1f}s | 最大延遲 {stats['max_latency']:.1f}s")
+        print(f"   超出預算 {stats['over_budget']} 段 | 降級 {stats['degraded']} 段 | 跳過 {stats['skipped']} 段")
     print("="*50)
 
 if __name__ == "__main__":
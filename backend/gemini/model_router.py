@@ -0,0 +1,84 @@
+import time
+import threading
+from collections import deque
+
+# ========== 參數設定 ==========
+# 每個模型保留最近幾次的延遲樣本
+LATENCY_WINDOW = 20
+# 以第幾百分位數當延遲預估 (看尾端延遲而不是平均)
+LATENCY_PERCENTILE = 0.9
+# 沒有樣本時的預設預估 (秒)
+DEFAULT_LATENCY_ESTIMATE = 15.0
+
+# Stage 1 / Stage 2 的模型順序：第一個是主模型，後面是較輕、較快的備援
+DEFAULT_MODEL_CHAIN = ("gemini-2.5-flash", "gemini-2.5-flash-lite")
+
+
+class AllModelsFailed(Exception):
+    """所有模型都呼叫失敗。"""
+
+
+class ModelRouter:
+    """
+    依延遲 SLO 選模型：
+    - 每個模型維護最近 LATENCY_WINDOW 次的延遲，取 P90 當預估
+    - 有 deadline 時，主模型預估會超時就改用第一個來得及的較快模型
+    - 呼叫失敗時依序換下一個模型
+    models：[(模型名稱, 呼叫函式)]，呼叫函式吃 prompt、回傳 replies (可以是本地假模型)
+    """
+
+    def __init__(self, models, window=LATENCY_WINDOW, default_estimate=DEFAULT_LATENCY_ESTIMATE):
+        if not models:
+            raise ValueError("ModelRouter 至少需要一個模型")
+        self.models = list(models)
+        self.default_estimate = default_estimate
+        self._latencies = {name: deque(maxlen=window) for name, _ in self.models}
+        self._lock = threading.Lock()
+
+    def estimate(self, name):
+        with self._lock:
+            samples = sorted(self._latencies[name])
+        if not samples:
+            return self.default_estimate
+        idx = min(int(len(samples) * LATENCY_PERCENTILE), len(samples) - 1)
+        return samples[idx]
+
+    def record(self, name, latency):
+        with self._lock:
+            self._latencies[name].append(latency)
+
+    def _plan(self, deadline):
+        """回傳本次嘗試的模型順序。"""
+        names = [name for name, _ in self.models]
+        if deadline is None:
+            return names
+
+        remaining = deadline - time.time()
+        estimates = {name: self.estimate(name) for name in names}
+        first = next((name for name in names if estimates[name] <= remaining), None)
+        if first is None:
+            # 全都來不及：選預估最快的那個，盡量少超時
+            first = min(names, key=lambda n: estimates[n])
+        return [first] + [name for name in names if name != first]
+
+    def call(self, prompt, deadline=None):
+        """回傳 (replies, 實際產出的模型名稱)。"""
+        funcs = dict(self.models)
+        errors = []
+        for name in self._plan(deadline):
+            t0 = time.perf_counter()
+            try:
+                replies = funcs[name](prompt)
+            except Exception as e:
+                # 失敗也算進延遲樣本 (供應端逾時變慢時預估才會跟著上升)，
+                # 但快速失敗不能把預估拉低，否則會一直被當成「來得及」的模型
+                self.record(name, max(time.perf_counter() - t0, self.estimate(name)))
+                errors.append(f"{name}: {e}")
+                print(f"⚠️ [Router] {name} 呼叫失敗，改用下一個模型：{e}")
+                continue
+            self.record(name, time.perf_counter() - t0)
+            return replies, name
+        raise AllModelsFailed(" | ".join(errors))
+
+    def stats(self):
+        return {name: {"estimate": self.estimate(name), "samples": len(self._latencies[name])} for name, _ in self.models}
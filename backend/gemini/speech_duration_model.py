@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+import json
+from collections import Counter
+import numpy as np
+
+# 音檔長度量測 (見 backend/TextToSpeech/audio_length.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "TextToSpeech"))
+from audio_length import audio_duration
+
+# ========== 參數設定 ==========
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "speech_duration_model.json")
+DEFAULT_VOICE = "cmn-TW-Wavenet-A"
+# 每個 (聲音, 情緒) 至少要有幾筆樣本才單獨擬合，不足時退回該聲音的整體模型
+MIN_SAMPLES_PER_GROUP = 8
+# 嶺迴歸強度 (樣本少時避免係數亂跳)
+RIDGE_LAMBDA = 1e-2
+# 與 generate_tts_google 一致：沒有指定語速時的預設值與語速上下限
+TTS_DEFAULT_RATE = 1.2
+TTS_RATE_RANGE = (0.75, 2.0)
+MANIFEST_NAME = "manifest.json"
+
+# 特徵：[中文字數, 英文字數, 標點數, 常數項]
+FEATURE_NAMES = ["cjk", "en_words", "punct", "bias"]
+# 舊版 estimate_speech_time 的固定權重 (1.0 / 1.3 / 0.4 音節，每秒 4 音節)
+HEURISTIC_COEF = [1.0 / 4.0, 1.3 / 4.0, 0.4 / 4.0, 0.0]
+
+# 單次掃描同時取出中文字、標點與英文字 (取代原本的四次 regex)
+# 英文字含縮寫與連字號 (don't、world-class 算一個字)，數字不算英文字
+TOKEN_RE = re.compile(r"(?P<cjk>[\u4e00-\u9fff])|(?P<punct>[，。！,.])|(?P<en>[A-Za-z]+(?:['-][A-Za-z]+)*)")
+
+
+# ========== 特徵 ==========
+def extract_features(texts):
+    """texts -> (N, 4) float 陣列。"""
+    feats = np.zeros((len(texts), len(FEATURE_NAMES)), dtype=np.float64)
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        counts = Counter(m.lastgroup for m in TOKEN_RE.finditer(text))
+        feats[i, 0] = counts["cjk"]
+        feats[i, 1] = counts["en"]
+        feats[i, 2] = counts["punct"]
+        feats[i, 3] = 1.0
+    return feats
+
+
+# ========== 模型 ==========
+class SpeechDurationModel:
+    """
+    預測語速 1.0 時的朗讀秒數：duration * rate ≈ features · coef。
+    係數依 "聲音|情緒" 分組，找不到時依序退回 "聲音|*"、"*|*" (預設為舊版經驗公式)。
+    """
+
+    def __init__(self, coefficients=None):
+        self.coefficients = {"*|*": list(HEURISTIC_COEF)}
+        if coefficients:
+            self.coefficients.update(coefficients)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f).get("coefficients", {}))
+
+    def save(self, path=MODEL_PATH, stats=None):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"features": FEATURE_NAMES, "coefficients": self.coefficients, "stats": stats or {}},
+                      f, ensure_ascii=False, indent=2)
+
+    def _coef(self, voice, emotion):
+        for key in (f"{voice}|{emotion}", f"{voice}|*", "*|*"):
+            if key in self.coefficients:
+                return self.coefficients[key]
+        return HEURISTIC_COEF
+
+    def syllables_per_second(self, voice=DEFAULT_VOICE):
+        """每個中文字的秒數倒數，供 Stage 2 換算音節上限。"""
+        per_char = self._coef(voice, "*")[0]
+        return 1.0 / per_char if per_char > 0 else 4.0
+
+    def predict(self, texts, emotions=None, rates=None, voice=DEFAULT_VOICE):
+        """向量化預測：一次算完一整段的所有句子。回傳秒數陣列。"""
+        if not texts:
+            return np.zeros(0, dtype=np.float64)
+        feats = extract_features(texts)
+        emotions = emotions or ["*"] * len(texts)
+        coef = np.array([self._coef(voice, e) for e in emotions], dtype=np.float64)
+        base = np.maximum((feats * coef).sum(axis=1), 0.0)
+        if rates is not None:
+            base = base / np.maximum(np.asarray(rates, dtype=np.float64), 1e-3)
+        return base
+
+
+def fit_coefficients(feats, targets):
+    """嶺迴歸擬合，係數限制為非負。"""
+    a = feats.T @ feats + RIDGE_LAMBDA * np.eye(feats.shape[1])
+    coef = np.linalg.solve(a, feats.T @ targets)
+    return np.maximum(coef, 0.0)
+
+
+def fit_model(samples):
+    """
+    samples：[{"voice", "emotion", "text", "rate", "duration"}]
+    以實際合成的長度 (換算回語速 1.0) 擬合每組係數，回傳 (模型, 統計)。
+    """
+    groups = {}
+    for s in samples:
+        groups.setdefault((s["voice"], s["emotion"]), []).append(s)
+        groups.setdefault((s["voice"], "*"), []).append(s)
+
+    coefficients, stats = {}, {}
+    heuristic = SpeechDurationModel()
+    for (voice, emotion), rows in sorted(groups.items()):
+        if len(rows) < MIN_SAMPLES_PER_GROUP:
+            continue
+        feats = extract_features([r["text"] for r in rows])
+        rates = np.array([r["rate"] for r in rows], dtype=np.float64)
+        durations = np.array([r["duration"] for r in rows], dtype=np.float64)
+        coef = fit_coefficients(feats, durations * rates)
+
+        key = f"{voice}|{emotion}"
+        coefficients[key] = [round(float(c), 5) for c in coef]
+        fitted_mae = float(np.abs(feats @ coef / rates - durations).mean())
+        heuristic_mae = float(np.abs(heuristic.predict([r["text"] for r in rows], rates=rates) - durations).mean())
+        stats[key] = {"samples": len(rows), "mae": round(fitted_mae, 3), "heuristic_mae": round(heuristic_mae, 3)}
+    return SpeechDurationModel(coefficients), stats
+
+
+# ========== 校正資料來源 ==========
+def load_samples_from_tts_cache(index_path):
+    """TTS 全域快取的索引已記錄每個音檔的 文本 / 情緒 / 語速 / 聲音 / 實測長度。"""
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, "r", encoding="utf-8") as f:
+        entries = json.load(f).get("entries", {})
+    samples = []
+    for entry in entries.values():
+        meta = entry.get("meta", {})
+        if meta.get("duration") and meta.get("text"):
+            samples.append({
+                "voice": meta.get("voice", DEFAULT_VOICE),
+                "emotion": meta.get("emotion", "平穩"),
+                "text": meta["text"],
+                "rate": meta.get("rate", 1.0),
+                "duration": meta["duration"],
+            })
+    return samples
+
+
+def load_samples_from_narratives(narrative_folder, voice=DEFAULT_VOICE):
+    """Stage 2 解說 JSON 經 TTS 後會寫回 tts_rate / tts_duration。"""
+    samples = []
+    for name in sorted(os.listdir(narrative_folder)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(narrative_folder, name), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for item in data.get("commentary", []):
+            if item.get("tts_duration") and item.get("tts_rate"):
+                samples.append({
+                    "voice": voice,
+                    "emotion": item.get("emotion", "平穩"),
+                    "text": item["text"],
+                    "rate": item["tts_rate"],
+                    "duration": item["tts_duration"],
+                })
+    return samples
+
+
+def narrative_rate(item):
+    """實際合成語速：TTS 寫回的 tts_rate，否則依 generate_tts_google.resolve_rate 的規則推算。"""
+    if item.get("tts_rate"):
+        return item["tts_rate"]
+    speed = item.get("tts_speed", item.get("speed"))
+    if speed is not None and float(speed) > 0:
+        return max(TTS_RATE_RANGE[0], min(float(speed), TTS_RATE_RANGE[1]))
+    return TTS_DEFAULT_RATE
+
+
+def segment_audio_files(segment_dir, commentary):
+    """旁白序號 -> 音檔路徑：優先查 manifest.json，沒有索引的舊資料夾依 {序號}_{情緒}.mp3/.wav 命名規則。"""
+    manifest_path = os.path.join(segment_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            lines = json.load(f).get("lines", {})
+        return {int(idx): os.path.join(segment_dir, line["file"]) for idx, line in lines.items()}
+    files = {}
+    for idx, item in enumerate(commentary):
+        for ext in ("mp3", "wav"):
+            path = os.path.join(segment_dir, f"{idx+1:03d}_{item.get('emotion', '平穩')}.{ext}")
+            if os.path.exists(path):
+                files[idx] = path
+                break
+    return files
+
+
+def load_samples_from_segment_audio(narrative_folder, tts_folder, voice=DEFAULT_VOICE):
+    """
+    直接量測既有的片段音檔 (只讀 MP3 標頭，不需解碼)，對照 Stage 2 解說 JSON 的文本 / 情緒 / 語速。
+    快取索引還沒有記錄長度的舊資料也能拿來校正。
+    """
+    samples = []
+    for name in sorted(os.listdir(narrative_folder)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(narrative_folder, name), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        commentary = data.get("commentary", [])
+        segment_name = data.get("segment", os.path.splitext(name)[0]).replace(".mp4", "")
+        segment_dir = os.path.join(tts_folder, segment_name)
+        if not commentary or not os.path.isdir(segment_dir):
+            continue
+        for idx, path in sorted(segment_audio_files(segment_dir, commentary).items()):
+            if idx >= len(commentary) or not os.path.exists(path):
+                continue
+            item = commentary[idx]
+            duration = audio_duration(path)
+            if duration and item.get("text"):
+                samples.append({
+                    "voice": voice,
+                    "emotion": item.get("emotion", "平穩"),
+                    "text": item["text"],
+                    "rate": narrative_rate(item),
+                    "duration": round(duration, 3),
+                })
+    return samples
+
+
+# ========== 獨立運行模式 (校正) ==========
+if __name__ == "__main__":
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tts_index = os.path.join(backend_dir, "TextToSpeech", "tts_cache", "index.json")
+    narrative_folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(backend_dir, "gemini", "final_narratives")
+    tts_folder = sys.argv[2] if len(sys.argv) > 2 else os.path.join(backend_dir, "TextToSpeech", "final_tts_google")
+
+    # 依序：快取索引的實測長度 -> 量測片段資料夾裡的音檔 -> 解說 JSON 寫回的 tts_duration
+    samples = load_samples_from_tts_cache(tts_index)
+    if not samples and os.path.exists(narrative_folder) and os.path.exists(tts_folder):
+        samples = load_samples_from_segment_audio(narrative_folder, tts_folder)
+    if not samples and os.path.exists(narrative_folder):
+        samples = load_samples_from_narratives(narrative_folder)
+
+    if not samples:
+        print("❌ 找不到任何實測長度，請先執行 TTS 產生音檔。")
+        sys.exit(1)
+
+    model, stats = fit_model(samples)
+    model.save(stats=stats)
+    print(f"✅ 以 {len(samples)} 筆實測長度完成校正 -> {MODEL_PATH}")
+    for key, st in stats.items():
+        print(f"   {key}: {st['samples']} 筆 | MAE {st['mae']:.3f}s (舊公式 {st['heuristic_mae']:.3f}s)")
@@ -0,0 +1,81 @@
+import time
+import pytest
+
+from model_router import ModelRouter, AllModelsFailed
+
+
+def make_model(reply="ok", error=None):
+    calls = []
+
+    def _call(prompt):
+        calls.append(prompt)
+        if error:
+            raise RuntimeError(error)
+        return [reply]
+
+    return _call, calls
+
+
+def test_no_deadline_uses_primary():
+    primary, primary_calls = make_model("primary")
+    backup, backup_calls = make_model("backup")
+    router = ModelRouter([("primary", primary), ("backup", backup)])
+
+    assert router.call("p") == (["primary"], "primary")
+    assert primary_calls == ["p"] and backup_calls == []
+
+
+def test_deadline_falls_back_to_faster_model():
+    primary, primary_calls = make_model("primary")
+    backup, backup_calls = make_model("backup")
+    router = ModelRouter([("primary", primary), ("backup", backup)])
+    for _ in range(5):
+        router.record("primary", 10.0)
+        router.record("backup", 1.0)
+
+    assert router.call("p", deadline=time.time() + 3.0) == (["backup"], "backup")
+    assert primary_calls == []
+    # 時間充裕時仍用主模型
+    assert router.call("p", deadline=time.time() + 30.0) == (["primary"], "primary")
+
+
+def test_deadline_nobody_fits_picks_fastest_estimate():
+    primary, _ = make_model("primary")
+    backup, _ = make_model("backup")
+    router = ModelRouter([("primary", primary), ("backup", backup)])
+    router.record("primary", 10.0)
+    router.record("backup", 5.0)
+
+    assert router.call("p", deadline=time.time() + 1.0)[1] == "backup"
+
+
+def test_failure_moves_to_next_model():
+    primary, primary_calls = make_model(error="quota")
+    backup, backup_calls = make_model("backup")
+    router = ModelRouter([("primary", primary), ("backup", backup)])
+
+    assert router.call("p") == (["backup"], "backup")
+    assert primary_calls == ["p"] and backup_calls == ["p"]
+
+
+def test_all_models_failed():
+    primary, _ = make_model(error="quota")
+    backup, _ = make_model(error="timeout")
+    router = ModelRouter([("primary", primary), ("backup", backup)])
+
+    with pytest.raises(AllModelsFailed) as exc:
+        router.call("p", deadline=time.time() + 30.0)
+    assert "primary: quota" in str(exc.value) and "backup: timeout" in str(exc.value)
+
+
+def test_fast_failure_does_not_lower_estimate():
+    primary, _ = make_model(error="quota")
+    backup, _ = make_model("backup")
+    router = ModelRouter([("primary", primary), ("backup", backup)], default_estimate=15.0)
+
+    for _ in range(5):
+        router.call("p")
+    assert router.estimate("primary") >= 15.0
+    # 主模型快速失敗後，短 deadline 仍不會被當成來得及的模型
+    router.record("backup", 1.0)
+    assert router._plan(time.time() + 5.0)[0] == "backup"
@@ -1,5 +1,7 @@
 import os
+import sys
 import json
+from typing import Optional
 import time
 from moviepy.editor import VideoFileClip
 from vertexai.generative_models import Part
@@ -15,6 +17,13 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 cred_path = os.path.join(PROJECT_ROOT, "credentials", "ai-anchor-462506-7887b7105f6a.json")
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
 
+# 錄製 / 重播卡帶 (見 backend/replay/cassette.py)
+sys.path.append(os.path.join(PROJECT_ROOT, "replay"))
+from cassette import get_cassette
+
+# 延遲 SLO 模型路由 (見 model_router.py)
+from model_router import ModelRouter, DEFAULT_MODEL_CHAIN
+
 # ========== 2. 關鍵參數 ==========
 MIN_CHUNK_DURATION = 2.0 
 
@@ -35,6 +44,23 @@ def format_time_str(seconds):
     s = seconds % 60
     return f"{m}:{s:04.1f}"
 
+def clip_to_source_time(t, windows):
+    """剪輯後短片的時間 -> 原片段時間 (windows 為依序接起來的 [開始, 結束] 區間)。"""
+    clip_cursor = 0.0
+    for start, end in windows:
+        span = end - start
+        if t <= clip_cursor + span:
+            return start + max(0.0, t - clip_cursor)
+        clip_cursor += span
+    return windows[-1][1] if windows else t
+
+def remap_event_times(events, windows):
+    for event in events:
+        for key in ("start_time", "end_time"):
+            if event.get(key):
+                event[key] = format_time_str(clip_to_source_time(parse_time_str(event[key]), windows))
+    return events
+
 # ========== 4. 組件與 Pipeline 初始化 (全域單次) ==========
 @component
 class Upload2GCS:
@@ -42,12 +68,15 @@ class Upload2GCS:
         self.bucket_name = bucket_name
     @component.output_types(uri=str)
     def run(self, file_path: str):
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(self.bucket_name)
         file_name = os.path.basename(file_path)
-        blob = bucket.blob(file_name)
-        blob.upload_from_filename(file_path)
-        return {"uri": f"gs://{self.bucket_name}/{file_name}"}
+        def _upload():
+            storage_client = storage.Client()
+            bucket = storage_client.bucket(self.bucket_name)
+            blob = bucket.blob(file_name)
+            blob.upload_from_filename(file_path)
+            return f"gs://{self.bucket_name}/{file_name}"
+        request = {"bucket": self.bucket_name, "file_name": file_name}
+        return {"uri": get_cassette().call("gcs_upload", request, _upload)}
 
 @component
 class AddVideo2Prompt:
@@ -57,12 +86,26 @@ class AddVideo2Prompt:
 
 @component
 class GeminiGenerator:
-    def __init__(self, project_id, location, model):
-        self.project_id, self.location, self.model = project_id, location, model
-    @component.output_types(replies=list)
-    def run(self, prompt: list):
-        generator = VertexAIGeminiGenerator(project_id=self.project_id, location=self.location, model=self.model)
-        return {"replies": generator.run(prompt)["replies"]}
+    """
+    models：模型順序 (主模型在前、較快的備援在後)，由 ModelRouter 依延遲預估與 deadline 挑選。
+    router：可直接傳入自訂 ModelRouter (例如本地假模型) 取代 Vertex AI。
+    """
+    def __init__(self, project_id, location, models=DEFAULT_MODEL_CHAIN, router=None):
+        self.project_id, self.location = project_id, location
+        self.router = router or ModelRouter([(m, lambda prompt, m=m: self._call_vertex(m, prompt)) for m in models])
+
+    def _call_vertex(self, model, prompt):
+        def _call():
+            generator = VertexAIGeminiGenerator(project_id=self.project_id, location=self.location, model=model)
+            return generator.run(prompt)["replies"]
+        # 經過卡帶層：record 模式會錄下請求與回應，replay 模式直接讀回不連網
+        request = {"model": model, "prompt": prompt}
+        return get_cassette().call("gemini", request, _call)
+
+    @component.output_types(replies=list, model=str)
+    def run(self, prompt: list, deadline: Optional[float] = None):
+        replies, model = self.router.call(prompt, deadline=deadline)
+        return {"replies": replies, "model": model}
 
 event_analysis_template = """ 
 1. 角色 (Role)
@@ -160,32 +203,37 @@ pipeline_upload = Pipeline()
 pipeline_upload.add_component(instance=upload2gcs, name="upload2gcs")
 
 add_video_2_prompt = AddVideo2Prompt()
-gemini_generator = GeminiGenerator(project_id="ai-anchor-462506", location="us-central1", model="gemini-2.5-flash")
+gemini_generator = GeminiGenerator(project_id="ai-anchor-462506", location="us-central1")
 pipeline_event_analysis = Pipeline()
 pipeline_event_analysis.add_component(instance=prompt_builder_event, name="prompt_builder") 
 pipeline_event_analysis.add_component(instance=add_video_2_prompt, name="add_video")
 pipeline_event_analysis.add_component(instance=gemini_generator, name="llm")
 pipeline_event_analysis.connect("prompt_builder", "add_video")
-pipeline_event_analysis.connect("add_video.prompt", "llm")
+pipeline_event_analysis.connect("add_video.prompt", "llm.prompt")
 
 # ========== 5. 核心功能：處理單一影片 ==========
-def process_single_video_stage1(video_path, output_folder, intro_text):
+def process_single_video_stage1(video_path, output_folder, intro_text, deadline=None, activity=None):
     """
     處理單一影片：上傳 -> 分析 -> 存檔
+    deadline：即時模式下此段的截止時間 (epoch 秒)，主模型來不及時改用較快的模型
+    activity：backend/detection/activity_filter.py 的預先過濾結果；有剪輯短片時只上傳短片，
+              事件時間換算回原片段，略過的區間記為 known_gaps 交給 Stage 2
     回傳：成功生成的 JSON 路徑 (若失敗回傳 None)
     """
     os.makedirs(output_folder, exist_ok=True)
     file_name = os.path.basename(video_path)
+    clip_path = activity.get("clip") if activity and activity.get("status") == "success" else None
     
     try:
         # Step 1: Upload
-        upload_result = pipeline_upload.run({"upload2gcs": {"file_path": video_path}})
+        upload_result = pipeline_upload.run({"upload2gcs": {"file_path": clip_path or video_path}})
         video_uri = upload_result["upload2gcs"]["uri"]
 
         # Step 2: Analyze
         event_result = pipeline_event_analysis.run({
             "add_video": {"uri": video_uri},
-            "prompt_builder": {"intro": intro_text}
+            "prompt_builder": {"intro": intro_text},
+            "llm": {"deadline": deadline}
         })
         
         replies = event_result["llm"]["replies"]
@@ -204,12 +252,18 @@ def process_single_video_stage1(video_path, output_folder, intro_text):
         event_data = json.loads(json_str) 
         
         processed_events = event_data
+        if clip_path:
+            processed_events = remap_event_times(event_data, activity["windows"])
         
         final_event_data = {
             "segment_video_uri": video_uri,
             "intro": intro_text,
+            "model": event_result["llm"]["model"],
             "events": processed_events
         }
+        if clip_path:
+            final_event_data["active_windows"] = activity["windows"]
+            final_event_data["known_gaps"] = activity["known_gaps"]
         
         json_filename = f"{os.path.splitext(file_name)[0]}_event.json"
         output_path = os.path.join(output_folder, json_filename)
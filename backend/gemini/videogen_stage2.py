@@ -1,7 +1,9 @@
 import os
+import sys
 import json
 import re
 from datetime import timedelta
+from typing import Optional
 from moviepy.editor import VideoFileClip
 from vertexai.generative_models import Part
 from haystack_integrations.components.generators.google_vertex import VertexAIGeminiGenerator
@@ -14,8 +16,19 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 cred_path = os.path.join(PROJECT_ROOT, "credentials", "ai-anchor-462506-7887b7105f6a.json")
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
 
+# 錄製 / 重播卡帶 (見 backend/replay/cassette.py)
+sys.path.append(os.path.join(PROJECT_ROOT, "replay"))
+from cassette import get_cassette
+
+# 延遲 SLO 模型路由 (見 model_router.py)
+from model_router import ModelRouter, DEFAULT_MODEL_CHAIN
+
+# 語音時長模型 (見 speech_duration_model.py；未校正時等同舊版經驗公式)
+from speech_duration_model import SpeechDurationModel
+DURATION_MODEL = SpeechDurationModel.load()
+
 # ========== 2. 關鍵參數 ==========
-SYLLABLES_PER_SEC = 4.0      
+SYLLABLES_PER_SEC = DURATION_MODEL.syllables_per_second()
 MIN_EVENT_DURATION = 1.0      
 MAX_RALLY_DURATION = 4.5
 MIN_GAP_DURATION = 3.0        
@@ -24,8 +37,14 @@ MERGE_THRESHOLD = 1.2
 
 # 全域歷史紀錄
 NARRATIVE_HISTORY = [] 
+# 依片段序號保存的歷史：亂序處理 (精華模式) 時只取序號較小的片段當前情提要
+NARRATIVE_HISTORY_BY_INDEX = {}
 HISTORY_WINDOW_SIZE = 3 
 
+# 即時模式降級設定 (見 live_scheduler.py)
+LIVE_SKIPPABLE_TYPES = ("GAP", "REPLAY")   # degrade_level >= 1 時略過
+LITE_HISTORY_WINDOW_SIZE = 1               # degrade_level >= 2 時只帶最近一段歷史
+
 # ========== 3. 工具函數 ==========
 def seconds_to_timecode(seconds):
     m, s = divmod(seconds, 60)
@@ -48,15 +67,23 @@ def parse_time_str(t_str):
         return sec
     except: return 0.0
 
-def estimate_speech_time(text):
+def estimate_speech_time(text, emotion="*"):
     if not text: return 0.0
-    chinese_chars = re.findall(r'[\u4e00-\u9fff]', text)
-    text_no_zh = re.sub(r'[\u4e00-\u9fff]', ' ', text)
-    text_clean_en = re.sub(r'[^\w\s]', '', text_no_zh)
-    english_words = text_clean_en.split()
-    count_punc = len(re.findall(r'[，。！,.]', text))
-    total_units = (len(chinese_chars) * 1.0) + (len(english_words) * 1.3) + (count_punc * 0.4)
-    return total_units / SYLLABLES_PER_SEC
+    return float(DURATION_MODEL.predict([text], emotions=[emotion])[0])
+
+def classify_emotion(task):
+    content_lower = task["raw_content"].lower()
+    task_type = task["type"]
+
+    if task_type == "INTRO": return "舒緩"
+    if task_type == "OUTRO": return "激動"
+    if task_type == "REPLAY": return "專業"
+    if task_type == "GAP": return "舒緩"
+    if any(k in content_lower for k in ["score", "smash", "kill", "won", "winner"]): return "激動"
+    if any(k in content_lower for k in ["defense", "save", "foul", "out", "mistake"]): return "緊張"
+    if any(k in content_lower for k in ["serve", "prepare"]): return "舒緩"
+    if any(k in content_lower for k in ["miss", "error", "fail"]): return "遺憾"
+    return "平穩"
 
 # ========== 4. Pipeline 初始化 ==========
 @component
@@ -67,12 +94,26 @@ class AddVideo2Prompt:
 
 @component
 class GeminiGenerator:
-    def __init__(self, project_id, location, model):
-        self.project_id, self.location, self.model = project_id, location, model
-    @component.output_types(replies=list)
-    def run(self, prompt: list):
-        generator = VertexAIGeminiGenerator(project_id=self.project_id, location=self.location, model=self.model)
-        return {"replies": generator.run(prompt)["replies"]}
+    """
+    models：模型順序 (主模型在前、較快的備援在後)，由 ModelRouter 依延遲預估與 deadline 挑選。
+    router：可直接傳入自訂 ModelRouter (例如本地假模型) 取代 Vertex AI。
+    """
+    def __init__(self, project_id, location, models=DEFAULT_MODEL_CHAIN, router=None):
+        self.project_id, self.location = project_id, location
+        self.router = router or ModelRouter([(m, lambda prompt, m=m: self._call_vertex(m, prompt)) for m in models])
+
+    def _call_vertex(self, model, prompt):
+        def _call():
+            generator = VertexAIGeminiGenerator(project_id=self.project_id, location=self.location, model=model)
+            return generator.run(prompt)["replies"]
+        # 經過卡帶層：record 模式會錄下請求與回應，replay 模式直接讀回不連網
+        request = {"model": model, "prompt": prompt}
+        return get_cassette().call("gemini", request, _call)
+
+    @component.output_types(replies=list, model=str)
+    def run(self, prompt: list, deadline: Optional[float] = None):
+        replies, model = self.router.call(prompt, deadline=deadline)
+        return {"replies": replies, "model": model}
 
 # ========== 5. Prompt 模板 ==========
 narrative_template = """ 
@@ -133,11 +174,23 @@ narrative_template = """
 請輸出 JSON：
 """
 
+# ⚡ 即時模式落後時使用的精簡版 Prompt (較短的輸入 -> 較快的回應)
+narrative_template_lite = """ 
+你是熱血的羽球賽事主播，請結合 JSON 事件與畫面，為每個 id 寫一句口語化、適合朗讀的解說。
+- 比賽背景：{{ intro }}
+- 前情提要：{{ prev_context }}
+- 規則：嚴守 `constraint` 音節上限；[Summary] 一句話總結；[Intro] 簡短開場；[Outro] 總結得分；未出現 [Score] 不可宣告得分；禁止 Markdown。
+- 輸出純 JSON 陣列，每個物件包含 `id` 和 `text`。
+
+📊 數據：
+{{ event_data }}
+"""
+
 # 🔥 [修正] 必須包含 "intro"，否則會報 Input not found 錯誤
 prompt_builder = PromptBuilder(template=narrative_template, required_variables=["event_data", "prev_context", "intro"])
 
 add_video_s2 = AddVideo2Prompt()
-gemini_s2 = GeminiGenerator(project_id="ai-anchor-462506", location="us-central1", model="gemini-2.5-flash")
+gemini_s2 = GeminiGenerator(project_id="ai-anchor-462506", location="us-central1")
 
 pipeline_s2 = Pipeline()
 pipeline_s2.add_component(instance=prompt_builder, name="prompt_builder")
@@ -146,9 +199,28 @@ pipeline_s2.add_component(instance=gemini_s2, name="llm")
 pipeline_s2.connect("prompt_builder.prompt", "add_video.prompt")
 pipeline_s2.connect("add_video.prompt", "llm.prompt")
 
+# 精簡版 Pipeline (Haystack 的組件不能同時掛在兩條 Pipeline 上，需另建實例)
+prompt_builder_lite = PromptBuilder(template=narrative_template_lite, required_variables=["event_data", "prev_context", "intro"])
+add_video_s2_lite = AddVideo2Prompt()
+gemini_s2_lite = GeminiGenerator(project_id="ai-anchor-462506", location="us-central1")
+
+pipeline_s2_lite = Pipeline()
+pipeline_s2_lite.add_component(instance=prompt_builder_lite, name="prompt_builder")
+pipeline_s2_lite.add_component(instance=add_video_s2_lite, name="add_video")
+pipeline_s2_lite.add_component(instance=gemini_s2_lite, name="llm")
+pipeline_s2_lite.connect("prompt_builder.prompt", "add_video.prompt")
+pipeline_s2_lite.connect("add_video.prompt", "llm.prompt")
+
 
 # ========== 7. 核心功能：處理單一影片 (最終完整版) ==========
-def process_single_video_stage2(video_path, event_json_path, output_folder):
+def process_single_video_stage2(video_path, event_json_path, output_folder, degrade_level=0, deadline=None, segment_index=None):
+    """
+    degrade_level：即時模式落後時的降級等級 (0 = 完整處理)
+      >= 1：略過 [Gap] / [Replay] 任務
+      >= 2：改用精簡版 Prompt，歷史只帶最近一段
+    deadline：此段的截止時間 (epoch 秒)，主模型預估來不及時由 ModelRouter 改用較快的模型
+    segment_index：片段序號；有傳入時歷史只取序號在此之前的片段，處理順序不是時間順序也不會錯亂
+    """
     global NARRATIVE_HISTORY
 
     os.makedirs(output_folder, exist_ok=True)
@@ -166,6 +238,8 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
             video_uri = data.get("video_uri", "") or data.get("segment_video_uri", "")
             # 🔥 讀取 intro，解決身分失憶問題
             current_intro = data.get("intro", "這是一場精彩的羽球比賽，請根據畫面解說。")
+            # 預先過濾略過的非比賽區間 (見 backend/detection/activity_filter.py)
+            known_gaps = data.get("known_gaps", [])
     except Exception as e:
         print(f"❌ 讀取 JSON 失敗: {e}")
         return None
@@ -261,6 +335,17 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
             "content": final_content
         })
 
+    # 已知空檔 (死球 / 重播 / 觀眾畫面，未送 Stage 1) 直接排進時間軸
+    for gap_start, gap_end in known_gaps:
+        if gap_end - gap_start < MIN_GAP_DURATION: continue
+        narrative_blocks.append({
+            "type": "GAP",
+            "raw_start": gap_start,
+            "raw_end": gap_end,
+            "content": "[Gap] 比賽暫停 (死球、重播或場邊畫面)，描述球員狀態、比分或心理。"
+        })
+    narrative_blocks.sort(key=lambda b: b["raw_start"])
+
     # ==========================================
     # Phase 2: 預先排程 (含反應延遲 + 智慧音節)
     # ==========================================
@@ -402,6 +487,9 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
             "prompt_content": "[Outro] 本回合結束，總結剛才的精彩表現。"
         })
 
+    if degrade_level >= 1:
+        scheduled_tasks = [t for t in scheduled_tasks if t["type"] not in LIVE_SKIPPABLE_TYPES]
+
     if not scheduled_tasks: return None
 
     # ==========================================
@@ -415,23 +503,33 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
             "content": task["prompt_content"]
         })
         
-    if NARRATIVE_HISTORY:
-        recent_history = NARRATIVE_HISTORY[-HISTORY_WINDOW_SIZE:]
+    use_lite = degrade_level >= 2
+    window_size = LITE_HISTORY_WINDOW_SIZE if use_lite else HISTORY_WINDOW_SIZE
+
+    if segment_index is not None:
+        history = [NARRATIVE_HISTORY_BY_INDEX[i] for i in sorted(NARRATIVE_HISTORY_BY_INDEX) if i < segment_index]
+    else:
+        history = NARRATIVE_HISTORY
+    if history:
+        recent_history = history[-window_size:]
         history_str = "\n".join([f"- {h}" for h in recent_history])
     else:
         history_str = "這是比賽的第一個片段，請直接開始解說。"
 
     try:
         # 🔥 傳入 intro 到 Pipeline
-        res = pipeline_s2.run({
+        pipeline = pipeline_s2_lite if use_lite else pipeline_s2
+        res = pipeline.run({
             "add_video": {"uri": video_uri},
             "prompt_builder": {
-                "event_data": json.dumps(llm_input_data, ensure_ascii=False, indent=2),
+                "event_data": json.dumps(llm_input_data, ensure_ascii=False, indent=None if use_lite else 2),
                 "prev_context": history_str,
                 "intro": current_intro 
-            }
+            },
+            "llm": {"deadline": deadline}
         })
         reply = res["llm"]["replies"][0].strip()
+        model_used = res["llm"]["model"]
         if "```" in reply:
             match = re.search(r'\[.*\]', reply, re.DOTALL)
             if match: reply = match.group()
@@ -448,9 +546,13 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
     segment_texts = []
     num_tasks = len(scheduled_tasks)
 
+    # 情緒先判斷，整段的朗讀時長一次向量化預估 (依 聲音 / 情緒 校正過的模型)
+    task_texts = [generated_map.get(str(task["id"]), "") for task in scheduled_tasks]
+    task_emotions = [classify_emotion(task) for task in scheduled_tasks]
+    estimated_durs = DURATION_MODEL.predict(task_texts, emotions=task_emotions)
+
     for i, task in enumerate(scheduled_tasks):
-        tid = str(task["id"])
-        text = generated_map.get(tid, "")
+        text = task_texts[i]
         if not text: continue
         
         final_start = task["final_start"]
@@ -463,7 +565,7 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
             hard_limit_end = total_duration
             
         # 🔥 雙重檢查
-        estimated_dur = estimate_speech_time(text)
+        estimated_dur = float(estimated_durs[i])
         calculated_end = final_start + estimated_dur
         final_end = min(calculated_end, hard_limit_end)
         
@@ -479,18 +581,7 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
         speed_val = round(max(1.0,min(speed_val,2.0)),2)
 
         # 情緒判斷
-        emotion = "平穩" 
-        content_lower = task["raw_content"].lower()
-        task_type = task["type"]
-        
-        if task_type == "INTRO": emotion = "舒緩"
-        elif task_type == "OUTRO": emotion = "激動" 
-        elif task_type == "REPLAY": emotion = "專業"       
-        elif task_type == "GAP": emotion = "舒緩"
-        elif any(k in content_lower for k in ["score", "smash", "kill", "won", "winner"]): emotion = "激動"
-        elif any(k in content_lower for k in ["defense", "save", "foul", "out", "mistake"]): emotion = "緊張"
-        elif any(k in content_lower for k in ["serve", "prepare"]): emotion = "舒緩"
-        elif any(k in content_lower for k in ["miss", "error", "fail"]): emotion = "遺憾"
+        emotion = task_emotions[i]
 
         commentary.append({
             "start_time": seconds_to_timecode(final_start),
@@ -503,13 +594,16 @@ def process_single_video_stage2(video_path, event_json_path, output_folder):
         segment_texts.append(text)
 
     if segment_texts:
-        NARRATIVE_HISTORY.append(" ".join(segment_texts))
-        if len(NARRATIVE_HISTORY) > 10: NARRATIVE_HISTORY.pop(0)
+        if segment_index is not None:
+            NARRATIVE_HISTORY_BY_INDEX[segment_index] = " ".join(segment_texts)
+        else:
+            NARRATIVE_HISTORY.append(" ".join(segment_texts))
+            if len(NARRATIVE_HISTORY) > 10: NARRATIVE_HISTORY.pop(0)
 
     output_path = os.path.join(output_folder, f"{base_name}.json")
     if commentary:
         with open(output_path, "w", encoding="utf-8") as f:
-            json.dump({"segment": base_name, "commentary": commentary}, f, ensure_ascii=False, indent=2)
+            json.dump({"segment": base_name, "model": model_used, "commentary": commentary}, f, ensure_ascii=False, indent=2)
         return output_path
     else:
         return None
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# ========== 1. 路徑與共用模組 ==========
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BACKEND_DIR, "merge_audio"))
+from audio_mixer import decode_audio
+
+# ========== 2. 參數設定 ==========
+# 只看能量，不需要高取樣率
+SCORE_SAMPLE_RATE = 16000
+HOP_SEC = 0.01                 # 每 10ms 一個 RMS 值
+CROWD_WINDOW_SEC = 1.0         # 觀眾聲浪以 1 秒平均衡量 (濾掉單次擊球)
+ONSET_DB = 6.0                 # 相鄰區塊能量上升超過此值 (dB) 視為一次撞擊 (擊球、踩地)
+SILENCE_DB = -60.0
+DECODE_WORKERS = 4             # ffmpeg 解碼為外部行程，以執行緒平行即可
+
+# 各特徵 (整場 z 分數) 的權重
+SCORE_WEIGHTS = {
+    "crowd_rise_db": 0.4,      # 1 秒聲浪峰值高出本段中位數多少 (歡呼)
+    "loudness_db": 0.2,        # 1 秒聲浪的 95 百分位 (整段熱度)
+    "onset_rate": 0.25,        # 每秒撞擊次數 (來回節奏)
+    "onset_peak_db": 0.15,     # 最強撞擊 (重殺)
+}
+
+
+# ========== 3. 特徵計算 (向量化) ==========
+def rms_envelope(samples, sample_rate=SCORE_SAMPLE_RATE, hop_sec=HOP_SEC):
+    """(frames,) 或 (frames, channels) -> 每 hop 一個 RMS 值 (dB)。"""
+    x = samples.mean(axis=1) if samples.ndim == 2 else samples
+    hop = max(1, int(sample_rate * hop_sec))
+    n = len(x) // hop
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    blocks = x[:n * hop].reshape(n, hop)
+    rms = np.sqrt(np.mean(blocks * blocks, axis=1))
+    return np.maximum(20 * np.log10(rms + 1e-10), SILENCE_DB).astype(np.float32)
+
+
+def moving_average(values, window):
+    window = max(1, min(window, len(values)))
+    csum = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+    return ((csum[window:] - csum[:-window]) / window).astype(np.float32)
+
+
+def onset_envelope(db):
+    """正向能量差分：突然變大聲的程度 (dB)。"""
+    return np.maximum(0.0, np.diff(db, prepend=db[:1]))
+
+
+def excitement_features(samples, sample_rate=SCORE_SAMPLE_RATE):
+    """
+    單一片段的音訊特徵；沒有音軌時回傳 None。
+    回傳：{"crowd_rise_db", "loudness_db", "onset_rate", "onset_peak_db", "duration"}
+    """
+    db = rms_envelope(samples, sample_rate)
+    if len(db) == 0:
+        return None
+    duration = len(db) * HOP_SEC
+    crowd = moving_average(db, int(CROWD_WINDOW_SEC / HOP_SEC))
+    onset = onset_envelope(db)
+    # 撞擊：超過門檻且為局部最大值，避免同一聲被算兩次
+    is_peak = (onset >= ONSET_DB) & (onset >= np.roll(onset, 1)) & (onset > np.roll(onset, -1))
+    return {
+        "crowd_rise_db": float(crowd.max() - np.median(db)),
+        "loudness_db": float(np.percentile(crowd, 95)),
+        "onset_rate": float(is_peak.sum() / duration),
+        "onset_peak_db": float(np.percentile(onset, 99.5)),
+        "duration": round(duration, 2),
+    }
+
+
+def segment_features(path):
+    try:
+        return excitement_features(decode_audio(path, SCORE_SAMPLE_RATE, 1))
+    except Exception as e:
+        print(f"⚠️ [Highlight] {os.path.basename(path)} 音訊解碼失敗：{e}")
+        return None
+
+
+def combine_scores(features, weights=SCORE_WEIGHTS):
+    """
+    各特徵在整場比賽內做 z 分數 (片段之間才能比較)，加權相加。
+    沒有音軌的片段分數為 0 (整場平均)。
+    """
+    names = list(weights)
+    matrix = np.array([[f[n] for n in names] if f else [np.nan] * len(names) for f in features],
+                      dtype=np.float64).reshape(len(features), len(names))
+    valid = ~np.isnan(matrix).any(axis=1)
+    z = np.zeros_like(matrix)
+    if valid.any():
+        mean = matrix[valid].mean(axis=0)
+        std = matrix[valid].std(axis=0)
+        z[valid] = (matrix[valid] - mean) / np.where(std > 0, std, 1.0)
+    return z @ np.array([weights[n] for n in names])
+
+
+# ========== 4. 批次評分 ==========
+def score_segments(video_paths, workers=DECODE_WORKERS, weights=SCORE_WEIGHTS):
+    """
+    在任何 LLM 呼叫前為所有片段評分。
+    回傳依分數由高到低排序的 [{"segment", "index", "score", "features"}]，index 為原本的順序。
+    """
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        features = list(executor.map(segment_features, video_paths))
+    scores = combine_scores(features, weights) if video_paths else []
+
+    ranking = [
+        {"segment": path, "index": i, "score": round(float(score), 4), "features": feats}
+        for i, (path, score, feats) in enumerate(zip(video_paths, scores, features))
+    ]
+    ranking.sort(key=lambda r: r["score"], reverse=True)
+    print(f"🔊 [Highlight] {len(video_paths)} 段音訊評分完成 | {time.perf_counter() - t0:.1f}s")
+    return ranking
+
+
+def save_scores(ranking, output_path):
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(ranking, f, ensure_ascii=False, indent=2)
+    return output_path
+
+
+# ========== 5. 獨立運行模式 ==========
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python audio_highlight.py <片段資料夾> [輸出.json]")
+        sys.exit(1)
+    folder = sys.argv[1]
+    paths = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".mp4")]
+    ranking = score_segments(paths)
+    for rank, r in enumerate(ranking[:10], 1):
+        print(f"  {rank:2d}. {os.path.basename(r['segment'])}  score={r['score']:+.2f}")
+    if len(sys.argv) > 2:
+        print(f"💾 已儲存：{save_scores(ranking, sys.argv[2])}")
@@ -0,0 +1,251 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+
+# ========== 1. 路徑與共用模組 ==========
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BACKEND_DIR, "merge_audio"))
+sys.path.append(os.path.join(BACKEND_DIR, "video_merger"))
+from merge_audio import mux_audio_stream_copy
+from audio_mixer import decode_audio, mix_tracks, write_wav, MIX_CHANNELS
+from video_merge import probe_video, merge_videos_stream_copy, FFMPEG_EXE
+from render_match import segment_placements, SEGMENT_LENGTH, SEGMENT_NAME_FORMAT
+
+# ========== 2. 參數設定 ==========
+TARGET_DURATION = 120.0        # 精華影片目標長度 (秒)
+PAD_BEFORE = 3.0               # 事件前保留 (看到來球)
+PAD_AFTER = 2.0                # 事件後保留 (落地、反應)
+MERGE_GAP = 1.0                # 相鄰區間間隔小於此值時合併
+HIGHLIGHT_CATEGORIES = ("Score",)
+EVENT_SUFFIX = "_event.json"
+
+
+# ========== 3. 工具函數 ==========
+def parse_time_str(t_str):
+    try:
+        if not t_str: return 0.0
+        parts = t_str.strip().split(':')
+        sec = 0.0
+        if len(parts) == 3: sec += float(parts[-3]) * 3600
+        if len(parts) >= 2: sec += float(parts[-2]) * 60
+        sec += float(parts[-1])
+        return sec
+    except: return 0.0
+
+
+def is_highlight(event):
+    return bool(event.get("is_crucial")) or event.get("category") in HIGHLIGHT_CATEGORIES
+
+
+def resolve_source(source, segment_name):
+    """
+    source 為片段資料夾：回傳 (<資料夾>/<片段>.mp4, 0)
+    source 為整場影片：依片段編號回傳 (整場影片, 片段起點秒數)，編號規則同 video_splitter
+    """
+    if os.path.isdir(source):
+        return os.path.join(source, segment_name + ".mp4"), 0.0
+    m = re.search(r"(\d+)$", segment_name)
+    return source, ((int(m.group(1)) - 1) * SEGMENT_LENGTH if m else 0.0)
+
+
+# ========== 4. 選取區間 ==========
+def highlight_windows(event_json_folder, source, pad_before=PAD_BEFORE, pad_after=PAD_AFTER, merge_gap=MERGE_GAP):
+    """
+    讀取 Stage 1 的 *_event.json，取出 is_crucial 與 Score 事件前後加緩衝的區間，重疊的合併。
+    串流複製只能從關鍵影格開始，起點先往前對齊關鍵影格再合併，剪出來的畫面才不會重複。
+    回傳依時間排序的 [{"source", "start", "end", "segments", "priority", "actions"}]，時間為來源影片的秒數。
+    """
+    raw = []
+    durations = {}
+    for f in sorted(os.listdir(event_json_folder)):
+        if not f.endswith(EVENT_SUFFIX):
+            continue
+        segment_name = f[:-len(EVENT_SUFFIX)]
+        path, offset = resolve_source(source, segment_name)
+        if not os.path.exists(path):
+            continue
+        if path not in durations:
+            durations[path] = probe_video(path)["duration"] or 0.0
+        with open(os.path.join(event_json_folder, f), "r", encoding="utf-8") as jf:
+            events = json.load(jf).get("events", [])
+        for event in events:
+            if not is_highlight(event):
+                continue
+            start = parse_time_str(event.get("start_time"))
+            end = parse_time_str(event.get("end_time")) or start + 1.0
+            raw.append({
+                "source": path,
+                "start": snap_to_keyframe(max(0.0, offset + start - pad_before), keyframe_times(path)),
+                "end": min(durations[path], offset + max(end, start) + pad_after),
+                "segments": [segment_name],
+                "priority": int(bool(event.get("is_crucial"))) + int(event.get("category") in HIGHLIGHT_CATEGORIES),
+                "actions": [event.get("action", "")],
+            })
+
+    raw.sort(key=lambda w: (w["source"], w["start"]))
+    windows = []
+    for w in raw:
+        if w["end"] <= w["start"]:
+            continue
+        last = windows[-1] if windows else None
+        if last and last["source"] == w["source"] and w["start"] <= last["end"] + merge_gap:
+            last["end"] = max(last["end"], w["end"])
+            last["priority"] += w["priority"]
+            last["actions"] += w["actions"]
+            last["segments"] += [s for s in w["segments"] if s not in last["segments"]]
+        else:
+            windows.append(w)
+    return windows
+
+
+def select_windows(windows, target_duration=TARGET_DURATION):
+    """總長超過目標時，依優先度 (關鍵 + 得分事件數) 挑選 (至少保留一段)，再恢復時間順序。"""
+    if not target_duration or sum(w["end"] - w["start"] for w in windows) <= target_duration:
+        return windows
+    ranked = sorted(range(len(windows)), key=lambda i: (-windows[i]["priority"], windows[i]["end"] - windows[i]["start"]))
+    chosen, total = [], 0.0
+    for i in ranked:
+        span = windows[i]["end"] - windows[i]["start"]
+        if total + span <= target_duration or not chosen:
+            chosen.append(i)
+            total += span
+    return [windows[i] for i in sorted(chosen)]
+
+
+# ========== 5. 關鍵影格對齊的串流複製剪輯 ==========
+_keyframe_cache = {}
+
+
+def keyframe_times(path):
+    """只解碼關鍵影格 (-skip_frame nokey)，從 showinfo 取得每個關鍵影格的時間。"""
+    if path not in _keyframe_cache:
+        cmd = [FFMPEG_EXE, "-hide_banner", "-skip_frame", "nokey", "-i", path,
+               "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"]
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        info = proc.stderr.decode("utf-8", "ignore")
+        times = sorted(float(t) for t in re.findall(r"pts_time:\s*([\d.]+)", info))
+        _keyframe_cache[path] = np.array(times or [0.0])
+    return _keyframe_cache[path]
+
+
+def snap_to_keyframe(t, keyframes):
+    """不晚於 t 的最後一個關鍵影格 (串流複製只能從關鍵影格開始)。"""
+    idx = np.searchsorted(keyframes, t + 1e-3, side="right") - 1
+    return float(keyframes[max(0, idx)])
+
+
+def cut_stream_copy(path, start, end, output_path):
+    cmd = [FFMPEG_EXE, "-y", "-v", "error", "-ss", f"{start:.3f}", "-i", path, "-t", f"{end - start:.3f}",
+           "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy", "-avoid_negative_ts", "make_zero", output_path]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", "ignore").strip()[-500:])
+    return output_path
+
+
+# ========== 6. 旁白 (選用) ==========
+def window_placements(window, source, json_folder, tts_folder, audio_delay=0.3):
+    """把區間涵蓋的各片段旁白換算成區間內的時間；在區間開始前就已開口的句子略過。"""
+    duration = window["end"] - window["start"]
+    if os.path.isdir(source):
+        segment_names = window["segments"]
+    else:
+        # 整場影片：區間可能跨到沒有精華事件的相鄰片段，依時間找出涵蓋的所有片段
+        first, last = int(window["start"] // SEGMENT_LENGTH), int(window["end"] // SEGMENT_LENGTH)
+        segment_names = [SEGMENT_NAME_FORMAT.format(n + 1) for n in range(first, last + 1)]
+    placements = []
+    for segment_name in segment_names:
+        path, offset = resolve_source(source, segment_name)
+        seg_duration = (probe_video(path)["duration"] or SEGMENT_LENGTH) if os.path.isdir(source) else SEGMENT_LENGTH
+        for voice_path, start, allowed, _ in segment_placements(segment_name, json_folder, tts_folder, seg_duration, audio_delay):
+            t = offset + start - window["start"]
+            if 0 <= t < duration:
+                limit = duration - t if allowed is None else min(allowed, duration - t)
+                placements.append((decode_audio(voice_path), t, limit))
+    return placements
+
+
+def narrate_clip(clip_path, window, source, json_folder, tts_folder):
+    duration = window["end"] - window["start"]
+    probe = probe_video(clip_path)
+    crowd = (decode_audio(clip_path) if probe["audio"] is not None
+             else np.zeros((0, MIX_CHANNELS), dtype=np.float32))
+    placements = window_placements(window, source, json_folder, tts_folder)
+    mix, _ = mix_tracks(crowd, placements, duration)
+    wav_path = write_wav(os.path.splitext(clip_path)[0] + "_mix.wav", mix)
+    narrated_path = os.path.splitext(clip_path)[0] + "_narrated.mp4"
+    mux_audio_stream_copy(clip_path, wav_path, narrated_path)
+    os.remove(wav_path)
+    os.replace(narrated_path, clip_path)
+    return len(placements)
+
+
+# ========== 7. 匯出精華 ==========
+def export_highlights(event_json_folder, source, output_video, narration_json_folder=None, tts_folder=None,
+                      target_duration=TARGET_DURATION):
+    """
+    Stage 1 完成後即可產生精華影片：
+    1. 選出 is_crucial / Score 區間 (含緩衝，重疊合併，超過目標長度時依優先度挑選)
+    2. 區間起點已對齊關鍵影格，以 -c copy 剪出 (不重新編碼)
+    3. 有 narration_json_folder + tts_folder 時，把對應的旁白混入現場音 (視訊仍為串流複製)
+    4. concat demuxer 串接
+    source：片段資料夾或整場影片
+    """
+    t0 = time.perf_counter()
+    windows = select_windows(highlight_windows(event_json_folder, source), target_duration)
+    if not windows:
+        msg = "❌ 沒有可用的精華事件 (is_crucial / Score)"
+        print(msg)
+        return {"status": "error", "message": msg}
+
+    narrate = bool(narration_json_folder and tts_folder)
+    os.makedirs(os.path.dirname(output_video) or ".", exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="highlight_", dir=os.path.dirname(output_video) or None)
+    lines = 0
+    try:
+        for i, window in enumerate(windows):
+            clip_path = cut_stream_copy(window["source"], window["start"], window["end"],
+                                        os.path.join(work_dir, f"{i:04d}.mp4"))
+            if narrate:
+                lines += narrate_clip(clip_path, window, source, narration_json_folder, tts_folder)
+        merge_videos_stream_copy(work_dir, output_video)
+    except Exception as e:
+        msg = f"❌ 精華匯出失敗：{e}"
+        print(msg)
+        return {"status": "error", "message": msg}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total = sum(w["end"] - w["start"] for w in windows)
+    elapsed = time.perf_counter() - t0
+    print(f"🎉 ✅ 精華影片完成 ({len(windows)} 段 / {total:.1f}s，{elapsed:.1f}s{f'，旁白 {lines} 句' if narrate else ''})：{output_video}")
+    return {
+        "status": "success",
+        "output_video": output_video,
+        "clips": [{"source": os.path.basename(w["source"]), "start": round(w["start"], 2), "end": round(w["end"], 2),
+                   "actions": w["actions"]} for w in windows],
+        "duration": round(total, 2),
+        "narrated_lines": lines,
+        "elapsed": round(elapsed, 2),
+    }
+
+
+# ✅ 後端單測模式
+if __name__ == "__main__":
+    event_json_folder = "D:/Vs.code/AI_Anchor/backend/gemini/event_analysis_output"
+    source = "D:/Vs.code/AI_Anchor/backend/video_splitter/badminton_segments"
+    json_folder = "D:/Vs.code/AI_Anchor/backend/gemini/final_narratives"
+    tts_folder = "D:/Vs.code/AI_Anchor/backend/TextToSpeech/final_tts_google"
+    output_video = "D:/Vs.code/AI_Anchor/backend/video_merger/output/badminton_highlights.mp4"
+
+    # 只要 Stage 1 完成即可匯出；旁白還沒生成時不傳 json_folder / tts_folder
+    with_narration = os.path.exists(json_folder) and os.path.exists(tts_folder)
+    result = export_highlights(event_json_folder, source, output_video,
+                               json_folder if with_narration else None, tts_folder if with_narration else None)
+    print(result)
@@ -0,0 +1,163 @@
+import wave
+import subprocess
+import numpy as np
+import imageio_ffmpeg
+from pcm_audio import MIX_SAMPLE_RATE, read_wav_memmap, pcm_to_float
+
+# ========== 參數設定 ==========
+MIX_CHANNELS = 2
+# 旁白期間現場聲壓低的量 (dB)
+DUCK_GAIN_DB = -12.0
+# 旁白增益 (dB)
+NARRATION_GAIN_DB = 0.0
+# 側鏈偵測：以 10ms 為一個區塊計算旁白能量
+DUCK_BLOCK_SEC = 0.01
+# 旁白能量高於此門檻 (dBFS) 才算有聲
+DUCK_THRESHOLD_DB = -45.0
+# 提前壓低 / 旁白結束後維持的時間，避免句間的短暫停頓讓現場聲忽大忽小
+DUCK_ATTACK_SEC = 0.15
+DUCK_RELEASE_SEC = 0.5
+# 增益曲線的平滑長度 (淡入淡出)
+DUCK_RAMP_SEC = 0.2
+# 旁白超出可用時段多少秒以上才截斷 (與 MoviePy 路徑相同)
+TRUNCATE_TOLERANCE = 0.1
+
+FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def db_to_gain(db):
+    return float(10 ** (db / 20.0))
+
+
+# ========== 解碼 ==========
+def decode_audio(path, sample_rate=MIX_SAMPLE_RATE, channels=MIX_CHANNELS, start=None, duration=None):
+    """
+    以 ffmpeg 將任意音訊 (或影片的音軌) 解碼成 float32 陣列 shape=(frames, channels)。
+    start / duration：只解碼其中一段 (秒)，整場影片逐段處理時使用。
+    取樣率相同的 wav 直接以記憶體映射讀取，不經 ffmpeg。
+    沒有音軌時回傳空陣列。
+    """
+    if path.endswith(".wav") and start is None and duration is None:
+        try:
+            data, sr = read_wav_memmap(path)
+            if sr == sample_rate:
+                return pcm_to_float(data, channels)
+        except ValueError:
+            pass
+
+    cmd = [FFMPEG_EXE, "-v", "error"]
+    if start:
+        cmd += ["-ss", f"{start:.3f}"]
+    if duration:
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += [
+        "-i", path, "-vn",
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(channels), "-ar", str(sample_rate), "pipe:1",
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0 and not proc.stdout:
+        stderr = proc.stderr.decode("utf-8", "ignore")
+        if "does not contain any stream" in stderr or "Output file #0 does not contain" in stderr:
+            return np.zeros((0, channels), dtype=np.float32)
+        raise RuntimeError(f"ffmpeg 解碼失敗：{path}\n{stderr[-500:]}")
+    pcm = np.frombuffer(proc.stdout, dtype="<i2")
+    pcm = pcm[: len(pcm) - len(pcm) % channels]
+    return pcm.reshape(-1, channels).astype(np.float32) / 32768.0
+
+
+# ========== 側鏈壓低 ==========
+def _sliding_any(mask, before, after):
+    """mask[i] 在 [i-before, i+after] 任一為真即為真 (以累加和向量化)。"""
+    csum = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+    idx = np.arange(len(mask))
+    lo = np.clip(idx - before, 0, len(mask))
+    hi = np.clip(idx + after + 1, 0, len(mask))
+    return (csum[hi] - csum[lo]) > 0
+
+
+def ducking_gain(narration, sample_rate=MIX_SAMPLE_RATE, duck_db=DUCK_GAIN_DB,
+                 threshold_db=DUCK_THRESHOLD_DB, attack=DUCK_ATTACK_SEC,
+                 release=DUCK_RELEASE_SEC, ramp=DUCK_RAMP_SEC):
+    """
+    依旁白能量計算現場聲的逐樣本增益曲線 (1.0 = 原音量, duck = 壓低後)。
+    全程以區塊為單位向量化計算，最後再內插回取樣點。
+    """
+    frames = narration.shape[0]
+    block = max(1, int(sample_rate * DUCK_BLOCK_SEC))
+    n_blocks = -(-frames // block)
+    if n_blocks == 0:
+        return np.ones(0, dtype=np.float32)
+
+    padded = np.zeros((n_blocks * block,), dtype=np.float32)
+    padded[:frames] = np.abs(narration).max(axis=1)
+    rms = np.sqrt((padded.reshape(n_blocks, block) ** 2).mean(axis=1))
+    active = rms > db_to_gain(threshold_db)
+
+    active = _sliding_any(active, int(release / DUCK_BLOCK_SEC), int(attack / DUCK_BLOCK_SEC))
+    target = np.where(active, db_to_gain(duck_db), 1.0).astype(np.float32)
+
+    ramp_blocks = max(1, int(ramp / DUCK_BLOCK_SEC))
+    if ramp_blocks > 1:
+        kernel = np.ones(ramp_blocks, dtype=np.float32) / ramp_blocks
+        target = np.convolve(np.pad(target, (ramp_blocks // 2, ramp_blocks - 1 - ramp_blocks // 2), mode="edge"),
+                             kernel, mode="valid")
+
+    centers = (np.arange(n_blocks) + 0.5) * block
+    return np.interp(np.arange(frames), centers, target).astype(np.float32)
+
+
+# ========== 混音 ==========
+def mix_tracks(crowd, placements, duration, sample_rate=MIX_SAMPLE_RATE,
+               duck_db=DUCK_GAIN_DB, narration_db=NARRATION_GAIN_DB):
+    """
+    crowd：原始現場音 (frames, 2)，可為空陣列
+    placements：[(音訊陣列, 開始秒數, 最長秒數 或 None)]
+    回傳 (混音結果 float32 (frames, 2), 旁白被截斷的句數)
+    """
+    frames = int(round(duration * sample_rate))
+    narration = np.zeros((frames, MIX_CHANNELS), dtype=np.float32)
+    truncated = 0
+
+    for audio, start, max_duration in placements:
+        offset = int(round(start * sample_rate))
+        if offset >= frames:
+            continue
+        length = audio.shape[0]
+        if max_duration is not None and length > int((max_duration + TRUNCATE_TOLERANCE) * sample_rate):
+            length = int(max_duration * sample_rate)
+            truncated += 1
+        length = min(length, frames - offset)
+        narration[offset:offset + length] += audio[:length]
+
+    narration *= db_to_gain(narration_db)
+    mix = narration
+    if crowd.shape[0]:
+        n = min(frames, crowd.shape[0])
+        gain = ducking_gain(narration, sample_rate, duck_db=duck_db)
+        mix[:n] += crowd[:n] * gain[:n, None]
+
+    np.clip(mix, -1.0, 1.0, out=mix)
+    return mix, truncated
+
+
+def write_wav(path, samples, sample_rate=MIX_SAMPLE_RATE):
+    """float32 (frames, channels) -> 16-bit PCM WAV，一次寫出。"""
+    pcm = (samples * 32767.0).astype("<i2")
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(samples.shape[1])
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm.tobytes())
+    return path
+
+
+def mix_segment_audio(video_path, placements, duration, output_wav, keep_crowd=True, **mix_kwargs):
+    """
+    單一片段：解碼原始現場音與所有旁白，於時間軸上混音 (旁白期間壓低現場聲)，寫出 wav。
+    placements：[(語音檔路徑, 開始秒數, 最長秒數 或 None)]
+    """
+    crowd = decode_audio(video_path) if keep_crowd else np.zeros((0, MIX_CHANNELS), dtype=np.float32)
+    loaded = [(decode_audio(path), start, max_duration) for path, start, max_duration in placements]
+    mix, truncated = mix_tracks(crowd, loaded, duration, **mix_kwargs)
+    write_wav(output_wav, mix)
+    return {"output": output_wav, "clips": len(loaded), "truncated": truncated, "crowd": bool(crowd.shape[0])}
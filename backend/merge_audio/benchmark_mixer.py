@@ -0,0 +1,89 @@
+"""
+混音效能比較：MoviePy CompositeAudioClip vs NumPy 向量化混音 (audio_mixer.py)。
+
+用法：
+    python benchmark_mixer.py                       # 合成測試資料 (30 秒現場聲 + 12 句旁白)
+    python benchmark_mixer.py <影片.mp4> <語音資料夾>  # 真實片段：語音依檔名順序每 2.5 秒放一句
+"""
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from moviepy.editor import AudioFileClip, CompositeAudioClip
+from pcm_audio import MIX_SAMPLE_RATE
+from audio_mixer import mix_segment_audio, write_wav
+
+# ========== 參數設定 ==========
+SYNTH_DURATION = 30.0
+SYNTH_LINES = 12
+SYNTH_LINE_SEC = 2.0
+REPEAT = 3
+
+
+def make_synthetic(workdir):
+    """產生 30 秒白噪音 (現場聲) 與數句正弦波 (旁白)。"""
+    rng = np.random.default_rng(0)
+    frames = int(SYNTH_DURATION * MIX_SAMPLE_RATE)
+    crowd = (rng.standard_normal((frames, 2)) * 0.1).astype(np.float32)
+    crowd_path = write_wav(os.path.join(workdir, "crowd.wav"), crowd)
+
+    t = np.arange(int(SYNTH_LINE_SEC * MIX_SAMPLE_RATE)) / MIX_SAMPLE_RATE
+    placements = []
+    for i in range(SYNTH_LINES):
+        tone = (0.3 * np.sin(2 * np.pi * (220 + 20 * i) * t)).astype(np.float32)
+        path = write_wav(os.path.join(workdir, f"{i+1:03d}_平穩.wav"), np.repeat(tone[:, None], 2, axis=1))
+        placements.append((path, i * SYNTH_DURATION / SYNTH_LINES, SYNTH_LINE_SEC))
+    return crowd_path, placements, SYNTH_DURATION
+
+
+def load_real(video_path, tts_folder):
+    files = sorted(f for f in os.listdir(tts_folder) if f.endswith((".wav", ".mp3")))
+    duration = AudioFileClip(video_path).duration
+    placements = [(os.path.join(tts_folder, f), i * 2.5, 2.5) for i, f in enumerate(files) if i * 2.5 < duration]
+    return video_path, placements, duration
+
+
+def run_moviepy(source_path, placements, duration, output_wav):
+    clips = [AudioFileClip(source_path)]
+    for path, start, allowed in placements:
+        clip = AudioFileClip(path)
+        if clip.duration > allowed + 0.1:
+            clip = clip.subclip(0, allowed)
+        clips.append(clip.set_start(start))
+    CompositeAudioClip(clips).set_duration(duration).write_audiofile(
+        output_wav, fps=MIX_SAMPLE_RATE, codec="pcm_s16le", logger=None)
+    for clip in clips:
+        clip.close()
+
+
+def run_numpy(source_path, placements, duration, output_wav):
+    mix_segment_audio(source_path, placements, duration, output_wav)
+
+
+def timed(func, *args):
+    best = float("inf")
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as workdir:
+        if len(sys.argv) >= 3:
+            source_path, placements, duration = load_real(sys.argv[1], sys.argv[2])
+            label = os.path.basename(sys.argv[1])
+        else:
+            source_path, placements, duration = make_synthetic(workdir)
+            label = "合成測試資料"
+
+        print(f"🎧 混音效能比較：{label} | {duration:.1f}s | {len(placements)} 句旁白 | 取 {REPEAT} 次最佳")
+        t_moviepy = timed(run_moviepy, source_path, placements, duration, os.path.join(workdir, "moviepy.wav"))
+        t_numpy = timed(run_numpy, source_path, placements, duration, os.path.join(workdir, "numpy.wav"))
+
+        print(f"   MoviePy CompositeAudioClip：{t_moviepy:.3f}s ({duration / t_moviepy:.1f}x 即時)")
+        print(f"   NumPy 向量化混音 (含壓低)：{t_numpy:.3f}s ({duration / t_numpy:.1f}x 即時)")
+        print(f"   ⚡ 加速 {t_moviepy / t_numpy:.1f}x")
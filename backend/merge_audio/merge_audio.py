@@ -1,6 +1,29 @@
 import os
 import json
+import time
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import imageio_ffmpeg
 from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip
+from moviepy.audio.AudioClip import AudioArrayClip
+from pcm_audio import MIX_SAMPLE_RATE, read_wav_memmap, pcm_to_float
+from audio_mixer import mix_segment_audio
+
+# TTS 可輸出的音檔格式 (wav 為 LINEAR16 原始 PCM)
+VOICE_EXTS = (".wav", ".mp3")
+# TTS 在每個片段資料夾寫出的索引 (見 generate_tts_google.write_segment_manifest)
+MANIFEST_NAME = "manifest.json"
+# 混音引擎："numpy" (保留現場聲並於旁白期間壓低) 或 "moviepy" (舊版，只留旁白)
+MIX_ENGINE = "numpy"
+# 輸出方式："copy" 只替換音軌、視訊串流不重新編碼；"reencode" 為舊版 libx264 全片重編
+MUX_MODE = "copy"
+MUX_AUDIO_BITRATE = "192k"
+
+FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
+# 每個 ffmpeg 行程的執行緒數 (None = ffmpeg 自行決定；平行合併時由行程池設定)
+FFMPEG_THREADS = None
+# 平行合併的片段數
+MERGE_WORKERS = max(1, (os.cpu_count() or 1) // 4)
 
 # ✅ 將時間字串轉為秒數
 def time_str_to_seconds(time_str):
@@ -22,37 +45,63 @@ def time_str_to_seconds(time_str):
         print(f"❌ time_str_to_seconds 轉換錯誤，輸入值: {time_str}")
         return 0.0
 
-# ✅ 單段影片合成
-def merge_segment_video_with_audio(video_path, json_path, tts_dir, output_path, audio_delay=0.3):
-    print(f"\n🎬 合併影片片段：{os.path.basename(video_path)}")
+# ✅ 載入語音：wav 以記憶體映射直接取 PCM (不經 ffmpeg 解碼)，mp3 沿用 AudioFileClip
+def load_voice_clip(path):
+    if path.endswith(".wav"):
+        data, sample_rate = read_wav_memmap(path)
+        return AudioArrayClip(pcm_to_float(data), fps=sample_rate)
+    return AudioFileClip(path)
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+# ✅ 視訊串流複製 + 新音軌 (不解碼、不重編視訊)
+def mux_audio_stream_copy(video_path, audio_path, output_path):
+    cmd = [
+        FFMPEG_EXE, "-y", "-v", "error",
+        "-i", video_path, "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy", "-c:a", "aac", "-b:a", MUX_AUDIO_BITRATE,
+        "-movflags", "+faststart",
+    ]
+    if FFMPEG_THREADS:
+        cmd += ["-threads", str(FFMPEG_THREADS)]
+    cmd.append(output_path)
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise RuntimeError(proc.stderr.decode("utf-8", "ignore").strip()[-500:])
+    return output_path
 
+# ✅ 讀取片段語音索引 (沒有或損毀時回傳 None，改用舊版資料夾掃描)
+def load_tts_manifest(segment_tts_folder):
+    manifest_path = os.path.join(segment_tts_folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
     try:
-        video = VideoFileClip(video_path)
-        video_duration = video.duration 
-    except Exception as e:
-        print(f"❌ 無法讀取影片檔：{video_path}，錯誤：{e}")
-        return {"status": "error", "segment": video_path, "reason": "video_load_error"}
-
-    commentary = data.get("commentary", [])
-    
-    if not commentary:
-        print(f"⚠️ 沒有旁白內容：{json_path}")
-        return {"status": "skip", "segment": video_path, "reason": "no_commentary"}
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("lines", {})
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 語音索引無法讀取，改為掃描資料夾：{e}")
+        return None
 
-    segment_name = os.path.splitext(os.path.basename(video_path))[0]
-    segment_tts_folder = os.path.join(tts_dir, segment_name)
-    
-    if not os.path.exists(segment_tts_folder):
-        print(f"⚠️ 沒有找到語音資料夾：{segment_tts_folder}")
-        return {"status": "skip", "segment": video_path, "reason": "tts_missing"}
+# ✅ 舊版：掃描一次資料夾，依檔名前綴建立 序號 -> 檔名 對照
+def index_voice_files_by_prefix(segment_tts_folder):
+    # 檔案是 001_xxx.mp3 -> JSON idx 0；002_xxx.mp3 -> JSON idx 1 (忽略後面的情緒文字)
+    voice_files = {}
+    for f in sorted(os.listdir(segment_tts_folder)):
+        prefix = f.split("_", 1)[0]
+        if prefix.isdigit() and f.endswith(VOICE_EXTS):
+            voice_files.setdefault(int(prefix) - 1, f)
+    return voice_files
 
-    audio_clips = []
+# ✅ 依旁白時間軸找出每句語音與擺放位置 (單段合成與整場渲染共用)
+def build_voice_placements(commentary, segment_tts_folder, video_duration, audio_delay=0.3):
+    """回傳 [(語音檔路徑, 開始秒數, 可用長度, TTS 實測長度)]，時間相對於片段開頭。"""
+    segment_name = os.path.basename(segment_tts_folder)
+    placements = []
 
-    # 取得該資料夾下所有 mp3 檔案
-    all_files = os.listdir(segment_tts_folder)
+    # 優先查 TTS 寫出的索引 (O(1))；沒有索引的舊資料夾才掃描目錄
+    manifest = load_tts_manifest(segment_tts_folder)
+    voice_files = None
 
     for idx, sentence in enumerate(commentary):
         start_time = time_str_to_seconds(sentence["start_time"])
@@ -64,68 +113,180 @@ def merge_segment_video_with_audio(video_path, json_path, tts_dir, output_path,
         if idx == len(commentary) - 1:
             allowed_duration = video_duration - adjusted_start
 
-        # 🔍 [核心修正] 根據圖片格式尋找檔案
-        # JSON idx 是 0 -> 檔案是 001_xxx.mp3
-        # JSON idx 是 1 -> 檔案是 002_xxx.mp3
-        target_prefix = f"{idx + 1:03d}" # 格式化為 001, 002...
-        
-        voice_file_name = None
-        for f in all_files:
-            # 只要檔名是以 "001" 開頭且是 mp3 就匹配 (忽略後面的情緒文字)
-            if f.startswith(target_prefix) and f.endswith(".mp3"):
-                voice_file_name = f
-                break
+        if manifest is not None:
+            # 有索引時只信任索引：沒有這句、或文字不符 (Stage 2 重跑後尚未重新 TTS) 都略過，
+            # 不可退回前綴掃描，否則會撿到同序號的舊音檔
+            entry = manifest.get(str(idx))
+            if entry and entry.get("text", sentence.get("text")) == sentence.get("text") \
+                    and os.path.exists(os.path.join(segment_tts_folder, entry["file"])):
+                voice_file_name = entry["file"]
+                tts_duration = entry.get("duration")
+            else:
+                voice_file_name = None
+        else:
+            if voice_files is None:
+                voice_files = index_voice_files_by_prefix(segment_tts_folder)
+            voice_file_name = voice_files.get(idx)
+            tts_duration = sentence.get("tts_duration")
 
         if not voice_file_name:
-            print(f"⚠️ 找不到對應音檔 (預期開頭: {target_prefix}) @ {segment_name}")
+            print(f"⚠️ 找不到對應音檔 (序號: {idx + 1:03d}) @ {segment_name}")
             continue
 
         voice_file_path = os.path.join(segment_tts_folder, voice_file_name)
+        placements.append((voice_file_path, adjusted_start, allowed_duration, tts_duration))
+
+    return placements
+
+# ✅ 單段影片合成
+def merge_segment_video_with_audio(video_path, json_path, tts_dir, output_path, audio_delay=0.3,
+                                   mix_engine=None, mux_mode=None):
+    """
+    mix_engine："numpy" 以向量化混音保留並壓低現場聲；"moviepy" 為舊版 CompositeAudioClip (只有旁白)。
+    mux_mode："copy" 視訊串流直接複製 (-c:v copy)，失敗時自動退回 "reencode" (libx264 重新編碼)。
+    未指定時取 MIX_ENGINE / MUX_MODE。
+    """
+    mix_engine = mix_engine or MIX_ENGINE
+    mux_mode = mux_mode or MUX_MODE
+    print(f"\n🎬 合併影片片段：{os.path.basename(video_path)}")
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
 
+    try:
+        video = VideoFileClip(video_path)
+        video_duration = video.duration 
+    except Exception as e:
+        print(f"❌ 無法讀取影片檔：{video_path}，錯誤：{e}")
+        return {"status": "error", "segment": video_path, "reason": "video_load_error"}
+
+    mix_wav = os.path.splitext(output_path)[0] + "_mix.wav"
+    final_audio = None
+    # 任何提早返回都要關閉影片並清掉暫存的混音檔
+    try:
+        commentary = data.get("commentary", [])
+    
+        if not commentary:
+            print(f"⚠️ 沒有旁白內容：{json_path}")
+            return {"status": "skip", "segment": video_path, "reason": "no_commentary"}
+
+        segment_name = os.path.splitext(os.path.basename(video_path))[0]
+        segment_tts_folder = os.path.join(tts_dir, segment_name)
+    
+        if not os.path.exists(segment_tts_folder):
+            print(f"⚠️ 沒有找到語音資料夾：{segment_tts_folder}")
+            return {"status": "skip", "segment": video_path, "reason": "tts_missing"}
+
+        placements = build_voice_placements(commentary, segment_tts_folder, video_duration, audio_delay)
+
+        if not placements:
+            print("❌ 沒有可用語音片段，跳過：", segment_name)
+            return {"status": "skip", "segment": video_path, "reason": "no_audio_clips"}
+
+        # 合成：先產生整段音軌，再與原始視訊串流合併
         try:
-            # 載入音檔 (使用不同變數名稱避免混淆)
-            clip_to_add = AudioFileClip(voice_file_path)
-            
-            # 截斷邏輯
-            if clip_to_add.duration > (allowed_duration + 0.1):
-                print(f"   ✂️ [截斷] {voice_file_name}: {clip_to_add.duration:.2f}s -> {allowed_duration:.2f}s")
-                clip_to_add = clip_to_add.subclip(0, allowed_duration)
-            
-            # 設定開始時間
-            clip_to_add = clip_to_add.set_start(adjusted_start)
-            audio_clips.append(clip_to_add)
-            
+            if mix_engine == "numpy":
+                # 向量化混音：保留原始現場聲，旁白期間以側鏈壓低
+                mix_info = mix_segment_audio(
+                    video_path, [(path, start, allowed) for path, start, allowed, _ in placements],
+                    video_duration, mix_wav,
+                )
+                if mix_info["truncated"]:
+                    print(f"   ✂️ [截斷] {mix_info['truncated']} 句旁白超出可用時段")
+            else:
+                audio_clips = []
+                for voice_file_path, adjusted_start, allowed_duration, tts_duration in placements:
+                    voice_file_name = os.path.basename(voice_file_path)
+                    try:
+                        # 載入音檔 (使用不同變數名稱避免混淆)
+                        clip_to_add = load_voice_clip(voice_file_path)
+                    
+                        # 截斷邏輯 (TTS 階段已量測並寫入 tts_duration，不必再解碼音檔取得長度)
+                        clip_duration = tts_duration or clip_to_add.duration
+                        if clip_duration > (allowed_duration + 0.1):
+                            print(f"   ✂️ [截斷] {voice_file_name}: {clip_duration:.2f}s -> {allowed_duration:.2f}s")
+                            clip_to_add = clip_to_add.subclip(0, allowed_duration)
+                    
+                        # 設定開始時間
+                        clip_to_add = clip_to_add.set_start(adjusted_start)
+                        audio_clips.append(clip_to_add)
+                    
+                    except Exception as e:
+                        print(f"❌ 處理音檔失敗：{voice_file_name}，錯誤：{e}")
+
+                if not audio_clips:
+                    print("❌ 沒有可用語音片段，跳過：", segment_name)
+                    return {"status": "skip", "segment": video_path, "reason": "no_audio_clips"}
+                final_audio = CompositeAudioClip(audio_clips)
+                if mux_mode == "copy":
+                    final_audio.write_audiofile(mix_wav, fps=MIX_SAMPLE_RATE, codec="pcm_s16le", logger=None)
+        except Exception as e:
+            print(f"❌ 混音失敗：{segment_name}，錯誤：{e}")
+            return {"status": "error", "segment": video_path, "reason": "mix_error"}
+
+        try:
+            muxed = None
+            if mux_mode == "copy":
+                try:
+                    # 視訊串流原封不動複製，只編碼音軌
+                    mux_audio_stream_copy(video_path, mix_wav, output_path)
+                    muxed = "copy"
+                except Exception as e:
+                    print(f"⚠️ 視訊串流複製失敗，改為重新編碼：{e}")
+
+            if not muxed:
+                if final_audio is None:
+                    final_audio = AudioFileClip(mix_wav)
+                video = video.set_audio(final_audio)
+                video.write_videofile(output_path, codec="libx264", audio_codec="aac", threads=FFMPEG_THREADS, logger=None) # logger=None 減少輸出雜訊
+                muxed = "reencode"
+            print(f"✅ 合併完成 ({muxed})：{output_path}")
         except Exception as e:
-            print(f"❌ 處理音檔失敗：{voice_file_name}，錯誤：{e}")
+            print(f"❌ 寫入影片失敗：{output_path}，錯誤：{e}")
+            return {"status": "error", "segment": video_path, "reason": "write_error"}
+
+        return {"status": "success", "segment": video_path, "output": output_path, "mux": muxed}
+    finally:
+        video.close()
+        if final_audio is not None:
+            final_audio.close()
+        if os.path.exists(mix_wav):
+            os.remove(mix_wav)
 
-    if not audio_clips:
-        print("❌ 沒有可用語音片段，跳過：", segment_name)
-        return {"status": "skip", "segment": video_path, "reason": "no_audio_clips"}
+# ✅ 行程池工作端：限制每個 worker 的 ffmpeg 執行緒數，避免 N 個 ffmpeg 互搶核心
+def _init_merge_worker(ffmpeg_threads):
+    global FFMPEG_THREADS
+    FFMPEG_THREADS = ffmpeg_threads
 
-    # 合成
+def _timed_merge(video_path, json_path, tts_folder, output_path):
+    t0 = time.perf_counter()
     try:
-        final_audio = CompositeAudioClip(audio_clips)
-        video = video.set_audio(final_audio)
-        video.write_videofile(output_path, codec="libx264", audio_codec="aac", logger=None) # logger=None 減少輸出雜訊
-        print(f"✅ 合併完成：{output_path}")
+        result = merge_segment_video_with_audio(video_path, json_path, tts_folder, output_path)
     except Exception as e:
-        print(f"❌ 寫入影片失敗：{output_path}，錯誤：{e}")
-        return {"status": "error", "segment": video_path, "reason": "write_error"}
-
-    return {"status": "success", "segment": video_path, "output": output_path}
+        print(f"❌ 合併時發生未預期錯誤：{video_path}，錯誤：{e}")
+        result = {"status": "error", "segment": video_path, "reason": str(e)}
+    result["elapsed"] = round(time.perf_counter() - t0, 2)
+    return result
 
 # ✅ 批次處理所有影片片段
-def batch_merge_all_segments(video_folder, json_folder, tts_folder, output_folder):
+def batch_merge_all_segments(video_folder, json_folder, tts_folder, output_folder, workers=1, on_result=None):
+    """
+    workers：同時合併的片段數 (行程池)；每個 worker 的 ffmpeg 執行緒數為 CPU 核心數 / workers。
+    results 依片段檔名排序，與 workers 數無關；每筆附上 elapsed (秒)。
+    on_result(index, result)：每段一完成就呼叫 (平行時完成順序不固定)，例如邊合併邊發布 HLS。
+    """
     os.makedirs(output_folder, exist_ok=True)
 
-    results = []
     video_files = [f for f in os.listdir(video_folder) if f.endswith(".mp4")]
     
     if not video_files:
         print(f"❌ 錯誤：在 {video_folder} 找不到任何 .mp4 影片")
         return {"status": "error", "reason": "no_videos_found"}
 
-    for file in sorted(video_files):
+    video_files = sorted(video_files)
+    results = [None] * len(video_files)
+    jobs = []
+    for i, file in enumerate(video_files):
         base_name = os.path.splitext(file)[0]
         video_path = os.path.join(video_folder, file)
         json_path = os.path.join(json_folder, base_name + ".json")
@@ -133,13 +294,43 @@ def batch_merge_all_segments(video_folder, json_folder, tts_folder, output_folde
 
         if not os.path.exists(json_path):
             print(f"⚠️ 跳過 (無 JSON)：{base_name}")
-            results.append({"status": "skip", "segment": video_path, "reason": "json_missing"})
+            results[i] = {"status": "skip", "segment": video_path, "reason": "json_missing", "elapsed": 0.0}
+            if on_result:
+                on_result(i, results[i])
             continue
 
-        result = merge_segment_video_with_audio(video_path, json_path, tts_folder, output_path)
-        results.append(result)
+        jobs.append((i, (video_path, json_path, tts_folder, output_path)))
+
+    t0 = time.perf_counter()
+    workers = max(1, min(workers, len(jobs))) if jobs else 1
+    if workers == 1:
+        for i, args in jobs:
+            results[i] = _timed_merge(*args)
+            if on_result:
+                on_result(i, results[i])
+    else:
+        ffmpeg_threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"⚙️ 平行合併：{workers} 個行程，每個 ffmpeg {ffmpeg_threads} 執行緒")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_merge_worker,
+                                 initargs=(ffmpeg_threads,)) as executor:
+            futures = {executor.submit(_timed_merge, *args): (i, args) for i, args in jobs}
+            for future in as_completed(futures):
+                i, args = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    # worker 行程異常結束 (例如記憶體不足被系統終止)
+                    results[i] = {"status": "error", "segment": args[0], "reason": str(e), "elapsed": 0.0}
+                if on_result:
+                    on_result(i, results[i])
+    total_elapsed = time.perf_counter() - t0
+
+    print("\n⏱️ 各片段耗時：")
+    for r in results:
+        print(f"   {os.path.basename(r['segment'])}: {r['elapsed']:.2f}s [{r['status']}]")
+    print(f"   總計 {total_elapsed:.2f}s (片段耗時加總 {sum(r['elapsed'] for r in results):.2f}s)")
 
-    return {"status": "done", "results": results}
+    return {"status": "done", "results": results, "elapsed": round(total_elapsed, 2)}
 
 # ✅ 主程式
 if __name__ == "__main__":
@@ -150,7 +341,7 @@ if __name__ == "__main__":
     output_folder = "D:/Vs.code/AI_Anchor/backend/merge_audio/final_output_videos"
 
     print("🚀 開始執行音訊合併...")
-    result = batch_merge_all_segments(video_folder, json_folder, tts_folder, output_folder)
+    result = batch_merge_all_segments(video_folder, json_folder, tts_folder, output_folder, workers=MERGE_WORKERS)
     
     # 簡單輸出結果統計
     success_count = sum(1 for r in result["results"] if r["status"] == "success")
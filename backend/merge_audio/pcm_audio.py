@@ -0,0 +1,58 @@
+import struct
+import numpy as np
+
+# ========== 參數設定 ==========
+# 最終混音取樣率 (TTS 以 LINEAR16 輸出時直接要求此取樣率，merge 不需重新取樣)
+MIX_SAMPLE_RATE = 44100
+
+
+def read_wav_memmap(path):
+    """
+    以記憶體映射讀取 16-bit PCM WAV (不複製、不解碼)。
+    回傳 (int16 陣列 shape=(frames, channels), 取樣率)。
+    """
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise ValueError(f"不是 WAV 檔：{path}")
+
+        channels = sample_rate = bits = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f"WAV 缺少 data 區塊：{path}")
+            chunk_id, chunk_size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                audio_format, channels, sample_rate = struct.unpack("<HHI", fmt[:8])
+                bits = struct.unpack("<H", fmt[14:16])[0]
+                if audio_format != 1 or bits != 16:
+                    raise ValueError(f"只支援 16-bit PCM WAV：{path}")
+            elif chunk_id == b"data":
+                if channels is None:
+                    raise ValueError(f"WAV 缺少 fmt 區塊：{path}")
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+    frames = chunk_size // (2 * channels)
+    if frames == 0:
+        return np.zeros((0, channels), dtype=np.int16), sample_rate
+    data = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(frames * channels,))
+    return data.reshape(frames, channels), sample_rate
+
+
+def wav_duration(path):
+    data, sample_rate = read_wav_memmap(path)
+    return data.shape[0] / sample_rate
+
+
+def pcm_to_float(data, channels=2):
+    """int16 PCM -> float32 [-1, 1]，並展開成指定聲道數 (單聲道複製到左右)。"""
+    samples = data.astype(np.float32) / 32768.0
+    if samples.shape[1] == channels:
+        return samples
+    if samples.shape[1] == 1:
+        return np.repeat(samples, channels, axis=1)
+    return samples[:, :channels]
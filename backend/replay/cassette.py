@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+
+# ========== 參數設定 ==========
+# 模式：
+#   off    -> 直接呼叫外部服務 (預設)
+#   record -> 照常呼叫，並把每一次的請求 / 回應 / 耗時錄進卡帶
+#   replay -> 完全不連網，從卡帶讀回當時的回應
+CASSETTE_MODE = os.environ.get("AI_ANCHOR_CASSETTE_MODE", "off").strip().lower()
+CASSETTE_DIR = os.environ.get(
+    "AI_ANCHOR_CASSETTE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes"),
+)
+# replay 時是否照錄製當下的延遲 sleep (1 = 重現原始延遲, 0 = 全速重播)
+CASSETTE_REPLAY_LATENCY = os.environ.get("AI_ANCHOR_CASSETTE_LATENCY", "0") == "1"
+
+VALID_MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(Exception):
+    """replay 模式下找不到對應的錄製紀錄。"""
+
+
+class CassetteReplayError(Exception):
+    """錄製當下外部服務就失敗了，replay 時原樣重現該錯誤。"""
+
+
+# ========== 工具函數 ==========
+def to_jsonable(obj):
+    """把請求內容轉成可穩定序列化的結構 (bytes 轉 base64、Part 之類的物件呼叫 to_dict)。"""
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, bytes):
+        return {"__bytes__": base64.b64encode(obj).decode("ascii")}
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v) for v in obj]
+    if hasattr(obj, "to_dict"):
+        try:
+            return to_jsonable(obj.to_dict())
+        except TypeError:
+            # proto-plus 訊息的 to_dict 是類別方法
+            return to_jsonable(type(obj).to_dict(obj))
+    return repr(obj)
+
+
+def from_jsonable(obj):
+    if isinstance(obj, dict):
+        if set(obj.keys()) == {"__bytes__"}:
+            return base64.b64decode(obj["__bytes__"])
+        return {k: from_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [from_jsonable(v) for v in obj]
+    return obj
+
+
+def request_key(namespace, request):
+    canonical = json.dumps(to_jsonable(request), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{namespace}|{canonical}".encode("utf-8")).hexdigest()
+
+
+# ========== 卡帶 ==========
+class Cassette:
+    """
+    錄製 / 重播外部服務呼叫。
+    同一個請求出現多次時，依出現順序分別存成 _000, _001 ...，重播時照同樣順序取回。
+    """
+
+    def __init__(self, directory=CASSETTE_DIR, mode=CASSETTE_MODE, replay_latency=CASSETTE_REPLAY_LATENCY):
+        if mode not in VALID_MODES:
+            raise ValueError(f"未知的卡帶模式：{mode} (可用：{', '.join(VALID_MODES)})")
+        self.directory = directory
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def is_replay(self):
+        return self.mode == "replay"
+
+    def _next_path(self, namespace, request):
+        key = request_key(namespace, request)
+        with self._lock:
+            occurrence = self._counters.get(key, 0)
+            self._counters[key] = occurrence + 1
+        return os.path.join(self.directory, namespace, f"{key[:32]}_{occurrence:03d}.json")
+
+    def _write(self, path, record):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def call(self, namespace, request, func):
+        """
+        namespace：服務名稱 (gemini / tts / gcs_upload ...)
+        request：描述這次呼叫的內容，用來比對錄製紀錄
+        func：實際呼叫外部服務的函式 (replay 模式下不會被執行)
+        """
+        if self.mode == "off":
+            return func()
+
+        path = self._next_path(namespace, request)
+
+        if self.mode == "replay":
+            if not os.path.exists(path):
+                raise CassetteMiss(f"卡帶中沒有這筆 {namespace} 紀錄：{os.path.basename(path)}")
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            if self.replay_latency:
+                time.sleep(record.get("latency", 0.0))
+            if record.get("error"):
+                raise CassetteReplayError(record["error"])
+            return from_jsonable(record["response"])
+
+        # record 模式
+        record = {
+            "namespace": namespace,
+            "request": to_jsonable(request),
+            "recorded_at": time.time(),
+        }
+        t0 = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            record["latency"] = time.perf_counter() - t0
+            record["error"] = f"{type(e).__name__}: {e}"
+            self._write(path, record)
+            raise
+        record["latency"] = time.perf_counter() - t0
+        record["response"] = to_jsonable(result)
+        self._write(path, record)
+        return result
+
+
+# 全域單一卡帶 (Stage 1 / Stage 2 / TTS 共用，依環境變數決定模式)
+_default_cassette = None
+_default_lock = threading.Lock()
+
+
+def get_cassette():
+    global _default_cassette
+    with _default_lock:
+        if _default_cassette is None:
+            _default_cassette = Cassette()
+        return _default_cassette
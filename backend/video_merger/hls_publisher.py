@@ -0,0 +1,189 @@
+import os
+import re
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import imageio_ffmpeg
+
+# ========== 參數設定 ==========
+# 每個 HLS 切片的目標長度 (秒)；串流複製時實際長度取決於關鍵影格
+HLS_SEGMENT_TIME = 6
+# EVENT 播放清單中 TARGETDURATION 不可再變動 (RFC 8216)，固定為此值；超過的切片會重新切割
+HLS_TARGET_DURATION = 10
+HLS_PLAYLIST_NAME = "index.m3u8"
+HLS_SERVER_PORT = 8080
+# 只供本機測試；要讓區網其他裝置觀看時再改為 "0.0.0.0"
+HLS_SERVER_HOST = "127.0.0.1"
+
+FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
+
+EXTINF_RE = re.compile(r"#EXTINF:([\d.]+),\s*\n([^\n#]+)")
+
+
+class HLSPublisher:
+    """
+    漸進式 HLS 發布：每完成一段解說影片就切成 .ts 並追加到 EVENT 播放清單。
+    - 片段可能不依序完成 (平行合併)，publish 會暫存到前面的片段都到齊才寫入，
+      播放清單永遠是連續的時間軸
+    - 每個來源片段之間加 #EXT-X-DISCONTINUITY (各段時間戳從 0 開始)
+    - finish() 加上 #EXT-X-ENDLIST，播放器即知道比賽結束
+    """
+
+    def __init__(self, output_dir, target_duration=HLS_TARGET_DURATION, segment_time=HLS_SEGMENT_TIME):
+        self.output_dir = output_dir
+        self.target_duration = target_duration
+        self.segment_time = segment_time
+        self.playlist_path = os.path.join(output_dir, HLS_PLAYLIST_NAME)
+        self._lock = threading.Lock()
+        self._pending = {}      # 序號 -> 影片路徑 (None = 此段略過)
+        self._next_index = 0
+        self._entries = []      # [(是否不連續, 長度, 檔名)]
+        self._ended = False
+        os.makedirs(output_dir, exist_ok=True)
+        self._write_playlist()
+
+    # ---------- 對外介面 ----------
+    def publish(self, index, video_path):
+        """第 index 段 (從 0 起算) 已完成；video_path 為 None 表示此段略過。"""
+        with self._lock:
+            self._pending[index] = video_path
+            while self._next_index in self._pending:
+                path = self._pending.pop(self._next_index)
+                if path:
+                    try:
+                        self._append_segment(self._next_index, path)
+                    except Exception as e:
+                        print(f"⚠️ [HLS] 第 {self._next_index + 1} 段切片失敗，略過：{e}")
+                self._next_index += 1
+            self._write_playlist()
+
+    def finish(self):
+        with self._lock:
+            self._ended = True
+            self._write_playlist()
+        print(f"🏁 [HLS] 播放清單已結束：{self.playlist_path}")
+
+    # ---------- 內部 ----------
+    def _segment(self, video_path, prefix, reencode=False):
+        """切成 .ts，回傳 [(長度, 檔名)]。reencode 時每 segment_time 秒強制一個關鍵影格。"""
+        work_dir = tempfile.mkdtemp(prefix="hls_", dir=self.output_dir)
+        try:
+            tmp_playlist = os.path.join(work_dir, "part.m3u8")
+            codec = (["-c:v", "libx264", "-preset", "veryfast",
+                      "-force_key_frames", f"expr:gte(t,n_forced*{self.segment_time})", "-c:a", "aac"]
+                     if reencode else ["-c", "copy"])
+            cmd = [
+                FFMPEG_EXE, "-y", "-v", "error", "-i", video_path,
+                *codec, "-f", "hls",
+                "-hls_time", str(self.segment_time), "-hls_list_size", "0",
+                "-hls_segment_filename", os.path.join(self.output_dir, f"{prefix}_%03d.ts"),
+                tmp_playlist,
+            ]
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if proc.returncode != 0:
+                raise RuntimeError(proc.stderr.decode("utf-8", "ignore").strip()[-500:])
+            with open(tmp_playlist, "r", encoding="utf-8") as f:
+                return [(float(d), os.path.basename(uri.strip())) for d, uri in EXTINF_RE.findall(f.read())]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _too_long(self, parts):
+        # RFC 8216：EXTINF 四捨五入後不得超過 TARGETDURATION
+        return [uri for duration, uri in parts if int(duration + 0.5) > self.target_duration]
+
+    def _remove_parts(self, parts):
+        for _, uri in parts:
+            path = os.path.join(self.output_dir, uri)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _append_segment(self, index, video_path):
+        """
+        EVENT 播放清單的 TARGETDURATION 不能變動：
+        串流複製切出超過上限的切片 (關鍵影格間隔太長) 時，改為重新編碼並強制關鍵影格再切一次；仍超過就拒絕此段。
+        """
+        prefix = f"seg{index + 1:04d}"
+        parts = self._segment(video_path, prefix)
+        if self._too_long(parts):
+            print(f"⚠️ [HLS] 第 {index + 1} 段有切片超過 TARGETDURATION {self.target_duration}s，重新編碼後再切")
+            self._remove_parts(parts)
+            parts = self._segment(video_path, prefix, reencode=True)
+            too_long = self._too_long(parts)
+            if too_long:
+                self._remove_parts(parts)
+                raise RuntimeError(f"切片 {too_long} 仍超過 TARGETDURATION {self.target_duration}s")
+
+        for i, (duration, uri) in enumerate(parts):
+            self._entries.append((i == 0 and bool(self._entries), duration, uri))
+        print(f"📡 [HLS] 第 {index + 1} 段已發布 ({len(parts)} 個切片)")
+
+    def _write_playlist(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for discontinuity, duration, uri in self._entries:
+            if discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(uri)
+        if self._ended:
+            lines.append("#EXT-X-ENDLIST")
+
+        # 先寫暫存檔再替換，播放器不會讀到寫一半的清單
+        tmp_path = f"{self.playlist_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.playlist_path)
+
+
+# ========== 本地靜態伺服器 (測試用) ==========
+class _HLSRequestHandler(SimpleHTTPRequestHandler):
+    def end_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if self.path.split("?")[0].endswith(".m3u8"):
+            self.send_header("Cache-Control", "no-cache")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory, port=HLS_SERVER_PORT, host=HLS_SERVER_HOST):
+    """背景執行緒啟動靜態檔案伺服器，回傳 server (呼叫 server.shutdown() 結束)。"""
+    server = ThreadingHTTPServer((host, port), partial(_HLSRequestHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🌐 [HLS] 播放網址：http://{'localhost' if host in ('127.0.0.1', '0.0.0.0') else host}:{port}/{HLS_PLAYLIST_NAME}")
+    return server
+
+
+# ✅ 後端單測模式：邊合併邊發布
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "merge_audio"))
+    from merge_audio import batch_merge_all_segments, MERGE_WORKERS
+
+    video_folder = "D:/Vs.code/AI_Anchor/backend/video_splitter/badminton_segments(1126test)"
+    json_folder = "D:/Vs.code/AI_Anchor/backend/gemini/final_narratives"
+    tts_folder = "D:/Vs.code/AI_Anchor/backend/TextToSpeech/final_tts_google"
+    output_folder = "D:/Vs.code/AI_Anchor/backend/merge_audio/final_output_videos"
+    hls_folder = "D:/Vs.code/AI_Anchor/backend/video_merger/hls"
+
+    publisher = HLSPublisher(hls_folder)
+    server = serve_directory(hls_folder)
+
+    def on_result(index, result):
+        # 沒有旁白或合併失敗的片段改用原始片段，時間軸才不會中斷
+        publisher.publish(index, result.get("output") if result["status"] == "success" else result["segment"])
+
+    batch_merge_all_segments(video_folder, json_folder, tts_folder, output_folder,
+                             workers=MERGE_WORKERS, on_result=on_result)
+    publisher.finish()
+    input("按 Enter 結束伺服器...")
+    server.shutdown()
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+
+# ========== 1. 路徑與共用模組 ==========
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BACKEND_DIR, "merge_audio"))
+from merge_audio import build_voice_placements, FFMPEG_EXE, MUX_AUDIO_BITRATE
+from audio_mixer import decode_audio, mix_tracks, MIX_CHANNELS
+from pcm_audio import MIX_SAMPLE_RATE
+from video_merge import probe_video
+
+# ========== 2. 參數設定 ==========
+SEGMENT_LENGTH = 30            # 與 video_splitter 的 segment_length 一致
+SEGMENT_NAME_FORMAT = "segment_{:03d}"
+
+
+def segment_windows(total_duration, segment_length=SEGMENT_LENGTH):
+    """
+    重現 video_splitter 的切法：[(片段名稱, 開始秒數, 結束秒數)]。
+    切割時捨去的結尾零頭也補成一段 (沒有旁白，只保留現場聲)。
+    """
+    windows = []
+    for i, start in enumerate(range(0, int(total_duration), segment_length)):
+        windows.append((SEGMENT_NAME_FORMAT.format(i + 1), float(start), min(start + segment_length, total_duration)))
+    last_end = windows[-1][2] if windows else 0.0
+    if total_duration - last_end > 1.0 / MIX_SAMPLE_RATE:
+        windows.append((None, last_end, total_duration))
+    return windows
+
+
+def segment_placements(segment_name, json_folder, tts_folder, duration, audio_delay):
+    if not segment_name:
+        return []
+    json_path = os.path.join(json_folder, segment_name + ".json")
+    segment_tts_folder = os.path.join(tts_folder, segment_name)
+    if not os.path.exists(json_path) or not os.path.exists(segment_tts_folder):
+        return []
+    with open(json_path, "r", encoding="utf-8") as f:
+        commentary = json.load(f).get("commentary", [])
+    if not commentary:
+        return []
+    return build_voice_placements(commentary, segment_tts_folder, duration, audio_delay)
+
+
+# ========== 3. 整場單次渲染 ==========
+def render_match(source_video, json_folder, tts_folder, output_video,
+                 segment_length=SEGMENT_LENGTH, audio_delay=0.3, keep_crowd=True):
+    """
+    以原始下載影片直接產生整場解說影片：
+    1. 依片段順序，把每段的旁白 (加上片段起點偏移) 與現場聲混成整場音軌
+    2. 混好的 PCM 直接經管線交給 ffmpeg，與原始視訊串流合併 (-c:v copy)
+    不產生任何 _final.mp4 或暫存檔，整場只有一次音訊編碼、視訊完全不重編。
+    """
+    print(f"🎬 整場渲染：{os.path.basename(source_video)}")
+    t0 = time.perf_counter()
+
+    probe = probe_video(source_video)
+    if not probe["duration"] or probe["video"] is None:
+        msg = f"❌ 無法解析來源影片：{source_video}"
+        print(msg)
+        return {"status": "error", "message": msg}
+    has_crowd = keep_crowd and probe["audio"] is not None
+    windows = segment_windows(probe["duration"], segment_length)
+
+    os.makedirs(os.path.dirname(output_video) or ".", exist_ok=True)
+    cmd = [
+        FFMPEG_EXE, "-y", "-v", "error",
+        "-i", source_video,
+        "-f", "s16le", "-ar", str(MIX_SAMPLE_RATE), "-ac", str(MIX_CHANNELS), "-i", "pipe:0",
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy", "-c:a", "aac", "-b:a", MUX_AUDIO_BITRATE,
+        "-movflags", "+faststart",
+        output_video,
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    narrated, lines, truncated = 0, 0, 0
+    try:
+        for segment_name, start, end in windows:
+            duration = end - start
+            placements = segment_placements(segment_name, json_folder, tts_folder, duration, audio_delay)
+            crowd = (decode_audio(source_video, start=start, duration=duration) if has_crowd
+                     else np.zeros((0, MIX_CHANNELS), dtype=np.float32))
+            loaded = [(decode_audio(path), offset, allowed) for path, offset, allowed, _ in placements]
+            mix, n_truncated = mix_tracks(crowd, loaded, duration)
+
+            proc.stdin.write((mix * 32767.0).astype("<i2").tobytes())
+            if placements:
+                narrated += 1
+                lines += len(placements)
+                truncated += n_truncated
+        proc.stdin.close()
+    except Exception as e:
+        proc.kill()
+        proc.wait()
+        if os.path.exists(output_video):
+            os.remove(output_video)
+        msg = f"❌ 整場渲染失敗：{e}"
+        print(msg)
+        return {"status": "error", "message": msg}
+
+    stderr = proc.stderr.read().decode("utf-8", "ignore")
+    if proc.wait() != 0:
+        msg = f"❌ ffmpeg 合併失敗：{stderr.strip()[-500:]}"
+        print(msg)
+        return {"status": "error", "message": msg}
+
+    elapsed = time.perf_counter() - t0
+    print(f"🎉 ✅ 整場渲染完成 ({elapsed:.1f}s，{narrated}/{len(windows)} 段有旁白，共 {lines} 句)：{output_video}")
+    return {
+        "status": "success",
+        "output_video": output_video,
+        "total_segments": len(windows),
+        "narrated_segments": narrated,
+        "lines": lines,
+        "truncated_lines": truncated,
+        "total_duration": probe["duration"],
+        "elapsed": round(elapsed, 2),
+    }
+
+
+# ✅ 後端單測模式
+if __name__ == "__main__":
+    source_video = "D:/Vs.code/AI_Anchor/backend/video_download/download/videoplayback (1).mp4"
+    json_folder = "D:/Vs.code/AI_Anchor/backend/gemini/final_narratives"
+    tts_folder = "D:/Vs.code/AI_Anchor/backend/TextToSpeech/final_tts_google"
+    output_video = "D:/Vs.code/AI_Anchor/backend/video_merger/output/badminton_final_match.mp4"
+
+    result = render_match(source_video, json_folder, tts_folder, output_video)
+    print(result)
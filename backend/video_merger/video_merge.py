@@ -1,18 +1,243 @@
 import os
+import re
 import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import Counter
+import imageio_ffmpeg
 from moviepy.editor import VideoFileClip, concatenate_videoclips
 
-def merge_videos(input_folder, output_video):
+# ========== 參數設定 ==========
+# 合併方式："copy" 以 ffmpeg concat demuxer 串流複製 (秒級完成)；"reencode" 為舊版 MoviePy 全片重編
+MERGE_MODE = "copy"
+VIDEO_EXTS = ('.mp4', '.webm', '.avi', '.mov')
+# 參數不相容的片段重新編碼時使用的品質
+NORMALIZE_CRF = 18
+NORMALIZE_PRESET = "veryfast"
+NORMALIZE_AUDIO_BITRATE = "192k"
+
+FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def list_video_files(input_folder):
+    return sorted([
+        f for f in os.listdir(input_folder)
+        if f.lower().endswith(VIDEO_EXTS)
+    ])
+
+
+# ========== 串流參數檢查 (解析 ffmpeg -i 的輸出，不需要 ffprobe) ==========
+def _split_top_level(text):
+    """以逗號切開，但忽略括號內的逗號：'yuv420p(tv, bt709), 1920x1080' -> ['yuv420p(tv, bt709)', '1920x1080']"""
+    parts, depth, current = [], 0, ""
+    for ch in text:
+        if ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _parse_rate(value):
+    """'30' / '29.97' / '15.36k' -> float"""
+    if value is None:
+        return None
+    return float(value[:-1]) * 1000 if value.endswith("k") else float(value)
+
+
+def probe_video(path):
+    """
+    回傳串流參數：
+    {"duration", "video": {codec, profile, pix_fmt, width, height, fps, tbn} 或 None,
+     "audio": {codec, sample_rate, channels} 或 None}
+    """
+    proc = subprocess.run([FFMPEG_EXE, "-hide_banner", "-i", path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    info = proc.stderr.decode("utf-8", "ignore")
+
+    duration = None
+    m = re.search(r"Duration: (\d+):(\d+):([\d.]+)", info)
+    if m:
+        duration = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+
+    video = audio = None
+    for line in info.splitlines():
+        m = re.search(r"Stream #\d+:\d+.*?: (Video|Audio): (.*)", line)
+        if not m:
+            continue
+        fields = _split_top_level(m.group(2))
+        codec = fields[0].split()[0]
+        profile = re.search(r"\(([^)/]+)\)", fields[0])
+        profile = profile.group(1) if profile else None
+
+        if m.group(1) == "Video" and video is None:
+            size = re.search(r"(\d{2,})x(\d{2,})", m.group(2))
+            fps = re.search(r"([\d.]+k?) fps", m.group(2))
+            tbn = re.search(r"([\d.]+k?) tbn", m.group(2))
+            video = {
+                "codec": codec,
+                "profile": profile,
+                "pix_fmt": fields[1].split("(")[0] if len(fields) > 1 else None,
+                "width": int(size.group(1)) if size else None,
+                "height": int(size.group(2)) if size else None,
+                "fps": _parse_rate(fps.group(1)) if fps else None,
+                "tbn": _parse_rate(tbn.group(1)) if tbn else None,
+            }
+        elif m.group(1) == "Audio" and audio is None:
+            rate = re.search(r"(\d+) Hz", m.group(2))
+            audio = {
+                "codec": codec,
+                "sample_rate": int(rate.group(1)) if rate else None,
+                "channels": fields[2] if len(fields) > 2 else None,
+            }
+
+    return {"duration": duration, "video": video, "audio": audio}
+
+
+def stream_signature(probe):
+    """concat demuxer 串流複製時必須一致的參數。"""
+    v, a = probe["video"] or {}, probe["audio"] or {}
+    return (
+        v.get("codec"), v.get("profile"), v.get("pix_fmt"), v.get("width"), v.get("height"), v.get("fps"), v.get("tbn"),
+        a.get("codec"), a.get("sample_rate"), a.get("channels"),
+    )
+
+
+# ========== 不相容片段：只重編這幾段，參數對齊多數片段 ==========
+def normalize_segment(path, reference, output_path):
+    v, a = reference["video"], reference["audio"]
+    if v["codec"] != "h264" or (a and a["codec"] != "aac"):
+        raise RuntimeError(f"不支援對齊到 {v['codec']} / {a and a['codec']}")
+
+    cmd = [FFMPEG_EXE, "-y", "-v", "error", "-i", path]
+    has_audio = probe_video(path)["audio"] is not None
+    if a and not has_audio:
+        # 沒有音軌的片段補上靜音，否則串接後音軌會錯位
+        layout = a["channels"] if a["channels"] in ("mono", "stereo") else "stereo"
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=r={a['sample_rate']}:cl={layout}", "-shortest"]
+    cmd += ["-map", "0:v:0"]
+    if a:
+        cmd += ["-map", "0:a:0" if has_audio else "1:a:0"]
+
+    vf = f"scale={v['width']}:{v['height']}"
+    if v["fps"]:
+        vf += f",fps={v['fps']}"
+    cmd += ["-vf", vf, "-c:v", "libx264", "-preset", NORMALIZE_PRESET, "-crf", str(NORMALIZE_CRF),
+            "-pix_fmt", v["pix_fmt"]]
+    if v["profile"]:
+        cmd += ["-profile:v", v["profile"].lower().replace("constrained ", "")]
+    if v["tbn"]:
+        cmd += ["-video_track_timescale", str(int(v["tbn"]))]
+    if a:
+        cmd += ["-c:a", "aac", "-b:a", NORMALIZE_AUDIO_BITRATE, "-ar", str(a["sample_rate"])]
+        if a["channels"] in ("mono", "stereo"):
+            cmd += ["-ac", "1" if a["channels"] == "mono" else "2"]
+    cmd.append(output_path)
+
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", "ignore").strip()[-500:])
+    return output_path
+
+
+# ========== 串流複製合併 (concat demuxer) ==========
+def merge_videos_stream_copy(input_folder, output_video):
+    """
+    1. 解析每個片段的串流參數，以出現最多的參數組合為準
+    2. 不相容的片段個別重新編碼對齊 (只重編這幾段)
+    3. ffmpeg concat demuxer 以 -c copy 串接，不解碼
+    """
+    t0 = time.perf_counter()
+    video_files = list_video_files(input_folder)
+    if not video_files:
+        raise RuntimeError("沒有找到任何影片")
+
+    paths = [os.path.join(input_folder, f) for f in video_files]
+    probes = [probe_video(p) for p in paths]
+    for f, probe in zip(video_files, probes):
+        if probe["video"] is None:
+            raise RuntimeError(f"無法解析視訊串流：{f}")
+
+    signatures = [stream_signature(p) for p in probes]
+    reference_sig = Counter(signatures).most_common(1)[0][0]
+    reference = probes[signatures.index(reference_sig)]
+
+    work_dir = tempfile.mkdtemp(prefix="concat_", dir=os.path.dirname(output_video) or None)
+    try:
+        concat_paths, reencoded = [], []
+        for f, path, sig in zip(video_files, paths, signatures):
+            if sig == reference_sig:
+                concat_paths.append(path)
+                continue
+            print(f"🔧 參數不相容，重新編碼：{f}")
+            concat_paths.append(normalize_segment(path, reference, os.path.join(work_dir, f"{len(reencoded):04d}.mp4")))
+            reencoded.append(f)
+
+        list_path = os.path.join(work_dir, "concat.txt")
+        with open(list_path, "w", encoding="utf-8") as lf:
+            for p in concat_paths:
+                escaped = os.path.abspath(p).replace("\\", "/").replace("'", "'\\''")
+                lf.write(f"file '{escaped}'\n")
+
+        cmd = [FFMPEG_EXE, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+               "-map", "0", "-c", "copy", "-movflags", "+faststart", output_video]
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.decode("utf-8", "ignore").strip()[-500:])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total_duration = sum(p["duration"] or 0.0 for p in probes)
+    return {
+        "status": "success",
+        "output_video": output_video,
+        "total_segments": len(video_files),
+        "total_duration": total_duration,
+        "mode": "copy",
+        "reencoded_segments": reencoded,
+        "elapsed": round(time.perf_counter() - t0, 2),
+    }
+
+
+def merge_videos(input_folder, output_video, mode=None):
     """
     將資料夾中的影片合併為一個影片，回傳執行結果。
+    mode："copy" (預設取 MERGE_MODE) 先嘗試串流複製，失敗時退回 MoviePy 重新編碼。
     """
     print(f"📁 開始合併資料夾：{input_folder}")
+    mode = mode or MERGE_MODE
 
+    # 🆕 確保輸出目錄存在 (只給檔名時輸出到目前目錄)
     try:
-        video_files = sorted([
-            f for f in os.listdir(input_folder)
-            if f.lower().endswith(('.mp4', '.webm', '.avi', '.mov'))
-        ])
+        os.makedirs(os.path.dirname(output_video) or ".", exist_ok=True)
+    except Exception as e:
+        print(f"❌ 合併時發生錯誤：{e}")
+        return {"status": "error", "message": str(e)}
+
+    if mode == "copy":
+        try:
+            result = merge_videos_stream_copy(input_folder, output_video)
+            reencoded = result["reencoded_segments"]
+            print(f"🎉 ✅ 串流複製合併完成 ({result['elapsed']:.1f}s，重新編碼 {len(reencoded)} 段)：{output_video}")
+            return result
+        except Exception as e:
+            print(f"⚠️ 串流複製合併失敗，改用 MoviePy 重新編碼：{e}")
+
+    return merge_videos_reencode(input_folder, output_video)
+
+
+def merge_videos_reencode(input_folder, output_video):
+    """舊版：以 MoviePy 開啟所有片段後整段重新編碼。"""
+    try:
+        video_files = list_video_files(input_folder)
 
         if not video_files:
             msg = "❌ 沒有找到任何影片，請檢查資料夾與副檔名！"
@@ -39,10 +264,6 @@ def merge_videos(input_folder, output_video):
         total_duration = sum([clip.duration for clip in clips])
         print(f"🕒 合併後總時長預估：{total_duration:.2f} 秒")
 
-        # 🆕 確保輸出目錄存在
-        output_dir = os.path.dirname(output_video)
-        os.makedirs(output_dir, exist_ok=True)
-
         final_clip = concatenate_videoclips(clips, method="compose")
         final_clip.write_videofile(output_video, codec="libx264", audio_codec="aac")
 
@@ -57,7 +278,8 @@ def merge_videos(input_folder, output_video):
             "status": "success",
             "output_video": output_video,
             "total_segments": len(video_files),
-            "total_duration": total_duration
+            "total_duration": total_duration,
+            "mode": "reencode"
         }
 
     except Exception as e: